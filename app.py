@@ -1,116 +1,3397 @@
+import ast
+import atexit
+import base64
+import bisect
+import cProfile
+import csv
+import functools
+import glob
+import hashlib
+import io
+import itertools
+import json
+import math
+import os
+import re
+import shutil
 import sqlite3
-from datetime import datetime, date
-from flask import Flask, render_template_string, request, redirect, url_for, flash
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
+from decimal import Decimal, InvalidOperation
+
+import click
+from flask import (Flask, Response, render_template, request, redirect, url_for, flash, g, jsonify,
+                   send_file, has_app_context, has_request_context)
+from flask.cli import AppGroup
+from jinja2 import DictLoader
 
 app = Flask(__name__)
 # Required for flash messages
 app.secret_key = 'corporate_secret_key_change_in_production'
-DB_NAME = "billing_system.db"
+# Overridable so benchmarks and scratch runs never touch the real ledger
+DB_NAME = os.environ.get('BILLING_DB', "billing_system.db")
+
+# Applied to every connection as it is opened. WAL lets readers run alongside
+# the single writer, and busy_timeout makes writers queue instead of failing
+# straight away with "database is locked".
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,  # negative = KiB, i.e. ~16 MB page cache
+    'temp_store': 'MEMORY',
+}
+# Keep connections open between requests; False restores open-per-request
+app.config['SQLITE_POOL_CONNECTIONS'] = True
+app.config['SQLITE_POOL_MAX_IDLE'] = 16
+# Per-request SQL timing for /metrics and Server-Timing (see INSTRUMENTATION)
+app.config['SQL_TRACE'] = os.environ.get('BILLING_SQL_TRACE', '1') != '0'
+
+# ==========================================
+# MONEY (integer minor units)
+# ==========================================
+
+# Amounts are stored, added up and compared as integer cents. Rounding only
+# happens where a fraction of a cent can appear (parsing input, tax) and
+# uses MONEY_ROUNDING, any decimal module rounding mode name.
+app.config['MONEY_ROUNDING'] = os.environ.get('BILLING_MONEY_ROUNDING', 'ROUND_HALF_UP')
+
+CENT = Decimal('0.01')
+# Largest amount accepted anywhere (a trillion currency units); sums of many such
+# amounts still fit SQLite's 64-bit INTEGER
+MAX_CENTS = 10 ** 14
+MAX_TAX_RATE = 100
+# "12", "-3.5", "19.99": whole cents already, converted without Decimal
+_PLAIN_AMOUNT = re.compile(r'(-?)(\d+)(?:\.(\d{0,2}))?')
+
+
+def to_cents(value):
+    """
+    Cents for an amount given as str, int, float or Decimal; ValueError if it
+    isn't one or is larger than MAX_CENTS either way.
+    """
+    if isinstance(value, float):
+        value = repr(value)  # shortest round-trip form: 19.99, not 19.989999...
+    if isinstance(value, str):
+        match = _PLAIN_AMOUNT.fullmatch(value.strip())
+        if match:
+            sign, units, fraction = match.groups()
+            cents = int(units) * 100 + int((fraction or '').ljust(2, '0'))
+            if cents > MAX_CENTS:
+                raise ValueError(f'Amount too large: {value!r}')
+            return -cents if sign else cents
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f'Not an amount: {value!r}') from None
+    if not amount.is_finite():
+        raise ValueError(f'Not an amount: {value!r}')
+    if abs(amount) > MAX_CENTS // 100:
+        raise ValueError(f'Amount too large: {value!r}')
+    try:
+        return int(amount.quantize(CENT, rounding=app.config['MONEY_ROUNDING']).scaleb(2))
+    except InvalidOperation:
+        raise ValueError(f'Not an amount: {value!r}') from None
+
+
+def from_cents(cents):
+    """Cents as a float in currency units, for templates, JSON and the REAL mirrors."""
+    return cents / 100
+
+
+def parse_tax_rate(value):
+    """A percentage tax rate from form or import input; ValueError unless 0 <= rate <= MAX_TAX_RATE."""
+    try:
+        rate = float(value or 0)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('Tax rate must be a number.') from None
+    if not math.isfinite(rate):
+        raise ValueError('Tax rate must be a number.')
+    if rate < 0:
+        raise ValueError('Tax rate cannot be negative.')
+    if rate > MAX_TAX_RATE:
+        raise ValueError(f'Tax rate cannot be more than {MAX_TAX_RATE}%.')
+    return rate
+
+
+@functools.lru_cache(maxsize=256)
+def _tax_ratio(tax_rate):
+    """A percentage rate as an exact integer fraction of one: 7.5 -> (15, 200)."""
+    rate = Decimal(repr(tax_rate)) if isinstance(tax_rate, float) else Decimal(str(tax_rate))
+    numerator, denominator = rate.as_integer_ratio()
+    return numerator, denominator * 100
+
+
+def tax_cents(subtotal_cents, tax_rate):
+    """Tax at a percentage rate, rounded once to a whole cent."""
+    numerator, denominator = _tax_ratio(tax_rate)
+    rounding = app.config['MONEY_ROUNDING']
+    if rounding in ('ROUND_HALF_UP', 'ROUND_HALF_EVEN') and subtotal_cents >= 0 and numerator >= 0:
+        # The usual modes in pure integer maths; anything else goes through Decimal
+        tax, remainder = divmod(subtotal_cents * numerator, denominator)
+        if 2 * remainder > denominator or (2 * remainder == denominator
+                                           and (rounding == 'ROUND_HALF_UP' or tax % 2)):
+            tax += 1
+        return tax
+    return int((Decimal(subtotal_cents * numerator) / denominator).quantize(Decimal(1), rounding=rounding))
+
+# ==========================================
+# DATABASE LAYER (Robust & Migratable)
+# ==========================================
+
+
+# The RequestTrace of the request running on this thread, if any; traced
+# connections add every statement's time to it (see INSTRUMENTATION).
+_active_trace = threading.local()
+
+
+def _traced(method):
+    def call(self, sql, *args):
+        trace = getattr(_active_trace, 'trace', None)
+        if trace is None:
+            return method(self, sql, *args)
+        start = time.perf_counter()
+        try:
+            return method(self, sql, *args)
+        finally:
+            trace.record_sql(sql, time.perf_counter() - start)
+    return call
+
+
+class TracedCursor(sqlite3.Cursor):
+    execute = _traced(sqlite3.Cursor.execute)
+    executemany = _traced(sqlite3.Cursor.executemany)
+
+
+class TracedConnection(sqlite3.Connection):
+    """
+    Times each statement into the current request's trace. Only the execute
+    step is measured; rows fetched lazily afterwards are not.
+    """
+    execute = _traced(sqlite3.Connection.execute)
+    executemany = _traced(sqlite3.Connection.executemany)
+    executescript = _traced(sqlite3.Connection.executescript)
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+
+def get_db_connection():
+    """Open a new connection with the configured pragma profile applied."""
+    # Pooled connections may be released by one thread and picked up by the
+    # next; each is only ever used by one thread at a time.
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False,
+                           factory=TracedConnection if app.config['SQL_TRACE'] else sqlite3.Connection)
+    conn.row_factory = sqlite3.Row
+    for pragma, value in app.config['SQLITE_PRAGMAS'].items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+    return conn
+
+
+class ConnectionPool:
+    """
+    Idle connections shared by request threads. A thread checks one out the
+    first time it needs the database inside an app context and hands it back
+    on teardown, so steady-state requests never pay for connect + pragmas.
+    """
+
+    def __init__(self):
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return get_db_connection()
+
+    def release(self, conn, discard=False):
+        if conn.in_transaction:
+            conn.rollback()  # never leak a half-finished write to the next request
+        if not discard and app.config['SQLITE_POOL_CONNECTIONS']:
+            with self._lock:
+                if len(self._idle) < app.config['SQLITE_POOL_MAX_IDLE']:
+                    self._idle.append(conn)
+                    return
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+db_pool = ConnectionPool()
+atexit.register(db_pool.close_all)
+
+
+def get_db():
+    """Connection bound to the current app context (one per thread)."""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+
+@contextmanager
+def write_transaction(conn):
+    """
+    BEGIN IMMEDIATE ... COMMIT. Taking the write lock up front means a busy
+    database makes us wait at BEGIN (honouring busy_timeout) instead of
+    failing halfway through with "database is locked".
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        # A connection that saw an exception is dropped rather than reused
+        db_pool.release(conn, discard=exc is not None)
+
+
+def _table_columns(c, table):
+    return {row[1] for row in c.execute(f'PRAGMA table_info({table})')}
+
+
+def _migrate_baseline(c):
+    """Tables, columns added by pre-versioned releases, and the seed catalog."""
+    c.execute('''CREATE TABLE IF NOT EXISTS products (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    sku TEXT,
+                    category TEXT,
+                    price REAL NOT NULL
+                )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS invoices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    customer_name TEXT NOT NULL,
+                    customer_email TEXT,
+                    date TEXT NOT NULL,
+                    due_date TEXT,
+                    status TEXT DEFAULT 'Pending',
+                    subtotal REAL DEFAULT 0.0,
+                    tax_rate REAL DEFAULT 0.0,
+                    tax_amount REAL DEFAULT 0.0,
+                    total_amount REAL NOT NULL
+                )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS invoice_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    invoice_id INTEGER,
+                    product_name TEXT,
+                    quantity INTEGER,
+                    price REAL,
+                    subtotal REAL,
+                    FOREIGN KEY(invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
+                )''')
+
+    # Databases created before versioning may be missing later columns
+    legacy_columns = [
+        ('products', 'sku', 'TEXT'),
+        ('products', 'category', 'TEXT'),
+        ('invoices', 'due_date', 'TEXT'),
+        ('invoices', 'status', "TEXT DEFAULT 'Pending'"),
+        ('invoices', 'subtotal', 'REAL DEFAULT 0.0'),
+        ('invoices', 'tax_rate', 'REAL DEFAULT 0.0'),
+        ('invoices', 'tax_amount', 'REAL DEFAULT 0.0'),
+        ('invoices', 'customer_email', 'TEXT'),
+    ]
+    for table, column, definition in legacy_columns:
+        if column not in _table_columns(c, table):
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            print(f"Migrated: Added {column} to {table}")
+
+    c.execute('SELECT count(*) FROM products')
+    if c.fetchone()[0] == 0:
+        products = [
+            ('Enterprise Laptop X1', 'HW-001', 'Hardware', 1299.99),
+            ('Wireless Ergonomic Mouse', 'ACC-055', 'Accessories', 45.50),
+            ('Mechanical Keyboard', 'ACC-089', 'Accessories', 85.00),
+            ('IT Consultation (Hourly)', 'SVC-101', 'Services', 150.00),
+            ('Software License (Annual)', 'SW-500', 'Software', 599.00)
+        ]
+        c.executemany(
+            'INSERT INTO products (name, sku, category, price) VALUES (?, ?, ?, ?)', products)
+        print("Database seeded with enterprise catalog.")
+
+
+def _migrate_lookup_indexes(c):
+    """Index the columns the invoice views and KPI queries filter on."""
+    c.execute('CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_id ON invoice_items(invoice_id)')
+    # Covering index: the KPI sums read status + total without touching rows
+    c.execute('CREATE INDEX IF NOT EXISTS idx_invoices_status_total ON invoices(status, total_amount)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_invoices_customer_name ON invoices(customer_name COLLATE NOCASE)')
+
+
+# Money columns the aggregates are built from: REAL amounts up to schema v11,
+# integer cents from v12 on (see _migrate_money_cents).
+_REAL_MONEY = {'subtotal': 'subtotal', 'tax': 'tax_amount', 'total': 'total_amount', 'revenue': 'revenue'}
+_CENTS_MONEY = {'subtotal': 'subtotal_cents', 'tax': 'tax_cents', 'total': 'total_cents',
+                'revenue': 'revenue_cents'}
+
+
+def rebuild_kpi_totals(c, money=_CENTS_MONEY, source='invoices'):
+    """Recompute the dashboard totals from scratch (also the initial backfill)."""
+    c.execute('DELETE FROM invoice_status_totals')
+    c.execute('''INSERT INTO invoice_status_totals (status, invoice_count, {total})
+                 SELECT IFNULL(status, ''), count(*), IFNULL(SUM({total}), 0)
+                 FROM {source} GROUP BY IFNULL(status, '')'''.format(source=source, **money))
+    c.execute('INSERT OR REPLACE INTO catalog_totals (id, product_count) '
+              'SELECT 1, count(*) FROM products')
+
+
+# From v16 a row leaves invoices only once it is soft-deleted (already taken out
+# of the aggregates by trg_invoice_soft_delete) or archived (kept in them as
+# history), so the delete triggers only act on rows that are neither.
+_LIVE_DELETE = 'WHEN old.deleted_at IS NULL AND old.archived_at IS NULL'
+
+
+def _create_kpi_triggers(c, money, live=False):
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_kpi_invoice_insert AFTER INSERT ON invoices
+                 BEGIN
+                    INSERT INTO invoice_status_totals (status, invoice_count, {total})
+                    VALUES (IFNULL(new.status, ''), 1, IFNULL(new.{total}, 0))
+                    ON CONFLICT(status) DO UPDATE SET
+                        invoice_count = invoice_count + 1,
+                        {total} = {total} + excluded.{total};
+                 END'''.format(**money))
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_kpi_invoice_delete AFTER DELETE ON invoices {when}
+                 BEGIN
+                    UPDATE invoice_status_totals
+                    SET invoice_count = invoice_count - 1,
+                        {total} = {total} - IFNULL(old.{total}, 0)
+                    WHERE status = IFNULL(old.status, '');
+                 END'''.format(when=_LIVE_DELETE if live else '', **money))
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_kpi_invoice_update AFTER UPDATE OF status, {total} ON invoices
+                 WHEN old.status IS NOT new.status OR old.{total} IS NOT new.{total}
+                 BEGIN
+                    UPDATE invoice_status_totals
+                    SET invoice_count = invoice_count - 1,
+                        {total} = {total} - IFNULL(old.{total}, 0)
+                    WHERE status = IFNULL(old.status, '');
+                    INSERT INTO invoice_status_totals (status, invoice_count, {total})
+                    VALUES (IFNULL(new.status, ''), 1, IFNULL(new.{total}, 0))
+                    ON CONFLICT(status) DO UPDATE SET
+                        invoice_count = invoice_count + 1,
+                        {total} = {total} + excluded.{total};
+                 END'''.format(**money))
+
+
+def _migrate_kpi_totals(c):
+    """
+    Per-status invoice counts/sums and the product count, kept current by
+    triggers so every write path updates them inside its own transaction.
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS invoice_status_totals (
+                    status TEXT PRIMARY KEY,
+                    invoice_count INTEGER NOT NULL DEFAULT 0,
+                    total_amount REAL NOT NULL DEFAULT 0
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS catalog_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    product_count INTEGER NOT NULL DEFAULT 0
+                )''')
+
+    _create_kpi_triggers(c, _REAL_MONEY)
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_kpi_product_insert AFTER INSERT ON products
+                 BEGIN
+                    UPDATE catalog_totals SET product_count = product_count + 1 WHERE id = 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_kpi_product_delete AFTER DELETE ON products
+                 BEGIN
+                    UPDATE catalog_totals SET product_count = product_count - 1 WHERE id = 1;
+                 END''')
+
+    rebuild_kpi_totals(c, _REAL_MONEY)
+
+
+def load_kpis(conn):
+    """Dashboard figures from the maintained totals: a handful of rows, not a scan."""
+    kpis = {'total_revenue': 0.0, 'pending_amount': 0.0, 'pending_count': 0,
+            'overdue_amount': 0.0, 'overdue_count': 0, 'invoice_count': 0, 'archived_count': 0}
+    revenue_cents = 0
+    for row in conn.execute('SELECT status, invoice_count, total_cents, paid_cents, archived_count '
+                            'FROM invoice_status_totals'):
+        kpis['invoice_count'] += row['invoice_count']
+        kpis['archived_count'] += row['archived_count']
+        # Same rule as the old SUM ... WHERE status != 'Draft' (NULL status excluded)
+        if row['status'] not in ('Draft', ''):
+            revenue_cents += row['total_cents']
+        # Open amounts are what is still owed after part-payments
+        if row['status'] == 'Pending':
+            kpis['pending_amount'] = from_cents(row['total_cents'] - row['paid_cents'])
+            kpis['pending_count'] = row['invoice_count']
+        elif row['status'] == 'Overdue':
+            kpis['overdue_amount'] = from_cents(row['total_cents'] - row['paid_cents'])
+            kpis['overdue_count'] = row['invoice_count']
+    kpis['total_revenue'] = from_cents(revenue_cents)
+    row = conn.execute('SELECT product_count FROM catalog_totals WHERE id = 1').fetchone()
+    kpis['product_count'] = row['product_count'] if row else 0
+    return kpis
+
+
+def check_kpi_totals(conn):
+    """Return (key, stored, actual) for every maintained total that has drifted."""
+    stored = {r['status']: (r['invoice_count'], r['total_cents'], r['paid_cents'], r['archived_count'])
+              for r in conn.execute('SELECT * FROM invoice_status_totals')}
+    invoices, _ = invoice_sources(conn, archive=True)
+    actual = {r[0]: (r[1], r[2], r[3], r[4]) for r in conn.execute(
+        "SELECT IFNULL(status, ''), count(*), IFNULL(SUM(total_cents), 0), IFNULL(SUM(paid_cents), 0), "
+        f"count(archived_at) FROM {invoices} GROUP BY IFNULL(status, '')")}
+    mismatches = []
+    for status in sorted(set(stored) | set(actual)):
+        if stored.get(status, (0, 0, 0, 0)) != actual.get(status, (0, 0, 0, 0)):
+            mismatches.append((f'status={status!r}', stored.get(status), actual.get(status)))
+    stored_products = conn.execute('SELECT product_count FROM catalog_totals WHERE id = 1').fetchone()
+    actual_products = conn.execute('SELECT count(*) FROM products').fetchone()[0]
+    if stored_products is None or stored_products[0] != actual_products:
+        mismatches.append(('product_count', stored_products and stored_products[0], actual_products))
+    return mismatches
+
+
+def _migrate_status_paging_index(c):
+    """Lets a status-filtered dashboard page seek straight to WHERE status = ? AND id < ?."""
+    c.execute('CREATE INDEX IF NOT EXISTS idx_invoices_status_id ON invoices(status, id)')
+
+
+def refresh_invoice_search_items(conn, invoice_ids):
+    """
+    Re-index the line-item names of the given invoices. Triggers keep the
+    customer columns in sync; writers that add invoice_items call this once
+    per batch, which avoids rewriting the FTS row for every single line.
+    """
+    ids = list(invoice_ids)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        conn.execute(f'''UPDATE invoice_search SET item_names = (
+                             SELECT IFNULL(group_concat(product_name, ' '), '')
+                             FROM invoice_items WHERE invoice_id = invoice_search.rowid)
+                         WHERE rowid IN ({', '.join('?' * len(chunk))})''', chunk)
+
+
+def _migrate_invoice_search(c):
+    """FTS5 index over customer name/email and line-item names (rowid = invoice id)."""
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search USING fts5(
+                    customer_name, customer_email, item_names,
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '2 3'
+                )''')
+    # Name hits outrank email hits, which outrank line-item hits
+    c.execute("INSERT INTO invoice_search (invoice_search, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')")
+
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_search_invoice_insert AFTER INSERT ON invoices
+                 BEGIN
+                    INSERT INTO invoice_search (rowid, customer_name, customer_email, item_names)
+                    VALUES (new.id, new.customer_name, new.customer_email, '');
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_search_invoice_update
+                 AFTER UPDATE OF customer_name, customer_email ON invoices
+                 BEGIN
+                    UPDATE invoice_search SET customer_name = new.customer_name,
+                                              customer_email = new.customer_email
+                    WHERE rowid = new.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_search_invoice_delete AFTER DELETE ON invoices
+                 BEGIN
+                    DELETE FROM invoice_search WHERE rowid = old.id;
+                 END''')
+
+    c.execute('''INSERT INTO invoice_search (rowid, customer_name, customer_email, item_names)
+                 SELECT i.id, i.customer_name, i.customer_email,
+                        (SELECT IFNULL(group_concat(product_name, ' '), '')
+                         FROM invoice_items WHERE invoice_id = i.id)
+                 FROM invoices i''')
+
+
+def _migrate_invoice_date_index(c):
+    """Date-range exports walk invoices in date order straight off this index."""
+    c.execute('CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(date)')
+
+
+def _migrate_row_versions(c):
+    """
+    row_version on products/invoices and a per-table version counter, all
+    bumped by triggers. They back the API's ETags and the catalog cache, so
+    "has anything changed?" is a primary-key read.
+    """
+    for table in ('products', 'invoices'):
+        if 'row_version' not in _table_columns(c, table):
+            c.execute(f'ALTER TABLE {table} ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1')
+    c.execute('''CREATE TABLE IF NOT EXISTS table_versions (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )''')
+    c.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('products', 1), ('invoices', 1)")
+    for table in ('products', 'invoices'):
+        bump = f"UPDATE table_versions SET version = version + 1 WHERE name = '{table}';"
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_version_{table}_insert AFTER INSERT ON {table}
+                      BEGIN {bump} END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_version_{table}_delete AFTER DELETE ON {table}
+                      BEGIN {bump} END''')
+        # The WHEN guard skips the trigger's own row_version write
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_version_{table}_update AFTER UPDATE ON {table}
+                      WHEN new.row_version = old.row_version
+                      BEGIN
+                         UPDATE {table} SET row_version = old.row_version + 1 WHERE id = new.id;
+                         {bump}
+                      END''')
+
+
+def table_version(conn, name):
+    row = conn.execute('SELECT version FROM table_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def _migrate_jobs(c):
+    """Durable queue for background work (see BACKGROUND JOBS)."""
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL DEFAULT '{}',
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 3,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER,
+                    result TEXT,
+                    error TEXT,
+                    run_after REAL NOT NULL,
+                    locked_by TEXT,
+                    locked_at REAL,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, run_after)')
+
+
+def _migrate_recurring_invoices(c):
+    """Recurring invoice templates and the ledger of periods already billed."""
+    c.execute('''CREATE TABLE IF NOT EXISTS recurring_invoices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    customer_name TEXT NOT NULL,
+                    customer_email TEXT,
+                    tax_rate REAL NOT NULL DEFAULT 0,
+                    interval_months INTEGER NOT NULL DEFAULT 1,
+                    due_days INTEGER NOT NULL DEFAULT 30,
+                    start_date TEXT NOT NULL,
+                    next_run_date TEXT NOT NULL,
+                    runs INTEGER NOT NULL DEFAULT 0,
+                    active INTEGER NOT NULL DEFAULT 1,
+                    created_at TEXT
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS recurring_invoice_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recurring_id INTEGER NOT NULL REFERENCES recurring_invoices(id) ON DELETE CASCADE,
+                    product_name TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    price REAL NOT NULL
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS recurring_invoice_runs (
+                    recurring_id INTEGER NOT NULL REFERENCES recurring_invoices(id) ON DELETE CASCADE,
+                    period TEXT NOT NULL,
+                    invoice_id INTEGER,
+                    PRIMARY KEY (recurring_id, period)
+                ) WITHOUT ROWID''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_recurring_items_recurring_id ON recurring_invoice_items(recurring_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_recurring_due ON recurring_invoices(active, next_run_date)')
+
+
+def _migrate_overdue_sweep(c):
+    """Index for the Pending -> Overdue sweep, plus a log of what each sweep changed."""
+    c.execute('CREATE INDEX IF NOT EXISTS idx_invoices_status_due ON invoices(status, due_date)')
+    c.execute('''CREATE TABLE IF NOT EXISTS overdue_sweeps (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ran_at TEXT NOT NULL,
+                    as_of TEXT NOT NULL,
+                    trigger TEXT NOT NULL,
+                    changed INTEGER NOT NULL,
+                    seconds REAL
+                )''')
+
+
+# Report rollups: each statement applies one invoice's (or line's) figures
+# with a sign, so insert/delete/update triggers are the same UPSERT with
+# {sign} = +/- and {row} = new/old; money columns come from _*_MONEY.
+_ROLLUP_INVOICE_SQL = (
+    '''INSERT INTO revenue_daily (day, status, invoice_count, {subtotal}, {tax}, {total})
+       VALUES (IFNULL({row}.date, ''), IFNULL({row}.status, ''), {sign}1, {sign}IFNULL({row}.{subtotal}, 0),
+               {sign}IFNULL({row}.{tax}, 0), {sign}IFNULL({row}.{total}, 0))
+       ON CONFLICT(day, status) DO UPDATE SET
+           invoice_count = invoice_count + excluded.invoice_count,
+           {subtotal} = {subtotal} + excluded.{subtotal},
+           {tax} = {tax} + excluded.{tax},
+           {total} = {total} + excluded.{total};''',
+    '''INSERT INTO customer_revenue (customer_name, status, invoice_count, {total})
+       VALUES ({row}.customer_name, IFNULL({row}.status, ''), {sign}1, {sign}IFNULL({row}.{total}, 0))
+       ON CONFLICT(customer_name, status) DO UPDATE SET
+           invoice_count = invoice_count + excluded.invoice_count,
+           {total} = {total} + excluded.{total};''',
+)
+# Lines roll up under their invoice's month and status
+_ROLLUP_INVOICE_LINES_SQL = '''
+    INSERT INTO product_sales (month, product_name, status, line_count, quantity, {revenue})
+    SELECT substr(IFNULL({row}.date, ''), 1, 7), IFNULL(product_name, ''), IFNULL({row}.status, ''),
+           {sign}count(*), {sign}IFNULL(SUM(quantity), 0), {sign}IFNULL(SUM({subtotal}), 0)
+    FROM invoice_items WHERE invoice_id = {row}.id GROUP BY IFNULL(product_name, '')
+    ON CONFLICT(month, product_name, status) DO UPDATE SET
+        line_count = line_count + excluded.line_count,
+        quantity = quantity + excluded.quantity,
+        {revenue} = {revenue} + excluded.{revenue};'''
+_ROLLUP_LINE_SQL = '''
+    INSERT INTO product_sales (month, product_name, status, line_count, quantity, {revenue})
+    SELECT substr(IFNULL(date, ''), 1, 7), IFNULL({row}.product_name, ''), IFNULL(status, ''),
+           {sign}1, {sign}IFNULL({row}.quantity, 0), {sign}IFNULL({row}.{subtotal}, 0)
+    FROM invoices WHERE id = {row}.invoice_id
+    ON CONFLICT(month, product_name, status) DO UPDATE SET
+        line_count = line_count + excluded.line_count,
+        quantity = quantity + excluded.quantity,
+        {revenue} = {revenue} + excluded.{revenue};'''
+_ROLLUP_TRIGGERS = ('trg_rollup_invoice_insert', 'trg_rollup_invoice_delete', 'trg_rollup_invoice_update',
+                    'trg_rollup_invoice_move_lines', 'trg_rollup_line_insert', 'trg_rollup_line_delete',
+                    'trg_rollup_line_update')
+
+
+def rebuild_report_rollups(c, money=_CENTS_MONEY, sources=('invoices', 'invoice_items')):
+    """Recompute the report rollups from scratch (also the initial backfill)."""
+    invoices, items = sources
+    c.execute('DELETE FROM revenue_daily')
+    c.execute('DELETE FROM customer_revenue')
+    c.execute('DELETE FROM product_sales')
+    c.execute('''INSERT INTO revenue_daily (day, status, invoice_count, {subtotal}, {tax}, {total})
+                 SELECT IFNULL(date, ''), IFNULL(status, ''), count(*), IFNULL(SUM({subtotal}), 0),
+                        IFNULL(SUM({tax}), 0), IFNULL(SUM({total}), 0)
+                 FROM {invoices} GROUP BY 1, 2'''.format(invoices=invoices, **money))
+    c.execute('''INSERT INTO customer_revenue (customer_name, status, invoice_count, {total})
+                 SELECT customer_name, IFNULL(status, ''), count(*), IFNULL(SUM({total}), 0)
+                 FROM {invoices} GROUP BY 1, 2'''.format(invoices=invoices, **money))
+    c.execute('''INSERT INTO product_sales (month, product_name, status, line_count, quantity, {revenue})
+                 SELECT substr(IFNULL(i.date, ''), 1, 7), IFNULL(l.product_name, ''), IFNULL(i.status, ''),
+                        count(*), IFNULL(SUM(l.quantity), 0), IFNULL(SUM(l.{subtotal}), 0)
+                 FROM {items} l JOIN {invoices} i ON i.id = l.invoice_id
+                 GROUP BY 1, 2, 3'''.format(invoices=invoices, items=items, **money))
+
+
+def _create_rollup_tables(c, money, money_type):
+    c.execute('''CREATE TABLE IF NOT EXISTS revenue_daily (
+                    day TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    invoice_count INTEGER NOT NULL DEFAULT 0,
+                    {subtotal} {money_type} NOT NULL DEFAULT 0,
+                    {tax} {money_type} NOT NULL DEFAULT 0,
+                    {total} {money_type} NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, status)
+                ) WITHOUT ROWID'''.format(money_type=money_type, **money))
+    c.execute('''CREATE TABLE IF NOT EXISTS customer_revenue (
+                    customer_name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    invoice_count INTEGER NOT NULL DEFAULT 0,
+                    {total} {money_type} NOT NULL DEFAULT 0,
+                    PRIMARY KEY (customer_name, status)
+                ) WITHOUT ROWID'''.format(money_type=money_type, **money))
+    c.execute('''CREATE TABLE IF NOT EXISTS product_sales (
+                    month TEXT NOT NULL,
+                    product_name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    line_count INTEGER NOT NULL DEFAULT 0,
+                    quantity INTEGER NOT NULL DEFAULT 0,
+                    {revenue} {money_type} NOT NULL DEFAULT 0,
+                    PRIMARY KEY (month, product_name, status)
+                ) WITHOUT ROWID'''.format(money_type=money_type, **money))
+
+
+def _create_rollup_triggers(c, money, live=False):
+    def apply(sql, sign, row):
+        return sql.format(sign=sign, row=row, **money)
+
+    def apply_invoice(sign, row):
+        return '\n'.join(apply(sql, sign, row) for sql in _ROLLUP_INVOICE_SQL)
+
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_invoice_insert AFTER INSERT ON invoices
+                  BEGIN {apply_invoice('', 'new')} END''')
+    # BEFORE DELETE: the lines must still be there to be subtracted (a
+    # cascade removes them afterwards, when their own trigger finds no invoice)
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_invoice_delete BEFORE DELETE ON invoices
+                  {_LIVE_DELETE if live else ''}
+                  BEGIN {apply_invoice('-', 'old')} {apply(_ROLLUP_INVOICE_LINES_SQL, '-', 'old')} END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_rollup_invoice_update
+                  AFTER UPDATE OF customer_name, date, status, {subtotal}, {tax}, {total} ON invoices
+                  WHEN old.customer_name IS NOT new.customer_name OR old.date IS NOT new.date
+                    OR old.status IS NOT new.status OR old.{subtotal} IS NOT new.{subtotal}
+                    OR old.{tax} IS NOT new.{tax} OR old.{total} IS NOT new.{total}
+                  BEGIN '''.format(**money) + f'''{apply_invoice('-', 'old')} {apply_invoice('', 'new')} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_invoice_move_lines
+                  AFTER UPDATE OF date, status ON invoices
+                  WHEN old.date IS NOT new.date OR old.status IS NOT new.status
+                  BEGIN
+                      {apply(_ROLLUP_INVOICE_LINES_SQL, '-', 'old')}
+                      {apply(_ROLLUP_INVOICE_LINES_SQL, '', 'new')}
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_line_insert AFTER INSERT ON invoice_items
+                  BEGIN {apply(_ROLLUP_LINE_SQL, '', 'new')} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_line_delete AFTER DELETE ON invoice_items
+                  BEGIN {apply(_ROLLUP_LINE_SQL, '-', 'old')} END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_rollup_line_update
+                  AFTER UPDATE OF invoice_id, product_name, quantity, {subtotal} ON invoice_items
+                  BEGIN '''.format(**money) + f'''
+                      {apply(_ROLLUP_LINE_SQL, '-', 'old')}
+                      {apply(_ROLLUP_LINE_SQL, '', 'new')}
+                  END''')
+
+
+def _migrate_report_rollups(c):
+    """
+    Revenue by day, by customer and by product/month, per status, kept
+    current by triggers like the KPI totals so reports read rollup rows
+    instead of scanning invoices.
+    """
+    _create_rollup_tables(c, _REAL_MONEY, 'REAL')
+    _create_rollup_triggers(c, _REAL_MONEY)
+    rebuild_report_rollups(c, _REAL_MONEY)
+
+
+# Amount columns moved to integer cents in v12; the REAL originals stay as
+# display mirrors (written from the cents by insert_invoice).
+MONEY_COLUMNS = (
+    ('invoices', 'subtotal', 'subtotal_cents'),
+    ('invoices', 'tax_amount', 'tax_cents'),
+    ('invoices', 'total_amount', 'total_cents'),
+    ('invoice_items', 'price', 'price_cents'),
+    ('invoice_items', 'subtotal', 'subtotal_cents'),
+    ('recurring_invoice_items', 'price', 'price_cents'),
+)
+
+
+def _migrate_money_cents(c):
+    """
+    Integer minor-unit columns next to every REAL amount, backfilled through
+    to_cents (decimal rounding of each stored value), and the KPI totals and
+    report rollups rebuilt on them so every aggregate is an exact integer sum.
+    """
+    c.connection.create_function('to_cents', 1, lambda value: to_cents(value or 0), deterministic=True)
+    for table, real_column, cents_column in MONEY_COLUMNS:
+        if cents_column not in _table_columns(c, table):
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {cents_column} INTEGER NOT NULL DEFAULT 0')
+        c.execute(f'UPDATE {table} SET {cents_column} = to_cents({real_column})')
+
+    for trigger in ('trg_kpi_invoice_insert', 'trg_kpi_invoice_delete', 'trg_kpi_invoice_update') + _ROLLUP_TRIGGERS:
+        c.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    for table in ('invoice_status_totals', 'revenue_daily', 'customer_revenue', 'product_sales'):
+        c.execute(f'DROP TABLE IF EXISTS {table}')
+    c.execute('''CREATE TABLE invoice_status_totals (
+                    status TEXT PRIMARY KEY,
+                    invoice_count INTEGER NOT NULL DEFAULT 0,
+                    total_cents INTEGER NOT NULL DEFAULT 0
+                )''')
+    _create_kpi_triggers(c, _CENTS_MONEY)
+    _create_rollup_tables(c, _CENTS_MONEY, 'INTEGER')
+    _create_rollup_triggers(c, _CENTS_MONEY)
+    rebuild_kpi_totals(c)
+    rebuild_report_rollups(c)
+
+
+def customer_key(name, email=None):
+    """Dedup key for a customer: the email if there is one, else the case/space-folded name."""
+    email = (email or '').strip().lower()
+    return f'email:{email}' if email else 'name:' + ' '.join((name or '').split()).casefold()
+
+
+# Customer balances: one invoice's contribution applied with {sign}, like the
+# report rollups. Revenue follows the dashboard rule (everything but Draft);
+# outstanding is what is still open on Pending/Overdue invoices, measured by
+# an _OPEN_* expression (total until v14, total less payments since).
+# Removing an invoice re-reads the customer's latest date through
+# idx_invoices_customer.
+_CUSTOMER_BALANCE_SQL = '''
+    UPDATE customers SET
+        invoice_count = invoice_count {sign} 1,
+        revenue_cents = revenue_cents {sign} CASE WHEN IFNULL({row}.status, '') IN ('Draft', '') THEN 0
+                                                  ELSE IFNULL({row}.total_cents, 0) END,
+        outstanding_cents = outstanding_cents {sign} CASE WHEN {row}.status IN ('Pending', 'Overdue')
+                                                          THEN {open} ELSE 0 END,
+        last_invoice_date = {last_date}
+    WHERE id = {row}.customer_id;'''
+_CUSTOMER_LAST_DATE = {
+    '+': "NULLIF(max(IFNULL(last_invoice_date, ''), IFNULL(new.date, '')), '')",
+    '-': '(SELECT max(date) FROM invoices WHERE customer_id = old.customer_id)',
+}
+# v16: removing a row re-reads only live invoices, falling back to the latest archived date
+_CUSTOMER_LIVE_LAST_DATE = dict(_CUSTOMER_LAST_DATE, **{
+    '-': '''NULLIF(max(IFNULL((SELECT max(date) FROM invoices WHERE customer_id = old.customer_id
+                                     AND deleted_at IS NULL AND archived_at IS NULL), ''),
+                   IFNULL(archived_last_date, '')), '')''',
+})
+_OPEN_TOTAL = ('IFNULL({row}.total_cents, 0)', ('customer_id', 'date', 'status', 'total_cents'))
+_OPEN_BALANCE = ('(IFNULL({row}.total_cents, 0) - IFNULL({row}.paid_cents, 0))',
+                 ('customer_id', 'date', 'status', 'total_cents', 'paid_cents'))
+
+
+def _customer_balance_sql(sign, row, open_amount, last_date=_CUSTOMER_LAST_DATE):
+    return _CUSTOMER_BALANCE_SQL.format(sign=sign, row=row, last_date=last_date[sign],
+                                        open=open_amount[0].format(row=row))
+
+
+def _create_customer_triggers(c, open_amount, live=False):
+    columns = open_amount[1]
+    last_date = _CUSTOMER_LIVE_LAST_DATE if live else _CUSTOMER_LAST_DATE
+    changed = ' OR '.join(f'old.{column} IS NOT new.{column}' for column in columns)
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_customer_invoice_insert AFTER INSERT ON invoices
+                  BEGIN {_customer_balance_sql('+', 'new', open_amount, last_date)} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_customer_invoice_delete AFTER DELETE ON invoices
+                  {_LIVE_DELETE if live else ''}
+                  BEGIN {_customer_balance_sql('-', 'old', open_amount, last_date)} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_customer_invoice_update
+                  AFTER UPDATE OF {', '.join(columns)} ON invoices
+                  WHEN {changed}
+                  BEGIN {_customer_balance_sql('-', 'old', open_amount, last_date)}
+                        {_customer_balance_sql('+', 'new', open_amount, last_date)} END''')
+
+
+def _customer_totals_sql(open_amount):
+    """Select list recounting (invoice_count, revenue, outstanding, last date) from invoices."""
+    return '''count(*),
+              IFNULL(SUM(CASE WHEN IFNULL(status, '') IN ('Draft', '') THEN 0 ELSE total_cents END), 0),
+              IFNULL(SUM(CASE WHEN status IN ('Pending', 'Overdue') THEN {open} ELSE 0 END), 0),
+              max(date)'''.format(open=open_amount[0].format(row='invoices'))
+
+
+def rebuild_customer_balances(c, open_amount=_OPEN_BALANCE, source='invoices'):
+    """Recompute every customer's balances from its invoices (also the initial backfill)."""
+    c.execute(f'''UPDATE customers SET (invoice_count, revenue_cents, outstanding_cents, last_invoice_date) = (
+                     SELECT {_customer_totals_sql(open_amount)}
+                     FROM {source} AS invoices WHERE customer_id = customers.id)''')
+
+
+def check_customer_balances(conn):
+    """(key, stored, actual) for every customer whose maintained balances drifted."""
+    stored = {r[0]: tuple(r[1:]) for r in conn.execute(
+        'SELECT id, invoice_count, revenue_cents, outstanding_cents, last_invoice_date FROM customers')}
+    invoices, _ = invoice_sources(conn, archive=True)
+    actual = {r[0]: tuple(r[1:]) for r in conn.execute(
+        f'SELECT customer_id, {_customer_totals_sql(_OPEN_BALANCE)} FROM {invoices} AS invoices '
+        'GROUP BY customer_id')}
+    empty = (0, 0, 0, None)
+    mismatches = [(f'customer={key}', stored.get(key), actual.get(key))
+                  for key in sorted(set(stored) | set(actual), key=lambda k: (k is None, k or 0))
+                  if stored.get(key, empty) != actual.get(key, empty)]
+    # Balances above are derived from paid_cents, so a Paid invoice that was
+    # never settled (e.g. imported before insert_invoice set it) shows as owing
+    mismatches += [(f'invoice={r[0]} paid_cents', r[1], r[2]) for r in conn.execute(
+        f"SELECT id, paid_cents, total_cents FROM {invoices} AS invoices "
+        "WHERE status = 'Paid' AND paid_cents < total_cents ORDER BY id")]
+    return mismatches
+
+
+def _migrate_customers(c):
+    """
+    A customers table deduplicated from the free-text name/email on existing
+    invoices (by customer_key), invoices.customer_id pointing at it, and
+    per-customer count, revenue, outstanding balance and last invoice date
+    kept current by triggers, so statements and credit checks read one row.
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS customers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    lookup_key TEXT NOT NULL UNIQUE,
+                    name TEXT NOT NULL,
+                    email TEXT,
+                    credit_limit_cents INTEGER,
+                    invoice_count INTEGER NOT NULL DEFAULT 0,
+                    revenue_cents INTEGER NOT NULL DEFAULT 0,
+                    outstanding_cents INTEGER NOT NULL DEFAULT 0,
+                    last_invoice_date TEXT,
+                    created_at TEXT NOT NULL
+                )''')
+    if 'customer_id' not in _table_columns(c, 'invoices'):
+        c.execute('ALTER TABLE invoices ADD COLUMN customer_id INTEGER REFERENCES customers(id)')
+
+    c.connection.create_function('customer_key', 2, customer_key, deterministic=True)
+    # Name and email are taken from each customer's most recent invoice
+    c.execute('''INSERT OR IGNORE INTO customers (lookup_key, name, email, created_at)
+                 SELECT lookup_key, customer_name, NULLIF(trim(customer_email), ''), ?
+                 FROM (SELECT customer_key(customer_name, customer_email) AS lookup_key,
+                              customer_name, customer_email, max(id)
+                       FROM invoices GROUP BY lookup_key)''',
+              (datetime.now().isoformat(timespec='seconds'),))
+    c.execute('''UPDATE invoices SET customer_id = (
+                    SELECT id FROM customers WHERE lookup_key = customer_key(invoices.customer_name,
+                                                                             invoices.customer_email))
+                 WHERE customer_id IS NULL''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_invoices_customer ON invoices(customer_id, date)')
+
+    _create_customer_triggers(c, _OPEN_TOTAL)
+    # Balance changes already bump the invoices version; this covers edits to
+    # the customer record itself (credit limit, contact details)
+    c.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('customers', 1)")
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_version_customers_update
+                  AFTER UPDATE OF name, email, credit_limit_cents ON customers
+                  BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'customers'; END''')
+    rebuild_customer_balances(c, _OPEN_TOTAL)
+
+
+def rebuild_kpi_paid_totals(c, source='invoices'):
+    """Recompute invoice_status_totals.paid_cents (run after rebuild_kpi_totals)."""
+    c.execute('UPDATE invoice_status_totals SET paid_cents = 0')
+    c.execute(f'''UPDATE invoice_status_totals SET paid_cents = paid.cents
+                 FROM (SELECT IFNULL(status, '') AS status, SUM(paid_cents) AS cents
+                       FROM {source} GROUP BY 1) AS paid
+                 WHERE paid.status = invoice_status_totals.status''')
+
+
+def settle_paid_invoices(c, schemas=('main',)):
+    """Mark live Paid invoices that were recorded with nothing paid as settled in full."""
+    for schema in schemas:
+        c.execute(f'''UPDATE {schema}.invoices SET paid_cents = total_cents
+                      WHERE status = 'Paid' AND paid_cents < total_cents AND deleted_at IS NULL''')
+
+
+def _migrate_payments(c):
+    """
+    Payments and their allocations to invoices, invoices.paid_cents, and the
+    paid amount per status next to the KPI totals. Open balances (customer
+    outstanding, Pending/Overdue KPIs, aging) become total less paid.
+    Invoices already marked Paid are treated as settled in full.
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS payments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    customer_id INTEGER NOT NULL REFERENCES customers(id),
+                    amount_cents INTEGER NOT NULL CHECK (amount_cents > 0),
+                    unapplied_cents INTEGER NOT NULL DEFAULT 0,
+                    received_on TEXT NOT NULL,
+                    method TEXT NOT NULL DEFAULT 'manual',
+                    reference TEXT,
+                    external_id TEXT UNIQUE,
+                    created_at TEXT NOT NULL
+                )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_payments_customer ON payments(customer_id, received_on)')
+    c.execute('''CREATE TABLE IF NOT EXISTS payment_allocations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payment_id INTEGER NOT NULL REFERENCES payments(id),
+                    invoice_id INTEGER NOT NULL REFERENCES invoices(id) ON DELETE CASCADE,
+                    amount_cents INTEGER NOT NULL
+                )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_allocations_payment ON payment_allocations(payment_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_allocations_invoice ON payment_allocations(invoice_id)')
+
+    if 'paid_cents' not in _table_columns(c, 'invoices'):
+        c.execute('ALTER TABLE invoices ADD COLUMN paid_cents INTEGER NOT NULL DEFAULT 0')
+    c.execute("UPDATE invoices SET paid_cents = total_cents WHERE status = 'Paid'")
+
+    if 'paid_cents' not in _table_columns(c, 'invoice_status_totals'):
+        c.execute('ALTER TABLE invoice_status_totals ADD COLUMN paid_cents INTEGER NOT NULL DEFAULT 0')
+    # Separate from the count/total triggers; an UPSERT on both sides means
+    # it does not matter which of them fires first
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_kpi_paid_insert AFTER INSERT ON invoices
+                 WHEN new.paid_cents != 0
+                 BEGIN
+                    INSERT INTO invoice_status_totals (status, paid_cents) VALUES (IFNULL(new.status, ''), new.paid_cents)
+                    ON CONFLICT(status) DO UPDATE SET paid_cents = paid_cents + excluded.paid_cents;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_kpi_paid_delete AFTER DELETE ON invoices
+                 WHEN old.paid_cents != 0
+                 BEGIN
+                    UPDATE invoice_status_totals SET paid_cents = paid_cents - old.paid_cents
+                    WHERE status = IFNULL(old.status, '');
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_kpi_paid_update AFTER UPDATE OF status, paid_cents ON invoices
+                 WHEN (old.status IS NOT new.status OR old.paid_cents != new.paid_cents)
+                   AND (old.paid_cents != 0 OR new.paid_cents != 0)
+                 BEGIN
+                    UPDATE invoice_status_totals SET paid_cents = paid_cents - old.paid_cents
+                    WHERE status = IFNULL(old.status, '');
+                    INSERT INTO invoice_status_totals (status, paid_cents) VALUES (IFNULL(new.status, ''), new.paid_cents)
+                    ON CONFLICT(status) DO UPDATE SET paid_cents = paid_cents + excluded.paid_cents;
+                 END''')
+    rebuild_kpi_paid_totals(c)
+
+    for trigger in ('trg_customer_invoice_insert', 'trg_customer_invoice_delete', 'trg_customer_invoice_update'):
+        c.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    _create_customer_triggers(c, _OPEN_BALANCE)
+    rebuild_customer_balances(c)
+
+
+def _migrate_audit_log(c):
+    """Append-only audit trail (see AUDIT LOG); triggers refuse UPDATE and DELETE."""
+    c.execute('''CREATE TABLE IF NOT EXISTS audit_log (
+                    id INTEGER PRIMARY KEY,
+                    occurred_at TEXT NOT NULL,
+                    actor TEXT NOT NULL,
+                    action TEXT NOT NULL,
+                    entity TEXT NOT NULL,
+                    entity_id INTEGER,
+                    old_values TEXT,
+                    new_values TEXT
+                )''')
+    # Entity history and time-range scans; both end in rowid, so (occurred_at, id) keyset paging is a seek
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_log(entity, entity_id, occurred_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_time ON audit_log(occurred_at)')
+    for event in ('UPDATE', 'DELETE'):
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_audit_no_{event.lower()} BEFORE {event} ON audit_log
+                      BEGIN
+                         SELECT RAISE(ABORT, 'audit_log is append-only');
+                      END''')
+
+
+# Tracked invoice columns a trashed row may not change: the aggregates no
+# longer hold it, so an edit would be applied to totals it is not part of
+_TRASH_FROZEN_COLUMNS = ('customer_id', 'customer_name', 'customer_email', 'date', 'status',
+                         'subtotal_cents', 'tax_cents', 'total_cents', 'paid_cents')
+
+
+def _create_soft_delete_triggers(c):
+    def rollups(sign, row):
+        return '\n'.join(sql.format(sign=sign, row=row, **_CENTS_MONEY)
+                         for sql in _ROLLUP_INVOICE_SQL + (_ROLLUP_INVOICE_LINES_SQL,))
+
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_invoice_soft_delete AFTER UPDATE OF deleted_at ON invoices
+                  WHEN old.deleted_at IS NULL AND new.deleted_at IS NOT NULL
+                  BEGIN
+                     UPDATE invoice_status_totals
+                     SET invoice_count = invoice_count - 1,
+                         total_cents = total_cents - IFNULL(old.total_cents, 0),
+                         paid_cents = paid_cents - old.paid_cents
+                     WHERE status = IFNULL(old.status, '');
+                     {rollups('-', 'old')}
+                     {_customer_balance_sql('-', 'old', _OPEN_BALANCE, _CUSTOMER_LIVE_LAST_DATE)}
+                     DELETE FROM invoice_search WHERE rowid = old.id;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_invoice_restore AFTER UPDATE OF deleted_at ON invoices
+                  WHEN old.deleted_at IS NOT NULL AND new.deleted_at IS NULL
+                  BEGIN
+                     INSERT INTO invoice_status_totals (status, invoice_count, total_cents, paid_cents)
+                     VALUES (IFNULL(new.status, ''), 1, IFNULL(new.total_cents, 0), new.paid_cents)
+                     ON CONFLICT(status) DO UPDATE SET
+                         invoice_count = invoice_count + 1,
+                         total_cents = total_cents + excluded.total_cents,
+                         paid_cents = paid_cents + excluded.paid_cents;
+                     {rollups('', 'new')}
+                     {_customer_balance_sql('+', 'new', _OPEN_BALANCE, _CUSTOMER_LIVE_LAST_DATE)}
+                     INSERT INTO invoice_search (rowid, customer_name, customer_email, item_names)
+                     VALUES (new.id, new.customer_name, new.customer_email,
+                             (SELECT IFNULL(group_concat(product_name, ' '), '')
+                              FROM invoice_items WHERE invoice_id = new.id));
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_invoice_trash_frozen
+                  BEFORE UPDATE OF {', '.join(_TRASH_FROZEN_COLUMNS)} ON invoices
+                  WHEN old.deleted_at IS NOT NULL AND new.deleted_at IS NOT NULL
+                  BEGIN
+                     SELECT RAISE(ABORT, 'invoice is in the trash; restore it first');
+                  END''')
+
+
+def _migrate_soft_delete(c):
+    """
+    invoices.deleted_at / archived_at (see SOFT DELETE & ARCHIVE). Trashing
+    a row takes it out of every maintained aggregate and the search index
+    and restoring puts it back, both by trigger; deleting a row that is
+    trashed or being archived leaves the aggregates alone.
+    """
+    for table, column, definition in (('invoices', 'deleted_at', 'TEXT'),
+                                      ('invoices', 'archived_at', 'TEXT'),
+                                      ('customers', 'archived_last_date', 'TEXT'),
+                                      ('invoice_status_totals', 'archived_count', 'INTEGER NOT NULL DEFAULT 0')):
+        if column not in _table_columns(c, table):
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    # The trash is small: a partial index keeps it off the hot table's indexes
+    c.execute('CREATE INDEX IF NOT EXISTS idx_invoices_deleted ON invoices(deleted_at) WHERE deleted_at IS NOT NULL')
+
+    for trigger in ('trg_kpi_invoice_delete', 'trg_kpi_paid_delete', 'trg_rollup_invoice_delete',
+                    'trg_customer_invoice_insert', 'trg_customer_invoice_delete', 'trg_customer_invoice_update'):
+        c.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    _create_kpi_triggers(c, _CENTS_MONEY, live=True)
+    _create_rollup_triggers(c, _CENTS_MONEY, live=True)
+    _create_customer_triggers(c, _OPEN_BALANCE, live=True)
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_kpi_paid_delete AFTER DELETE ON invoices
+                  {_LIVE_DELETE} AND old.paid_cents != 0
+                  BEGIN
+                     UPDATE invoice_status_totals SET paid_cents = paid_cents - old.paid_cents
+                     WHERE status = IFNULL(old.status, '');
+                  END''')
+    _create_soft_delete_triggers(c)
+
+
+def _migrate_settle_paid_imports(c):
+    """
+    Invoices imported (or generated) straight into Paid used to keep
+    paid_cents = 0 and so showed as owing; settle them the way v14 settled
+    the Paid invoices of the time. The triggers carry the change into the
+    KPI totals and customer balances.
+    """
+    settle_paid_invoices(c)
+
+
+def _migrate_payments_version(c):
+    """
+    A table version for payments: a customer statement's unapplied credit
+    comes from there, and a payment held entirely as credit changes no
+    invoice or customer row.
+    """
+    c.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('payments', 1)")
+    bump = "UPDATE table_versions SET version = version + 1 WHERE name = 'payments';"
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_version_payments_insert AFTER INSERT ON payments
+                  BEGIN {bump} END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_version_payments_update AFTER UPDATE ON payments
+                  BEGIN {bump} END''')
+
+
+# Ordered schema history. PRAGMA user_version records the last step applied,
+# so startup only reads one integer once the database is current. Append new
+# steps; never edit or reorder ones that have shipped.
+MIGRATIONS = [
+    (1, 'Baseline schema and seed catalog', _migrate_baseline),
+    (2, 'Invoice lookup and KPI indexes', _migrate_lookup_indexes),
+    (3, 'Trigger-maintained dashboard KPI totals', _migrate_kpi_totals),
+    (4, 'Status + id index for keyset paging', _migrate_status_paging_index),
+    (5, 'FTS5 invoice search index', _migrate_invoice_search),
+    (6, 'Invoice date index for range exports', _migrate_invoice_date_index),
+    (7, 'Row and table versions for ETags', _migrate_row_versions),
+    (8, 'Background job queue', _migrate_jobs),
+    (9, 'Recurring invoice templates', _migrate_recurring_invoices),
+    (10, 'Overdue sweep index and log', _migrate_overdue_sweep),
+    (11, 'Trigger-maintained report rollups', _migrate_report_rollups),
+    (12, 'Integer-cent money columns', _migrate_money_cents),
+    (13, 'Customers with trigger-maintained balances', _migrate_customers),
+    (14, 'Payments ledger and paid balances', _migrate_payments),
+    (15, 'Append-only audit log', _migrate_audit_log),
+    (16, 'Soft delete and invoice archive', _migrate_soft_delete),
+    (17, 'Settle invoices created as Paid', _migrate_settle_paid_imports),
+    (18, 'Payments table version', _migrate_payments_version),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def init_and_migrate_db():
+    """
+    Brings the database up to SCHEMA_VERSION by running only the pending
+    migration steps, each in its own transaction together with the
+    user_version bump so a failed step is retried on the next start.
+    """
+    conn = get_db_connection()
+    try:
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+            return
+        for version, description, step in MIGRATIONS:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Re-read under the write lock: another process may have migrated
+                if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    conn.rollback()
+                    continue
+                step(conn.cursor())
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print(f"Migrated: schema v{version} ({description})")
+    finally:
+        conn.close()
+
+
+# Initialize on start
+init_and_migrate_db()
+
+# ==========================================
+# CONFIG & UTILS
+# ==========================================
+
+COMPANY_INFO = {
+    "name": "NexusBilling Corp",
+    "address": "123 Innovation Drive, Tech Valley, CA 94043",
+    "email": "finance@nexuscorp.com",
+    "phone": "+1 (555) 019-2834"
+}
+
+# Rows per dashboard page
+PAGE_SIZE = 20
+
+
+def encode_cursor(*values):
+    """Opaque, URL-safe token for a keyset position (e.g. the last id shown)."""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+SQLITE_INT_MAX = 2 ** 63 - 1
+
+
+def _cursor_value(value):
+    """A value SQLite can bind as-is: str, float or an int in its 64-bit range."""
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return -SQLITE_INT_MAX - 1 <= value <= SQLITE_INT_MAX
+    return isinstance(value, (str, float))
+
+
+def decode_cursor(token, size=None):
+    """
+    Inverse of encode_cursor; returns None for missing or tampered tokens,
+    including ones that are not `size` scalar values long.
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or not values or not all(_cursor_value(v) for v in values):
+        return None
+    return values if size is None or len(values) == size else None
+
+
+INVOICE_NUMBER = re.compile(r'^\s*#?\s*(?:INV-?)?0*(\d+)\s*$', re.IGNORECASE)
+
+
+def parse_invoice_search(query):
+    """
+    Classify a dashboard search: ('id', n) for an invoice number such as
+    "42", "#00042" or "INV-00042", ('text', fts_match) for anything else,
+    or None when there is nothing to search for.
+    """
+    match = INVOICE_NUMBER.match(query or '')
+    # Numbers past SQLite's integer range cannot be an invoice id; search them as text
+    if match and int(match.group(1)) <= SQLITE_INT_MAX:
+        return 'id', int(match.group(1))
+    # Each word must match as a prefix, so results narrow as the user types
+    terms = re.findall(r'\w+', query or '')
+    if not terms:
+        return None
+    return 'text', ' '.join(f'"{term}"*' for term in terms)
+
+# ==========================================
+# INVOICE WRITE PATH
+# ==========================================
+
+
+def build_invoice_lines(names, quantities, prices):
+    """
+    Validate and price every line in a single pass. Returns
+    ([(name, qty, unit_price_cents, line_total_cents), ...], subtotal_cents);
+    raises ValueError with a user-facing message on the first bad line.
+    """
+    if not len(names) == len(quantities) == len(prices):
+        raise ValueError('Line items are incomplete.')
+    lines = []
+    subtotal = 0
+    for n, (name, qty, price) in enumerate(zip(names, quantities, prices), 1):
+        name = '' if name is None else str(name).strip()
+        if not name:
+            raise ValueError(f'Line {n}: a description is required.')
+        try:
+            # Whole numbers only: 2.9 or true is an error, never silently 2 or 1
+            if isinstance(qty, bool) or (isinstance(qty, float) and not qty.is_integer()):
+                raise ValueError
+            if not isinstance(qty, (int, float, str)):
+                raise TypeError
+            qty = int(qty)
+            price = to_cents(price)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f'Line {n}: quantity and price must be numbers.') from None
+        if qty < 1 or price < 0:
+            raise ValueError(f'Line {n}: quantity must be at least 1 and price cannot be negative.')
+        subtotal += qty * price
+        if subtotal > MAX_CENTS:
+            raise ValueError(f'Line {n}: the invoice total is too large.')
+        lines.append((name, qty, price, qty * price))
+    if not lines:
+        raise ValueError('An invoice needs at least one line item.')
+    return lines, subtotal
+
+
+def invoice_totals(subtotal, tax_rate):
+    """(tax, total) in cents for a subtotal in cents and a percentage tax rate."""
+    tax = tax_cents(subtotal, tax_rate)
+    return tax, subtotal + tax
+
+
+def resolve_customer(conn, name, email=None):
+    """Id of the customer matching customer_key(name, email), created on first sight."""
+    key = customer_key(name, email)
+    row = conn.execute('SELECT id FROM customers WHERE lookup_key = ?', (key,)).fetchone()
+    if row:
+        return row[0]
+    return conn.execute('INSERT INTO customers (lookup_key, name, email, created_at) VALUES (?, ?, ?, ?)',
+                        (key, name, (email or '').strip() or None,
+                         datetime.now().isoformat(timespec='seconds'))).lastrowid
+
+
+def insert_invoice(conn, customer_name, customer_email, inv_date, due_date, tax_rate, lines,
+                   status='Pending', index_items=True):
+    """
+    Insert one invoice and all of its priced lines (from build_invoice_lines)
+    with a single executemany, inside the caller's transaction. Totals are
+    always computed here, never taken from the client. Returns the new id.
+    Batch writers pass index_items=False and refresh the search index once
+    for the whole batch.
+    """
+    subtotal = sum(line[3] for line in lines)
+    tax, total = invoice_totals(subtotal, tax_rate)
+    customer_id = resolve_customer(conn, customer_name, customer_email)
+    # An invoice created as Paid is settled in full, as _migrate_payments treats them
+    paid = total if status == 'Paid' else 0
+    cur = conn.execute('''INSERT INTO invoices
+                           (customer_name, customer_email, date, due_date, subtotal, tax_rate, tax_amount, total_amount, status,
+                            subtotal_cents, tax_cents, total_cents, paid_cents, customer_id)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                       (customer_name, customer_email, inv_date, due_date,
+                        from_cents(subtotal), tax_rate, from_cents(tax), from_cents(total), status,
+                        subtotal, tax, total, paid, customer_id))
+    invoice_id = cur.lastrowid
+    conn.executemany('''INSERT INTO invoice_items
+                          (invoice_id, product_name, quantity, price, subtotal, price_cents, subtotal_cents)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     [(invoice_id, name, qty, from_cents(price), from_cents(line_total), price, line_total)
+                      for name, qty, price, line_total in lines])
+    if index_items:
+        refresh_invoice_search_items(conn, [invoice_id])
+    return invoice_id
+
+# ==========================================
+# BULK IMPORT (streaming CSV / JSONL)
+# ==========================================
+
+INVOICE_STATUSES = ('Pending', 'Paid', 'Overdue', 'Draft')
+
+# One record per line item; consecutive records sharing an invoice_ref form
+# one invoice and the invoice-level fields are taken from its first record.
+IMPORT_FIELDS = ('invoice_ref', 'customer_name', 'customer_email', 'date', 'due_date',
+                 'status', 'tax_rate', 'product_name', 'quantity', 'price')
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+
+def iter_import_records(stream, fmt):
+    """
+    Yield (line_number, record) from a binary stream without reading it all
+    in. Lines are decoded one at a time, so bytes that are not UTF-8 end the
+    stream with an error record for their line after every record before it.
+    """
+    undecodable = []
+
+    def decoded_lines():
+        for n, raw in enumerate(stream, 1):
+            try:
+                yield raw.decode('utf-8-sig' if n == 1 else 'utf-8')
+            except UnicodeDecodeError as e:
+                undecodable.append((n, e))
+                return
+
+    text = decoded_lines()
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = {'_error': f'Invalid JSON: {e}'}
+            yield line_number, record if isinstance(record, dict) else {'_error': 'Expected a JSON object.'}
+    else:
+        raise ValueError(f'Unsupported import format: {fmt!r} (use csv or jsonl).')
+    for line_number, error in undecodable:
+        yield line_number, {'_error': f'Not UTF-8 text ({error.reason}); the rest of the file was not read.'}
+
+
+def _import_text(record, key):
+    """
+    record[key] as stripped text ('' when missing or null). JSONL numbers are
+    taken as written; any other JSON type (list, object, true/false) is a
+    ValueError for the row.
+    """
+    value = record.get(key)
+    if value is None:
+        return ''
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f'{key} must be text or a number.')
+    return str(value).strip()
+
+
+def _prepare_import_invoice(group):
+    """Validate one invoice's records; returns the insert_invoice arguments."""
+    for _, record in group:
+        if '_error' in record:
+            raise ValueError(record['_error'])
+    head = group[0][1]
+    customer_name = _import_text(head, 'customer_name')
+    if not customer_name:
+        raise ValueError('customer_name is required.')
+    try:
+        inv_date = date.fromisoformat(_import_text(head, 'date')).isoformat()
+        due_date = _import_text(head, 'due_date') or None
+        if due_date:
+            due_date = date.fromisoformat(due_date).isoformat()
+    except ValueError:
+        raise ValueError('date and due_date must be YYYY-MM-DD.') from None
+    status = _import_text(head, 'status') or 'Pending'
+    if status not in INVOICE_STATUSES:
+        raise ValueError(f'status must be one of {", ".join(INVOICE_STATUSES)}.')
+    if isinstance(head.get('tax_rate'), bool):
+        raise ValueError('Tax rate must be a number.')
+    tax_rate = parse_tax_rate(head.get('tax_rate'))
+    lines, _ = build_invoice_lines([r.get('product_name') for _, r in group],
+                                   [r.get('quantity') for _, r in group],
+                                   [r.get('price') for _, r in group])
+    return (customer_name, _import_text(head, 'customer_email') or None, inv_date, due_date,
+            tax_rate, lines, status)
+
+
+def import_invoices(conn, records, batch_size=500, progress=None):
+    """
+    Group streamed records into invoices and write them in transactions of
+    `batch_size` invoices. An invalid record rejects its whole invoice (never
+    a partial one) and is reported with its line number. Returns a report
+    dict with counts, throughput and errors.
+    """
+    report = {'rows': 0, 'invoices': 0, 'lines': 0, 'error_count': 0, 'errors': []}
+    started = time.perf_counter()
+    pending = []
+
+    def flush():
+        with write_transaction(conn):
+            ids = [insert_invoice(conn, *args, index_items=False) for args in pending]
+            refresh_invoice_search_items(conn, ids)
+        AUDIT.record([('create', 'invoice', invoice_id, None, invoice_audit_values(*args))
+                      for invoice_id, args in zip(ids, pending)])
+        report['invoices'] += len(pending)
+        report['lines'] += sum(len(args[5]) for args in pending)
+        pending.clear()
+        if progress:
+            progress(report)
+
+    def keyed():
+        for n, record in records:
+            try:
+                ref = _import_text(record, 'invoice_ref')
+            except ValueError as e:
+                record, ref = {'_error': str(e)}, ''
+            # Records without a ref are single-line invoices of their own
+            yield ref or f'line:{n}', (n, record)
+
+    for ref, grouped in itertools.groupby(keyed(), key=lambda pair: pair[0]):
+        group = [item for _, item in grouped]
+        report['rows'] += len(group)
+        try:
+            pending.append(_prepare_import_invoice(group))
+        except ValueError as e:
+            report['error_count'] += 1
+            if len(report['errors']) < IMPORT_MAX_REPORTED_ERRORS:
+                report['errors'].append({'line': group[0][0], 'invoice_ref': ref, 'error': str(e)})
+            continue
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['rows_per_second'] = round(report['rows'] / report['seconds']) if report['seconds'] else None
+    return report
+
+# ==========================================
+# PRODUCT CATALOG CACHE
+# ==========================================
+
+
+class ProductCatalog:
+    """
+    Immutable in-memory snapshot of the products table for one
+    table_versions['products'] value, with a sorted word-prefix index
+    (every word of the name, plus the SKU) for typeahead lookups.
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.products = [{'id': r['id'], 'name': r['name'], 'sku': r['sku'], 'price': r['price']}
+                         for r in sorted(rows, key=lambda r: (r['name'].casefold(), r['id']))]
+        self._words = []
+        keys = []
+        for position, product in enumerate(self.products):
+            sku = (product['sku'] or '').casefold()
+            words = set(re.findall(r'\w+', f"{product['name']} {sku}".casefold()))
+            if sku:
+                words.add(sku)  # "acc-055" as typed, not only "acc" and "055"
+            self._words.append(words)
+            keys.extend((word, position) for word in words)
+        keys.sort()
+        self._keys = keys
+        self._tokens = [token for token, _ in keys]
+
+    def lookup(self, query, limit, start=0):
+        """
+        Products with a word (or SKU) starting with the first query term and
+        containing the remaining terms as word prefixes, in index order.
+        Returns (products, resume_position or None).
+        """
+        # Terms keep inner punctuation so a SKU such as "acc-055" matches whole
+        terms = [t for t in (t.strip('.,;:!?()"\'') for t in (query or '').casefold().split()) if t]
+        if not terms:
+            page = self.products[start:start + limit]
+            more = start + limit < len(self.products)
+            return page, start + limit if more else None
+
+        first, rest = terms[0], terms[1:]
+        i = max(start, bisect.bisect_left(self._tokens, first))
+        seen, results = set(), []
+        while i < len(self._keys) and self._tokens[i].startswith(first):
+            position = self._keys[i][1]
+            words = self._words[position]
+            if position not in seen and all(any(w.startswith(t) for w in words) for t in rest):
+                if len(results) == limit:
+                    return results, i
+                seen.add(position)
+                results.append(self.products[position])
+            i += 1
+        return results, None
+
+
+_catalog = ProductCatalog(None, [])
+_catalog_lock = threading.Lock()
+
+
+def get_catalog(conn):
+    """The cached catalog, rebuilt only when the products table version moved."""
+    global _catalog
+    version = table_version(conn, 'products')
+    if _catalog.version != version:
+        with _catalog_lock:
+            if _catalog.version != version:
+                rows = conn.execute('SELECT id, name, sku, price FROM products').fetchall()
+                _catalog = ProductCatalog(version, rows)
+    return _catalog
+
+# ==========================================
+# STREAMING EXPORT
+# ==========================================
+
+EXPORT_COLUMNS = ('invoice_id', 'date', 'due_date', 'status', 'customer_name', 'customer_email',
+                  'subtotal', 'tax_rate', 'tax_amount', 'total_amount',
+                  'product_name', 'quantity', 'price', 'line_subtotal')
+EXPORT_FETCH_SIZE = 1000
+
+
+def iter_export_rows(start=None, end=None, status=None, archive=False):
+    """
+    Invoice + line-item rows (one per line) in date order, read through a
+    server-side cursor in EXPORT_FETCH_SIZE chunks on a dedicated
+    connection, so memory stays flat however large the range is. Archived
+    invoices are included when `archive` is set.
+    """
+    conditions, params = [], []
+    if start:
+        conditions.append('i.date >= ?')
+        params.append(start)
+    if end:
+        conditions.append('i.date <= ?')
+        params.append(end)
+    if status:
+        conditions.append('i.status = ?')
+        params.append(status)
+    # Its own connection: the response body is produced after the request's
+    # pooled connection has gone back to the pool. WAL keeps this long read
+    # from blocking writers.
+    conn = get_db_connection()
+    try:
+        if archive:
+            invoices, items = invoice_sources(conn, archive=True)
+        else:
+            invoices, items = 'invoices', 'invoice_items'
+            conditions.append('i.deleted_at IS NULL')
+        sql = f'''SELECT i.id AS invoice_id, i.date, i.due_date, i.status, i.customer_name, i.customer_email,
+                         i.subtotal, i.tax_rate, i.tax_amount, i.total_amount,
+                         it.product_name, it.quantity, it.price, it.subtotal AS line_subtotal
+                  FROM {invoices} i LEFT JOIN {items} it ON it.invoice_id = i.id'''
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY i.date, i.id, it.id'
+        cur = conn.execute(sql, params)
+        cur.arraysize = EXPORT_FETCH_SIZE
+        while True:
+            rows = cur.fetchmany()
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def iter_export_chunks(rows, fmt):
+    """Serialise rows to CSV or JSONL text, one chunk per EXPORT_FETCH_SIZE rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(EXPORT_COLUMNS)
+    for n, row in enumerate(rows, 1):
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(',', ':')))
+            buffer.write('\n')
+        if n % EXPORT_FETCH_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks):
+    """Incrementally gzip a byte stream."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+# ==========================================
+# PDF RENDERING (pure Python, cached on disk)
+# ==========================================
+
+# Cached files are named <invoice id>-<sha256 of everything printed>.pdf, so a
+# changed invoice simply misses the cache; update_status / delete_invoice also
+# remove stale files. Bump PDF_RENDERER_VERSION when the layout changes.
+app.config['PDF_CACHE_DIR'] = os.environ.get('BILLING_PDF_CACHE', 'pdf_cache')
+PDF_RENDERER_VERSION = 1
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792  # US Letter, points
+PDF_MARGIN = 50
+
+# Helvetica advance widths (1/1000 em) for printable ASCII, from the AFM.
+# Bold is close enough for right-aligning figures (digits are 556 in both).
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+
+def _text_width(text, size):
+    return sum(_HELVETICA_WIDTHS[ord(ch) - 32] if 32 <= ord(ch) <= 126 else 556
+               for ch in text) * size / 1000
+
+
+def _pdf_string(text):
+    """PDF literal string in WinAnsi (cp1252); unmappable characters become '?'."""
+    raw = str(text).encode('cp1252', errors='replace')
+    return b'(' + raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+class _PdfCanvas:
+    """Just enough of a page-description layer for text, rules and page breaks."""
+
+    def __init__(self):
+        self.pages = []
+        self.new_page()
+
+    def new_page(self):
+        self.ops = []
+        self.pages.append(self.ops)
+        self.y = PAGE_HEIGHT - PDF_MARGIN
+
+    def text(self, x, y, text, size=10, bold=False, align='left', gray=0.0):
+        if align == 'right':
+            x -= _text_width(str(text), size)
+        font = b'/F2' if bold else b'/F1'
+        self.ops.append(b'%.3f g BT %s %d Tf %.2f %.2f Td %s Tj ET' % (
+            gray, font, size, x, y, _pdf_string(text)))
+
+    def rule(self, x1, y, x2, width=0.5, gray=0.8):
+        self.ops.append(b'%.3f G %.2f w %.2f %.2f m %.2f %.2f l S' % (gray, width, x1, y, x2, y))
+
+    def fill_rect(self, x, y, w, h, gray):
+        self.ops.append(b'%.3f g %.2f %.2f %.2f %.2f re f' % (gray, x, y, w, h))
+
+    def to_bytes(self):
+        objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+                   b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+                   b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>']
+        page_refs = []
+        for ops in self.pages:
+            stream = zlib.compress(b'\n'.join(ops))
+            objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(stream), stream))
+            objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                           b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+                           % (PAGE_WIDTH, PAGE_HEIGHT, len(objects)))
+            page_refs.append(b'%d 0 R' % len(objects))
+        objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(page_refs), len(page_refs))
+
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(out))
+            out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+        out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+        return bytes(out)
+
+
+def render_invoice_pdf(invoice, items, company):
+    """Lay out one invoice (plain dicts) and return the PDF bytes."""
+    pdf = _PdfCanvas()
+    left, right = PDF_MARGIN, PAGE_WIDTH - PDF_MARGIN
+    money = '${:,.2f}'.format
+
+    pdf.text(left, pdf.y - 20, 'INVOICE', size=26, bold=True)
+    pdf.text(left, pdf.y - 40, f"#INV-{invoice['id']:05d}  ·  {invoice['status']}", size=10, gray=0.4)
+    pdf.text(right, pdf.y - 10, company['name'], size=13, bold=True, align='right')
+    for n, line in enumerate((company['address'], company['phone'], company['email'])):
+        pdf.text(right, pdf.y - 26 - n * 12, line, size=9, align='right', gray=0.4)
+    pdf.y -= 70
+    pdf.rule(left, pdf.y, right, width=1.5)
+
+    pdf.y -= 25
+    pdf.text(left, pdf.y, 'BILLED TO', size=8, bold=True, gray=0.4)
+    pdf.text(right - 110, pdf.y, 'Date Issued:', size=9, align='right', gray=0.4)
+    pdf.text(right, pdf.y, invoice['date'], size=9, bold=True, align='right')
+    pdf.y -= 16
+    pdf.text(left, pdf.y, invoice['customer_name'], size=12, bold=True)
+    pdf.text(right - 110, pdf.y, 'Due Date:', size=9, align='right', gray=0.4)
+    pdf.text(right, pdf.y, invoice['due_date'] or 'Upon Receipt', size=9, bold=True, align='right')
+    if invoice['customer_email']:
+        pdf.y -= 14
+        pdf.text(left, pdf.y, invoice['customer_email'], size=9, gray=0.4)
+
+    columns = ((left + 8, 'Description', 'left'), (right - 200, 'Qty', 'right'),
+               (right - 100, 'Unit Price', 'right'), (right - 8, 'Amount', 'right'))
+
+    def table_header():
+        pdf.y -= 30
+        pdf.fill_rect(left, pdf.y - 6, right - left, 20, 0.15)
+        for x, label, align in columns:
+            pdf.text(x, pdf.y, label.upper(), size=8, bold=True, align=align, gray=1.0)
+        pdf.y -= 8
+
+    table_header()
+    for item in items:
+        if pdf.y < PDF_MARGIN + 40:
+            pdf.new_page()
+            table_header()
+        pdf.y -= 18
+        name = str(item['product_name'] or '')
+        while name and _text_width(name, 9) > right - 200 - left - 40:
+            name = name[:-2] + '…'
+        values = (name, item['quantity'], money(item['price']), money(item['subtotal']))
+        for (x, _, align), value in zip(columns, values):
+            pdf.text(x, pdf.y, value, size=9, align=align)
+        pdf.rule(left, pdf.y - 6, right)
+
+    if pdf.y < PDF_MARGIN + 110:
+        pdf.new_page()
+    pdf.y -= 30
+    for label, value, bold in (('Subtotal', money(invoice['subtotal']), False),
+                               (f"Tax ({invoice['tax_rate']}%)", money(invoice['tax_amount']), False),
+                               ('Total Due', money(invoice['total_amount']), True)):
+        pdf.text(right - 130, pdf.y, label, size=11 if bold else 9, bold=bold, align='right')
+        pdf.text(right, pdf.y, value, size=11 if bold else 9, bold=bold, align='right')
+        pdf.y -= 18
+
+    pdf.rule(left, PDF_MARGIN + 30, right)
+    pdf.text(PAGE_WIDTH / 2 - _text_width('Thank you for your business!', 9) / 2, PDF_MARGIN + 14,
+             'Thank you for your business!', size=9, bold=True, gray=0.4)
+    return pdf.to_bytes()
+
+
+def load_invoice_document(conn, invoice_id):
+    """(invoice dict, [item dicts]) for rendering, from the archive if need be, or (None, None) if missing."""
+    invoice, schema = locate_invoice(conn, invoice_id)
+    if invoice is None:
+        return None, None
+    items = conn.execute(f'SELECT * FROM {schema}.invoice_items WHERE invoice_id = ? ORDER BY id',
+                         (invoice_id,)).fetchall()
+    return dict(invoice), [dict(item) for item in items]
+
+
+def invoice_pdf_path(invoice, items):
+    """Content-addressed cache path: any change to what is printed changes the name."""
+    payload = json.dumps([PDF_RENDERER_VERSION, COMPANY_INFO, invoice, items],
+                         sort_keys=True, default=str).encode()
+    digest = hashlib.sha256(payload).hexdigest()[:32]
+    return os.path.join(app.config['PDF_CACHE_DIR'], f"{invoice['id']}-{digest}.pdf")
+
+
+def write_invoice_pdf(path, invoice, items, company):
+    """Render and store atomically (also the process-pool work unit)."""
+    data = render_invoice_pdf(invoice, items, company)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def cached_invoice_pdf(conn, invoice_id):
+    """Path to an up-to-date PDF for the invoice (rendering on a miss), or None."""
+    invoice, items = load_invoice_document(conn, invoice_id)
+    if invoice is None:
+        return None
+    path = invoice_pdf_path(invoice, items)
+    if not os.path.exists(path):
+        invalidate_invoice_pdfs(invoice_id)
+        write_invoice_pdf(path, invoice, items, COMPANY_INFO)
+    return path
+
+
+def invalidate_invoice_pdfs(invoice_id):
+    for path in glob.glob(os.path.join(glob.escape(app.config['PDF_CACHE_DIR']), f'{invoice_id}-*.pdf')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def render_invoice_pdfs(invoice_ids, workers=None, progress=None):
+    """
+    Batch-render invoices through a process pool. Invoices whose current
+    content already has a cached file are skipped, so an interrupted run
+    resumes where it stopped. Returns {'rendered': n, 'cached': n, 'missing': n}.
+    """
+    counts = {'rendered': 0, 'cached': 0, 'missing': 0}
+    conn = get_db_connection()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for invoice_id in invoice_ids:
+                invoice, items = load_invoice_document(conn, invoice_id)
+                if invoice is None:
+                    counts['missing'] += 1
+                    continue
+                path = invoice_pdf_path(invoice, items)
+                if os.path.exists(path):
+                    counts['cached'] += 1
+                    continue
+                futures.append(pool.submit(write_invoice_pdf, path, invoice, items, COMPANY_INFO))
+                if len(futures) >= 256:  # bound memory held by queued work
+                    for future in futures:
+                        future.result()
+                    counts['rendered'] += len(futures)
+                    futures.clear()
+                    if progress:
+                        progress(counts)
+            for future in futures:
+                future.result()
+            counts['rendered'] += len(futures)
+    finally:
+        conn.close()
+    return counts
+
+# ==========================================
+# BACKGROUND JOBS (durable, SQLite-backed)
+# ==========================================
+
+# Heavy work is recorded in the jobs table and picked up by worker threads
+# (in-process, or a separate `flask jobs work` process), so requests only pay
+# for an INSERT. A job whose worker stops heartbeating for JOB_LEASE_SECONDS
+# is claimed again by another worker. Only `python app.py` starts in-process
+# workers (JOB_WORKERS of them); under `flask run` or a WSGI server, run
+# `flask jobs work` alongside it or queued jobs are never picked up.
+app.config['JOB_WORKERS'] = int(os.environ.get('BILLING_JOB_WORKERS', 2))
+app.config['JOB_POLL_SECONDS'] = 1.0
+app.config['JOB_LEASE_SECONDS'] = 300
+app.config['JOB_SPOOL_DIR'] = os.environ.get('BILLING_JOB_SPOOL', 'job_spool')
+
+JOB_HANDLERS = {}
+# Kinds that ingest a spooled upload: only their upload route queues them,
+# and an import is not idempotent, so they never get a second attempt
+SPOOLED_JOB_KINDS = set()
+
+
+def job_handler(kind, spooled=False):
+    """Register `fn(conn, payload, job)` as the handler for jobs of `kind`."""
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        if spooled:
+            SPOOLED_JOB_KINDS.add(kind)
+        return fn
+    return register
+
+
+def enqueue_job(conn, kind, payload=None, max_attempts=3, delay=0):
+    """Queue a job inside the caller's transaction; returns its id."""
+    if not isinstance(kind, str) or kind not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind!r}')
+    if kind in SPOOLED_JOB_KINDS:
+        max_attempts = 1
+    now = time.time()
+    cur = conn.execute('''INSERT INTO jobs (kind, payload, max_attempts, run_after, created_at)
+                          VALUES (?, ?, ?, ?, ?)''',
+                       (kind, json.dumps(payload or {}), max_attempts, now + delay, now))
+    return cur.lastrowid
+
+
+class JobContext:
+    """Handed to job handlers for progress reporting (which also renews the lease)."""
+
+    def __init__(self, conn, job_id):
+        self.conn = conn
+        self.id = job_id
+
+    def progress(self, done, total=None):
+        # Inside a handler's own transaction the update simply commits with it
+        standalone = not self.conn.in_transaction
+        self.conn.execute('UPDATE jobs SET progress = ?, total = IFNULL(?, total), locked_at = ? WHERE id = ?',
+                          (done, total, time.time(), self.id))
+        if standalone:
+            self.conn.commit()
+
+
+def claim_job(conn, worker_id):
+    """Atomically take the oldest runnable job (or an expired lease); None if idle."""
+    now = time.time()
+    with write_transaction(conn):
+        return conn.execute('''UPDATE jobs
+                               SET status = 'running', attempts = attempts + 1,
+                                   locked_by = ?, locked_at = ?, error = NULL
+                               WHERE id = (SELECT id FROM jobs
+                                           WHERE (status = 'queued' AND run_after <= ?)
+                                              OR (status = 'running' AND locked_at < ?)
+                                           ORDER BY id LIMIT 1)
+                               RETURNING *''',
+                            (worker_id, now, now, now - app.config['JOB_LEASE_SECONDS'])).fetchone()
+
+
+def run_next_job(conn, worker_id):
+    """Claim and run one job. Returns False when the queue had nothing runnable."""
+    job = claim_job(conn, worker_id)
+    if job is None:
+        return False
+    try:
+        handler = JOB_HANDLERS.get(job['kind'])
+        if handler is None:
+            raise LookupError(f"No handler registered for {job['kind']!r}")
+        with app.app_context():
+            g.audit_actor = f"job:{job['kind']}#{job['id']}"
+            result = handler(conn, json.loads(job['payload']), JobContext(conn, job['id']))
+    except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
+        retry = job['attempts'] < job['max_attempts']
+        # Exponential backoff between attempts: 2s, 4s, 8s, ...
+        conn.execute('''UPDATE jobs SET status = ?, error = ?, run_after = ?, locked_by = NULL,
+                               finished_at = ?
+                        WHERE id = ?''',
+                     ('queued' if retry else 'failed', f'{type(e).__name__}: {e}',
+                      time.time() + 2 ** job['attempts'], None if retry else time.time(), job['id']))
+        conn.commit()
+        app.logger.warning('Job %s (%s) attempt %s failed: %s', job['id'], job['kind'], job['attempts'], e)
+    else:
+        conn.execute('''UPDATE jobs SET status = 'done', result = ?, progress = IFNULL(total, progress),
+                               locked_by = NULL, finished_at = ?
+                        WHERE id = ?''', (json.dumps(result), time.time(), job['id']))
+        conn.commit()
+    return True
+
+
+class JobWorkerPool:
+    """N daemon threads, each with its own connection, polling the jobs table."""
+
+    def __init__(self, size):
+        self.size = size
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for n in range(self.size):
+            thread = threading.Thread(target=self._work, args=(f'{os.getpid()}-{n}',),
+                                      name=f'job-worker-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self, worker_id):
+        conn = get_db_connection()
+        try:
+            while not self._stop.is_set():
+                try:
+                    busy = run_next_job(conn, worker_id)
+                except sqlite3.Error:
+                    app.logger.exception('Job worker %s hit a database error', worker_id)
+                    busy = False
+                if not busy:
+                    self._stop.wait(app.config['JOB_POLL_SECONDS'])
+        finally:
+            conn.close()
+
+
+def job_status(row):
+    status = {key: row[key] for key in ('id', 'kind', 'status', 'attempts', 'max_attempts',
+                                        'progress', 'total', 'error')}
+    status['result'] = json.loads(row['result']) if row['result'] else None
+    status['created_at'] = datetime.fromtimestamp(row['created_at']).isoformat(timespec='seconds')
+    if row['finished_at']:
+        status['finished_at'] = datetime.fromtimestamp(row['finished_at']).isoformat(timespec='seconds')
+    return status
+
+
+def spooled_path(payload):
+    """The upload a spooled job reads, refused unless it resolves inside JOB_SPOOL_DIR."""
+    spool = os.path.realpath(app.config['JOB_SPOOL_DIR'])
+    path = os.path.realpath(str(payload.get('path') or ''))
+    if os.path.dirname(path) != spool:
+        raise ValueError(f'Not a spooled upload: {payload.get("path")!r}')
+    return path
+
+
+@job_handler('import_invoices', spooled=True)
+def _import_invoices_job(conn, payload, job):
+    """Bulk import from a spooled upload (see POST /import?async=1)."""
+    fh = open(spooled_path(payload), 'rb')
+    try:
+        with fh:
+            return import_invoices(conn, iter_import_records(fh, payload['format']),
+                                   payload.get('batch_size', 500),
+                                   progress=lambda r: job.progress(r['rows']))
+    finally:
+        os.remove(fh.name)
+
+
+@job_handler('render_pdfs')
+def _render_pdfs_job(conn, payload, job):
+    """Pre-render PDFs for {'status', 'start', 'end'} filters."""
+    conditions, params = ['deleted_at IS NULL'], []
+    for clause, key in (('status = ?', 'status'), ('date >= ?', 'start'), ('date <= ?', 'end')):
+        if payload.get(key):
+            conditions.append(clause)
+            params.append(payload[key])
+    sql = 'SELECT id FROM invoices WHERE ' + ' AND '.join(conditions)
+    invoice_ids = [row[0] for row in conn.execute(sql + ' ORDER BY id', params)]
+    job.progress(0, len(invoice_ids))
+    return render_invoice_pdfs(invoice_ids, payload.get('workers'),
+                               progress=lambda c: job.progress(c['rendered'] + c['cached']))
+
+# ==========================================
+# AUDIT LOG (append-only, buffered writes)
+# ==========================================
+
+# Every mutation is recorded as who / what / old values / new values. The
+# request only appends to an in-memory buffer; a flusher thread writes the
+# buffer to audit_log with one executemany per AUDIT_FLUSH_SECONDS (sooner
+# once AUDIT_BATCH_SIZE events wait), so a mutation never pays for a second
+# synchronous write. Events are emitted after their change commits, so a
+# rolled-back write is never logged. A hard crash can lose the last flush
+# interval; a normal exit flushes what is left (atexit).
+app.config['AUDIT_FLUSH_SECONDS'] = 1.0
+app.config['AUDIT_BATCH_SIZE'] = 500
+# Header naming the user, set by an authenticating reverse proxy (e.g. X-User).
+# Any client can send headers, so it is only trusted when configured; otherwise
+# (and for requests without it) changes are logged by client address.
+app.config['AUDIT_ACTOR_HEADER'] = os.environ.get('BILLING_AUDIT_ACTOR_HEADER') or None
+
+AUDIT_COLUMNS = ('occurred_at', 'actor', 'action', 'entity', 'entity_id', 'old_values', 'new_values')
+
+
+def audit_actor():
+    """Who a change is attributed to: the request's user, a job (g.audit_actor), else 'system'."""
+    if has_request_context():
+        header = app.config['AUDIT_ACTOR_HEADER']
+        return (header and request.headers.get(header)) or request.remote_addr or 'anonymous'
+    if has_app_context():
+        return g.get('audit_actor', 'system')
+    return 'system'
+
+
+class AuditLog:
+    """Process-wide event buffer drained by a daemon flusher thread."""
+
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # keeps batches in order when flush() is also called directly
+        self._wake = threading.Event()
+        self._thread = None
+        self.written = 0
+
+    def record(self, events):
+        """Buffer [(action, entity, entity_id, old, new), ...]; old/new are dicts or None."""
+        occurred_at = datetime.now().isoformat(timespec='milliseconds')
+        actor = audit_actor()
+        rows = [(occurred_at, actor, action, entity, entity_id,
+                 json.dumps(old, default=str) if old is not None else None,
+                 json.dumps(new, default=str) if new is not None else None)
+                for action, entity, entity_id, old, new in events]
+        if not rows:
+            return
+        with self._lock:
+            self._events.extend(rows)
+            pending = len(self._events)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+                self._thread.start()
+        if pending >= app.config['AUDIT_BATCH_SIZE']:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._events)
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of events written."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._events = self._events, []
+            if not rows:
+                return 0
+            conn = db_pool.acquire()
+            try:
+                with write_transaction(conn):
+                    conn.executemany(f'INSERT INTO audit_log ({", ".join(AUDIT_COLUMNS)}) '
+                                     f'VALUES ({", ".join("?" * len(AUDIT_COLUMNS))})', rows)
+            except Exception:
+                with self._lock:
+                    self._events[:0] = rows  # put them back, ahead of anything newer
+                db_pool.release(conn, discard=True)
+                raise
+            db_pool.release(conn)
+            self.written += len(rows)
+            return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(app.config['AUDIT_FLUSH_SECONDS'])
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                app.logger.exception('Audit log flush failed; %d events kept for the next attempt', self.pending())
+
+
+AUDIT = AuditLog()
+atexit.register(AUDIT.flush)
+
+
+def audit(action, entity, entity_id, old=None, new=None):
+    AUDIT.record([(action, entity, entity_id, old, new)])
+
+
+def invoice_audit_values(customer_name, customer_email, inv_date, due_date, tax_rate, lines, status='Pending'):
+    """New-invoice values from insert_invoice arguments."""
+    subtotal = sum(line[3] for line in lines)
+    return {'customer_name': customer_name, 'customer_email': customer_email, 'date': inv_date,
+            'due_date': due_date, 'status': status, 'tax_rate': tax_rate, 'lines': len(lines),
+            'total_amount': from_cents(invoice_totals(subtotal, tax_rate)[1])}
+
+
+def payment_audit_events(payments, results):
+    """'create' events for allocate_payments input and its results."""
+    return [('create', 'payment', payment_id, None,
+             {'customer_id': payment['customer_id'], 'invoice_id': payment.get('invoice_id'),
+              'amount': from_cents(payment['amount_cents']), 'applied': from_cents(applied),
+              'unapplied': from_cents(unapplied), 'received_on': payment['received_on'],
+              'method': payment.get('method', 'manual'), 'reference': payment.get('reference'),
+              'external_id': payment.get('external_id')})
+            for payment, (payment_id, applied, unapplied) in zip(payments, results)]
+
+
+def _audit_bound(value, end=False):
+    """ISO date or datetime -> occurred_at bound; a bare end date covers that whole day."""
+    if len(value) == 10:
+        day = date.fromisoformat(value)
+        return (day + timedelta(days=1)).isoformat() if end else day.isoformat()
+    return datetime.fromisoformat(value).isoformat(timespec='milliseconds')
+
+
+def query_audit_log(conn, entity=None, entity_id=None, start=None, end=None, actor=None, action=None,
+                    limit=100, after=None):
+    """
+    Newest-first events for an entity (and id) and/or an occurred_at range,
+    served from idx_audit_entity / idx_audit_time. `after` is the cursor of
+    the previous page. Returns (events, next_cursor).
+    """
+    conditions, params = [], []
+    for clause, value in (('entity = ?', entity), ('entity_id = ?', entity_id),
+                          ('actor = ?', actor), ('action = ?', action)):
+        if value is not None:
+            conditions.append(clause)
+            params.append(value)
+    if start:
+        conditions.append('occurred_at >= ?')
+        params.append(_audit_bound(start))
+    if end:
+        conditions.append('occurred_at < ?' if len(end) == 10 else 'occurred_at <= ?')
+        params.append(_audit_bound(end, end=True))
+    if after and len(after) == 2 and all(_cursor_value(v) for v in after):
+        conditions.append('(occurred_at, id) < (?, ?)')
+        params.extend(after)
+    sql = f'SELECT id, {", ".join(AUDIT_COLUMNS)} FROM audit_log'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    rows = conn.execute(sql + ' ORDER BY occurred_at DESC, id DESC LIMIT ?', params + [limit + 1]).fetchall()
+    events = []
+    for row in rows[:limit]:
+        event = dict(row)
+        for key in ('old_values', 'new_values'):
+            event[key] = json.loads(event[key]) if event[key] else None
+        events.append(event)
+    next_cursor = encode_cursor(rows[limit - 1]['occurred_at'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return events, next_cursor
+
+# ==========================================
+# RECURRING INVOICES
+# ==========================================
+
+# A template's next_run_date is its cursor: generating a period and advancing
+# the cursor happen in one transaction, and the advance is guarded on the old
+# value, so a re-run (or two overlapping runs) can never bill a period twice.
+# recurring_invoice_runs records which invoice each period produced.
+RECURRING_BATCH_SIZE = 1000
+
+
+def add_months(anchor, months):
+    """`anchor` moved by whole months, clamped to the end of shorter months."""
+    year, month = divmod(anchor.month - 1 + months, 12)
+    year, month = anchor.year + year, month + 1
+    days = (date(year + month // 12, month % 12 + 1, 1) - date(year, month, 1)).days
+    return date(year, month, min(anchor.day, days))
+
+
+def recurring_periods(template, run_date):
+    """Billing dates still owed by `template` up to and including run_date."""
+    start = date.fromisoformat(template['start_date'])
+    run = date.fromisoformat(template['next_run_date'])
+    n = template['runs']
+    periods = []
+    while run <= run_date:
+        periods.append(run)
+        n += 1
+        run = add_months(start, n * template['interval_months'])
+    return periods, run, n
+
+
+def create_recurring_invoice(conn, customer_name, customer_email, tax_rate, lines,
+                             start_date, interval_months=1, due_days=30):
+    """Store a template with its priced lines (from build_invoice_lines); returns its id."""
+    cur = conn.execute('''INSERT INTO recurring_invoices
+                           (customer_name, customer_email, tax_rate, interval_months, due_days,
+                            start_date, next_run_date, created_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                       (customer_name, customer_email, tax_rate, interval_months, due_days,
+                        start_date, start_date, datetime.now().isoformat(timespec='seconds')))
+    conn.executemany('''INSERT INTO recurring_invoice_items (recurring_id, product_name, quantity, price, price_cents)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     [(cur.lastrowid, name, qty, from_cents(price), price) for name, qty, price, _ in lines])
+    return cur.lastrowid
+
+
+def generate_recurring_invoices(conn, run_date=None, batch_size=RECURRING_BATCH_SIZE, progress=None):
+    """
+    Bill every active template due on or before run_date (default today),
+    catching up on missed periods, in transactions of about `batch_size`
+    invoices. Returns {'templates', 'invoices', 'seconds', 'invoices_per_second'}.
+    """
+    run_date = run_date or date.today()
+    report = {'templates': 0, 'invoices': 0}
+    started = time.perf_counter()
+    after = 0
+    while True:
+        # Templates are read outside the write lock; the guarded cursor update
+        # below discards any that another run advanced in the meantime.
+        templates = conn.execute('''SELECT * FROM recurring_invoices
+                                    WHERE active = 1 AND next_run_date <= ? AND id > ?
+                                    ORDER BY id LIMIT ?''',
+                                 (run_date.isoformat(), after, batch_size)).fetchall()
+        if not templates:
+            break
+        after = templates[-1]['id']
+        lines_by_template = {}
+        marks = ','.join('?' * len(templates))
+        for item in conn.execute(f'''SELECT recurring_id, product_name, quantity, price_cents
+                                     FROM recurring_invoice_items WHERE recurring_id IN ({marks})
+                                     ORDER BY id''', [t['id'] for t in templates]):
+            lines_by_template.setdefault(item['recurring_id'], []).append(
+                (item['product_name'], item['quantity'], item['price_cents'],
+                 item['quantity'] * item['price_cents']))
+
+        with write_transaction(conn):
+            invoice_ids = []
+            for template in templates:
+                lines = lines_by_template.get(template['id'])
+                if not lines:
+                    continue
+                periods, next_run, runs = recurring_periods(template, run_date)
+                claimed = conn.execute('''UPDATE recurring_invoices SET next_run_date = ?, runs = ?
+                                          WHERE id = ? AND next_run_date = ?''',
+                                       (next_run.isoformat(), runs, template['id'],
+                                        template['next_run_date'])).rowcount
+                if not claimed:
+                    continue
+                for period in periods:
+                    due_date = period + timedelta(days=template['due_days'])
+                    invoice_id = insert_invoice(conn, template['customer_name'], template['customer_email'],
+                                                period.isoformat(), due_date.isoformat(),
+                                                template['tax_rate'], lines, index_items=False)
+                    conn.execute('''INSERT INTO recurring_invoice_runs (recurring_id, period, invoice_id)
+                                    VALUES (?, ?, ?)''', (template['id'], period.isoformat(), invoice_id))
+                    invoice_ids.append(invoice_id)
+                report['templates'] += 1
+            refresh_invoice_search_items(conn, invoice_ids)
+        AUDIT.record([('create', 'invoice', invoice_id, None, {'source': 'recurring'}) for invoice_id in invoice_ids])
+        report['invoices'] += len(invoice_ids)
+        if progress:
+            progress(report)
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['invoices_per_second'] = round(report['invoices'] / report['seconds']) if report['seconds'] else None
+    return report
+
+
+@job_handler('generate_recurring')
+def _generate_recurring_job(conn, payload, job):
+    """Bill due recurring templates; {'date': 'YYYY-MM-DD'} overrides today."""
+    run_date = date.fromisoformat(payload['date']) if payload.get('date') else None
+    return generate_recurring_invoices(conn, run_date, payload.get('batch_size', RECURRING_BATCH_SIZE),
+                                       progress=lambda r: job.progress(r['invoices']))
+
+# ==========================================
+# OVERDUE SWEEP
+# ==========================================
+
+# Pending invoices whose due date has passed become Overdue in one UPDATE
+# over idx_invoices_status_due. Besides the CLI / job entry points, the
+# dashboard triggers a sweep lazily, at most once per interval per process.
+app.config['OVERDUE_SWEEP_INTERVAL'] = 300
+
+_lazy_sweep_lock = threading.Lock()
+_lazy_sweep_due = 0.0
+
+
+def sweep_overdue(conn, as_of=None, trigger='manual'):
+    """Flag Pending invoices due before `as_of` (default today) as Overdue; returns the count."""
+    as_of = (as_of or date.today()).isoformat()
+    started = time.perf_counter()
+    with write_transaction(conn):
+        # due_date > '' skips invoices saved without one ("Upon Receipt")
+        ids = [row[0] for row in conn.execute('''UPDATE invoices SET status = 'Overdue'
+                                                 WHERE status = 'Pending' AND due_date > '' AND due_date < ?
+                                                   AND deleted_at IS NULL
+                                                 RETURNING id''', (as_of,))]
+        changed = len(ids)
+        conn.execute('''INSERT INTO overdue_sweeps (ran_at, as_of, trigger, changed, seconds)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     (datetime.now().isoformat(timespec='seconds'), as_of, trigger, changed,
+                      round(time.perf_counter() - started, 4)))
+    AUDIT.record([('status', 'invoice', invoice_id, {'status': 'Pending'}, {'status': 'Overdue'})
+                  for invoice_id in ids])
+    return changed
+
+
+def maybe_sweep_overdue(conn):
+    """Throttled sweep for request paths; never makes a request wait on another sweep."""
+    global _lazy_sweep_due
+    if time.monotonic() < _lazy_sweep_due or not _lazy_sweep_lock.acquire(blocking=False):
+        return None
+    try:
+        _lazy_sweep_due = time.monotonic() + app.config['OVERDUE_SWEEP_INTERVAL']
+        return sweep_overdue(conn, trigger='dashboard')
+    except sqlite3.OperationalError:  # database busy: the next interval will catch up
+        app.logger.warning('Lazy overdue sweep skipped', exc_info=True)
+        return None
+    finally:
+        _lazy_sweep_lock.release()
+
+
+@job_handler('sweep_overdue')
+def _sweep_overdue_job(conn, payload, job):
+    as_of = date.fromisoformat(payload['as_of']) if payload.get('as_of') else None
+    return {'changed': sweep_overdue(conn, as_of, trigger='job')}
+
+# ==========================================
+# CUSTOMERS (balances, statements, credit checks)
+# ==========================================
+
+# Balances live on the customers row (see _migrate_customers), so every
+# figure here is a primary-key read; only the list of open invoices on a
+# statement touches invoices, through idx_invoices_customer.
+
+
+def customer_summary(row):
+    """API/template view of a customers row; available_credit is None without a limit."""
+    limit = row['credit_limit_cents']
+    return {
+        'id': row['id'], 'name': row['name'], 'email': row['email'],
+        'invoice_count': row['invoice_count'], 'revenue': from_cents(row['revenue_cents']),
+        'outstanding': from_cents(row['outstanding_cents']), 'last_invoice_date': row['last_invoice_date'],
+        'credit_limit': None if limit is None else from_cents(limit),
+        'available_credit': None if limit is None else from_cents(limit - row['outstanding_cents']),
+    }
+
+
+def load_customer(conn, customer_id):
+    return conn.execute('SELECT * FROM customers WHERE id = ?', (customer_id,)).fetchone()
+
+
+def customer_statement(conn, customer_id, limit=100):
+    """Balances plus the customer's open invoices, oldest first; None if unknown."""
+    customer = load_customer(conn, customer_id)
+    if customer is None:
+        return None
+    rows = conn.execute('''SELECT id, date, due_date, status, total_cents, paid_cents FROM invoices
+                           WHERE customer_id = ? AND status IN ('Pending', 'Overdue') AND deleted_at IS NULL
+                           ORDER BY date, id LIMIT ?''', (customer_id, limit))
+    statement = customer_summary(customer)
+    statement['open_invoices'] = [{'id': r['id'], 'date': r['date'], 'due_date': r['due_date'],
+                                   'status': r['status'], 'amount': from_cents(r['total_cents']),
+                                   'balance': from_cents(r['total_cents'] - r['paid_cents'])}
+                                  for r in rows]
+    unapplied = conn.execute('SELECT IFNULL(SUM(unapplied_cents), 0) FROM payments WHERE customer_id = ?',
+                             (customer_id,)).fetchone()[0]
+    statement['unapplied_credit'] = from_cents(unapplied)
+    return statement
+
+
+def credit_check(customer, amount_cents):
+    """Would billing `amount_cents` more keep the customer within its credit limit?"""
+    limit = customer['credit_limit_cents']
+    exposure = customer['outstanding_cents'] + amount_cents
+    return {'customer_id': customer['id'], 'amount': from_cents(amount_cents),
+            'outstanding': from_cents(customer['outstanding_cents']),
+            'credit_limit': None if limit is None else from_cents(limit),
+            'approved': limit is None or exposure <= limit}
+
+# ==========================================
+# PAYMENTS (ledger, allocation, bank files)
+# ==========================================
+
+# A payment belongs to a customer and is allocated across that customer's
+# open invoices oldest-first (date, id), after the invoice it names, if any.
+# Allocation is planned in Python over the open invoices read once per
+# batch; the batch then lands as inserts plus ONE set-based UPDATE of
+# invoices (paid_cents, and status -> Paid once settled), all in the
+# caller's transaction. What cannot be allocated stays on the payment as
+# unapplied credit.
+PAYMENT_BATCH_SIZE = 1000
+BANK_FIELDS = ('transaction_id', 'date', 'amount', 'reference', 'payer_name', 'payer_email')
+INVOICE_REFERENCE = re.compile(r'\bINV-?0*(\d+)\b', re.IGNORECASE)
+
+
+def _open_invoices_by_customer(conn, customer_ids):
+    """{customer_id: [[invoice_id, balance_cents], ...]} oldest first, via idx_invoices_customer."""
+    open_invoices = {}
+    ids = sorted(customer_ids)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        for row in conn.execute(f'''SELECT customer_id, id, total_cents - paid_cents FROM invoices
+                                     WHERE customer_id IN ({', '.join('?' * len(chunk))})
+                                       AND status IN ('Pending', 'Overdue') AND total_cents > paid_cents
+                                       AND deleted_at IS NULL
+                                     ORDER BY customer_id, date, id''', chunk):
+            open_invoices.setdefault(row[0], []).append([row[1], row[2]])
+    return open_invoices
+
+
+def allocate_payments(conn, payments):
+    """
+    Record a batch of payments and apply them, inside the caller's write
+    transaction. Each payment is a dict with customer_id, amount_cents and
+    received_on, and optionally invoice_id (settled first), method,
+    reference and external_id. Returns [(payment_id, applied_cents,
+    unapplied_cents), ...] in input order.
+    """
+    open_invoices = _open_invoices_by_customer(conn, {p['customer_id'] for p in payments})
+    by_id = {entry[0]: (customer_id, entry) for customer_id, queue in open_invoices.items() for entry in queue}
+    plans = []
+    for payment in payments:
+        queue = open_invoices.get(payment['customer_id'], [])
+        # The named invoice goes first if it is open and this customer's
+        owner, named = by_id.get(payment.get('invoice_id'), (None, None))
+        first = [named] if owner == payment['customer_id'] else []
+        remaining, allocations = payment['amount_cents'], []
+        for entry in itertools.chain(first, queue):
+            if not remaining:
+                break
+            if entry[1]:
+                applied = min(remaining, entry[1])
+                entry[1] -= applied
+                remaining -= applied
+                allocations.append((entry[0], applied))
+        # Settled invoices leave the head of the queue, so it never gets rescanned
+        settled = 0
+        while settled < len(queue) and not queue[settled][1]:
+            settled += 1
+        del queue[:settled]
+        plans.append((payment, allocations, remaining))
+
+    created_at = datetime.now().isoformat(timespec='seconds')
+    results, rows = [], []
+    for payment, allocations, unapplied in plans:
+        payment_id = conn.execute('''INSERT INTO payments (customer_id, amount_cents, unapplied_cents, received_on,
+                                                           method, reference, external_id, created_at)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                                  (payment['customer_id'], payment['amount_cents'], unapplied,
+                                   payment['received_on'], payment.get('method', 'manual'),
+                                   payment.get('reference'), payment.get('external_id'), created_at)).lastrowid
+        rows.extend((payment_id, invoice_id, amount) for invoice_id, amount in allocations)
+        results.append((payment_id, payment['amount_cents'] - unapplied, unapplied))
+    if rows:
+        conn.executemany('INSERT INTO payment_allocations (payment_id, invoice_id, amount_cents) VALUES (?, ?, ?)',
+                         rows)
+        # The write lock is held, so this batch's payments are exactly the id range
+        conn.execute('''UPDATE invoices
+                        SET paid_cents = invoices.paid_cents + batch.cents,
+                            status = CASE WHEN invoices.paid_cents + batch.cents >= invoices.total_cents
+                                          THEN 'Paid' ELSE invoices.status END
+                        FROM (SELECT invoice_id, SUM(amount_cents) AS cents FROM payment_allocations
+                              WHERE payment_id BETWEEN ? AND ? GROUP BY invoice_id) AS batch
+                        WHERE invoices.id = batch.invoice_id''',
+                     (results[0][0], results[-1][0]))
+    return results
+
+
+def _parse_bank_record(record):
+    """Validate one bank-statement record; returns a partial payment dict."""
+    if '_error' in record:
+        raise ValueError(record['_error'])
+    try:
+        amount = to_cents(record.get('amount'))
+    except ValueError:
+        raise ValueError('amount must be a number.') from None
+    if amount <= 0:
+        raise ValueError('amount must be positive (debits are not payments).')
+    try:
+        received_on = date.fromisoformat(_import_text(record, 'date')).isoformat()
+    except ValueError:
+        raise ValueError('date must be YYYY-MM-DD.') from None
+    reference = _import_text(record, 'reference')
+    match = INVOICE_REFERENCE.search(reference)
+    # A number past SQLite's integer range cannot name an invoice
+    invoice_id = int(match.group(1)) if match and int(match.group(1)) <= SQLITE_INT_MAX else None
+    payer_name = _import_text(record, 'payer_name')
+    payer_email = _import_text(record, 'payer_email')
+    if invoice_id is None and not payer_name and not payer_email:
+        raise ValueError('No invoice reference or payer to match.')
+    return {'amount_cents': amount, 'received_on': received_on, 'reference': reference or None,
+            'external_id': _import_text(record, 'transaction_id') or None,
+            'invoice_id': invoice_id,
+            'lookup_key': customer_key(payer_name, payer_email) if payer_name or payer_email else None,
+            'method': 'bank'}
+
+
+def import_bank_payments(conn, records, batch_size=PAYMENT_BATCH_SIZE, progress=None):
+    """
+    Reconcile a bank statement: each credit is matched to a customer by the
+    invoice number in its reference (INV-00042) or else by payer email/name,
+    then allocated in transactions of `batch_size`. Lines whose
+    transaction_id was already imported are skipped, so a file can be
+    re-run safely. Returns a report like import_invoices.
+    """
+    report = {'rows': 0, 'payments': 0, 'applied': 0.0, 'unapplied': 0.0, 'duplicates': 0,
+              'error_count': 0, 'errors': []}
+    applied = unapplied = 0
+    started = time.perf_counter()
+    pending = []
+
+    def reject(line_number, message):
+        report['error_count'] += 1
+        if len(report['errors']) < IMPORT_MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line_number, 'error': message})
+
+    def flush():
+        nonlocal applied, unapplied
+        with write_transaction(conn):
+            external_ids = [p['external_id'] for _, p in pending if p['external_id']]
+            seen = set()
+            for start in range(0, len(external_ids), 500):
+                chunk = external_ids[start:start + 500]
+                seen.update(r[0] for r in conn.execute(
+                    f"SELECT external_id FROM payments WHERE external_id IN ({', '.join('?' * len(chunk))})", chunk))
+            invoice_ids = sorted({p['invoice_id'] for _, p in pending if p['invoice_id']})
+            invoice_customers = {}
+            for start in range(0, len(invoice_ids), 500):
+                chunk = invoice_ids[start:start + 500]
+                invoice_customers.update(conn.execute(
+                    f"SELECT id, customer_id FROM invoices WHERE id IN ({', '.join('?' * len(chunk))})", chunk))
+            keys = sorted({p['lookup_key'] for _, p in pending if p['lookup_key']})
+            key_customers = {}
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                key_customers.update(conn.execute(
+                    f"SELECT lookup_key, id FROM customers WHERE lookup_key IN ({', '.join('?' * len(chunk))})", chunk))
+
+            batch = []
+            for line_number, payment in pending:
+                if payment['external_id']:
+                    if payment['external_id'] in seen:
+                        report['duplicates'] += 1
+                        continue
+                    seen.add(payment['external_id'])
+                customer_id = invoice_customers.get(payment['invoice_id']) or key_customers.get(payment['lookup_key'])
+                if customer_id is None:
+                    reject(line_number, 'No matching invoice or customer.')
+                    continue
+                if payment['invoice_id'] not in invoice_customers:
+                    payment['invoice_id'] = None
+                batch.append(dict(payment, customer_id=customer_id))
+            results = allocate_payments(conn, batch) if batch else []
+            for _, applied_cents, unapplied_cents in results:
+                applied += applied_cents
+                unapplied += unapplied_cents
+        AUDIT.record(payment_audit_events(batch, results))
+        report['payments'] += len(batch)
+        pending.clear()
+        if progress:
+            progress(report)
+
+    for line_number, record in records:
+        report['rows'] += 1
+        try:
+            pending.append((line_number, _parse_bank_record(record)))
+        except (ValueError, ArithmeticError) as e:
+            reject(line_number, str(e))
+            continue
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+
+    report['applied'], report['unapplied'] = from_cents(applied), from_cents(unapplied)
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['rows_per_second'] = round(report['rows'] / report['seconds']) if report['seconds'] else None
+    return report
+
+
+@job_handler('import_payments', spooled=True)
+def _import_payments_job(conn, payload, job):
+    """Bank-statement reconciliation from a spooled upload (see POST /payments/import?async=1)."""
+    fh = open(spooled_path(payload), 'rb')
+    try:
+        with fh:
+            return import_bank_payments(conn, iter_import_records(fh, payload['format']),
+                                        payload.get('batch_size', PAYMENT_BATCH_SIZE),
+                                        progress=lambda r: job.progress(r['rows']))
+    finally:
+        os.remove(fh.name)
+
+# ==========================================
+# BULK ACTIONS (status state machine)
+# ==========================================
+
+# Allowed status moves. Paid is terminal: money is reversed through the
+# payments ledger, not by editing the status. Only invoices with nothing
+# paid against them may be deleted (moved to the trash, see SOFT DELETE &
+# ARCHIVE), so no allocation is ever orphaned.
+STATUS_TRANSITIONS = {
+    'Draft': ('Pending',),
+    'Pending': ('Paid', 'Overdue', 'Draft'),
+    'Overdue': ('Paid', 'Pending'),
+    'Paid': (),
+}
+DELETABLE_STATUSES = ('Draft', 'Pending', 'Overdue')
+
+
+def statuses_leading_to(status):
+    return tuple(source for source, targets in STATUS_TRANSITIONS.items() if status in targets)
+
+
+def invoice_selection(ids=None, status=None, start=None, end=None, query=None, trash=False):
+    """
+    (WHERE clause, params) over invoices for explicit ids or for the
+    dashboard's filters (status, date range, search term), limited to live
+    invoices or, with trash=True, to trashed ones. Raises ValueError when
+    nothing narrows the selection, so a bare request never means "all".
+    """
+    state = 'deleted_at IS NOT NULL' if trash else 'deleted_at IS NULL'
+    if ids is not None and not isinstance(ids, (list, tuple)):
+        raise ValueError('ids must be a list of invoice numbers.')
+    if ids:
+        try:
+            if any(isinstance(i, bool) or not isinstance(i, (int, str)) for i in ids):
+                raise ValueError
+            ids = sorted({int(i) for i in ids})
+            if not all(0 < i <= SQLITE_INT_MAX for i in ids):
+                raise ValueError
+        except ValueError:
+            raise ValueError('ids must be invoice numbers.') from None
+        return f"id IN ({', '.join('?' * len(ids))}) AND {state}", ids
+    conditions, params = [], []
+    if status:
+        conditions.append('status = ?')
+        params.append(status)
+    for bound, op in ((start, '>='), (end, '<=')):
+        if bound:
+            try:
+                params.append(date.fromisoformat(bound).isoformat())
+            except ValueError:
+                raise ValueError('start and end must be YYYY-MM-DD.') from None
+            conditions.append(f'date {op} ?')
+    search = parse_invoice_search(query)
+    if search and search[0] == 'text' and trash:
+        for condition, param in unindexed_search(query):
+            conditions.append(condition)
+            params.extend(param)
+    elif search and search[0] == 'text':
+        conditions.append('id IN (SELECT rowid FROM invoice_search WHERE invoice_search MATCH ?)')
+        params.append(search[1])
+    elif search:
+        conditions.append('id = ?')
+        params.append(search[1])
+    if not conditions:
+        raise ValueError('Select invoices or give a filter (status, start, end, q).')
+    return ' AND '.join(conditions + [state]), params
+
+
+def bulk_update_status(conn, selection, status, reference='Marked as paid (bulk)'):
+    """
+    Move every selected invoice that the state machine allows to `status`
+    in one transaction; returns {'matched', 'updated', 'skipped'}. Settling
+    to Paid books each open balance as a payment (see allocate_payments),
+    exactly like update_status does for a single invoice.
+    """
+    if status not in STATUS_TRANSITIONS:
+        raise ValueError(f'status must be one of {", ".join(STATUS_TRANSITIONS)}.')
+    where, params = selection
+    sources = statuses_leading_to(status)
+    events = []
+    with write_transaction(conn):
+        matched = conn.execute(f'SELECT count(*) FROM invoices WHERE {where}', params).fetchone()[0]
+        updated = 0
+        if sources:
+            marks = ', '.join('?' * len(sources))
+            previous = {row[0]: row[1] for row in conn.execute(
+                f'SELECT id, status FROM invoices WHERE {where} AND status IN ({marks})', params + list(sources))}
+            if status == 'Paid':
+                owing = conn.execute(f'''SELECT id, customer_id, total_cents - paid_cents FROM invoices
+                                         WHERE {where} AND status IN ({marks}) AND total_cents > paid_cents''',
+                                     params + list(sources)).fetchall()
+                today = date.today().isoformat()
+                for start in range(0, len(owing), PAYMENT_BATCH_SIZE):
+                    payments = [{'customer_id': customer_id, 'amount_cents': balance, 'received_on': today,
+                                 'invoice_id': invoice_id, 'reference': reference}
+                                for invoice_id, customer_id, balance in owing[start:start + PAYMENT_BATCH_SIZE]]
+                    events += payment_audit_events(payments, allocate_payments(conn, payments))
+            # Settled invoices are already Paid; the rest still need the status flip
+            ids = sorted(previous)
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                conn.execute(f"UPDATE invoices SET status = ? WHERE id IN ({', '.join('?' * len(chunk))}) "
+                             "AND status != ?", [status] + chunk + [status])
+            updated = len(ids)
+            events += [('status', 'invoice', invoice_id, {'status': previous[invoice_id]}, {'status': status})
+                       for invoice_id in ids]
+    AUDIT.record(events)
+    return {'matched': matched, 'updated': updated, 'skipped': matched - updated}
+
+
+def bulk_delete_invoices(conn, selection):
+    """Move the selected invoices that may be deleted to the trash; returns {'matched', 'deleted', 'skipped'}."""
+    where, params = selection
+    marks = ', '.join('?' * len(DELETABLE_STATUSES))
+    deleted_at = datetime.now().isoformat(timespec='seconds')
+    with write_transaction(conn):
+        matched = conn.execute(f'SELECT count(*) FROM invoices WHERE {where}', params).fetchone()[0]
+        ids = sorted(row[0] for row in conn.execute(
+            f'''UPDATE invoices SET deleted_at = ?
+                WHERE {where} AND status IN ({marks}) AND paid_cents = 0 RETURNING id''',
+            [deleted_at] + params + list(DELETABLE_STATUSES)))
+    AUDIT.record([('delete', 'invoice', invoice_id, None, {'deleted_at': deleted_at}) for invoice_id in ids])
+    return {'matched': matched, 'deleted': len(ids), 'skipped': matched - len(ids)}
+
+
+def restore_invoices(conn, selection):
+    """Take the selected trashed invoices (invoice_selection(trash=True)) back out; returns {'restored'}."""
+    where, params = selection
+    with write_transaction(conn):
+        trashed = conn.execute(f'SELECT id, deleted_at FROM invoices WHERE {where}', params).fetchall()
+        conn.execute(f'UPDATE invoices SET deleted_at = NULL WHERE {where}', params)
+    AUDIT.record([('restore', 'invoice', row['id'], {'deleted_at': row['deleted_at']}, {'deleted_at': None})
+                  for row in trashed])
+    return {'restored': len(trashed)}
+
+# ==========================================
+# SOFT DELETE & ARCHIVE
+# ==========================================
+
+# Deleting an invoice only stamps deleted_at: triggers take it out of the
+# totals, rollups, balances and search index, and restoring puts it back.
+# Closed invoices (Paid, or trashed) older than ARCHIVE_AFTER_DAYS are moved
+# with their lines and payment allocations into a second SQLite file,
+# ATTACHed as "archive", so the hot tables and their indexes only grow with
+# the open working set. Totals, rollups and customer balances keep archived
+# invoices as history; listings and ad-hoc reads use the hot tables unless
+# asked to include the archive. Archived invoices are read-only.
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('BILLING_ARCHIVE_AFTER_DAYS', 730))
+app.config['ARCHIVE_BATCH_SIZE'] = 1000
+# Defaults to <database>-archive.db next to the ledger
+app.config['ARCHIVE_DB'] = os.environ.get('BILLING_ARCHIVE_DB')
+# (table, column holding the invoice id) moved together, parent first
+ARCHIVE_TABLES = (('invoices', 'id'), ('invoice_items', 'invoice_id'), ('payment_allocations', 'invoice_id'))
+
+
+def archive_path():
+    return app.config['ARCHIVE_DB'] or os.path.splitext(DB_NAME)[0] + '-archive.db'
+
+
+def attach_archive(conn, create=False):
+    """
+    ATTACH the archive as "archive" on this connection (once: it stays
+    attached while pooled) and bring its tables up to the main schema.
+    Returns False when there is no archive file yet and `create` is not
+    set. ATTACH is refused inside a transaction, so call it before one.
+    """
+    if any(row[1] == 'archive' for row in conn.execute('PRAGMA database_list')):
+        return True
+    path = archive_path()
+    if not create and not os.path.exists(path):
+        return False
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    conn.execute('PRAGMA archive.journal_mode = WAL')
+    _sync_archive_schema(conn)
+    return True
+
+
+def _table_column_names(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
 
-# ==========================================
-# DATABASE LAYER (Robust & Migratable)
-# ==========================================
+def _sync_archive_schema(conn):
+    """Archive tables mirror the main columns: types and primary key only, no triggers or foreign keys."""
+    for table, key in ARCHIVE_TABLES:
+        columns = conn.execute(f'PRAGMA main.table_info({table})').fetchall()
+        existing = set(_table_column_names(conn, 'archive', table))
+        if not existing:
+            definitions = ', '.join(f'{col[1]} {col[2]}' + (' PRIMARY KEY' if col[5] else '') for col in columns)
+            conn.execute(f'CREATE TABLE archive.{table} ({definitions})')
+        for col in columns:
+            if existing and col[1] not in existing:
+                conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {col[1]} {col[2]}')
+        if key != 'id':
+            conn.execute(f'CREATE INDEX IF NOT EXISTS archive.idx_{table}_invoice ON {table}({key})')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_invoices_status_id ON invoices(status, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_invoices_date ON invoices(date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_invoices_customer ON invoices(customer_id, date)')
 
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+def invoice_sources(conn, archive=False, trash=False):
+    """
+    (invoices, invoice_items) FROM-clause sources over the hot tables' live
+    rows (trashed ones with trash=True) and, when `archive` is set and an
+    archive exists, the archived ones too. Rows a run has copied but not yet
+    removed from the hot tables are only read from there.
+    """
+    state = 'deleted_at IS NOT NULL' if trash else 'deleted_at IS NULL'
+    invoice_columns = ', '.join(_table_column_names(conn, 'main', 'invoices'))
+    item_columns = ', '.join(_table_column_names(conn, 'main', 'invoice_items'))
+    invoices = f'SELECT {invoice_columns} FROM main.invoices WHERE {state}'
+    items = f'SELECT {item_columns} FROM main.invoice_items'
+    if archive and attach_archive(conn):
+        invoices += (f' UNION ALL SELECT {invoice_columns} FROM archive.invoices'
+                     f' WHERE {state} AND id NOT IN (SELECT id FROM main.invoices)')
+        items += (f' UNION ALL SELECT {item_columns} FROM archive.invoice_items'
+                  ' WHERE invoice_id NOT IN (SELECT id FROM main.invoices)')
+    return f'({invoices})', f'({items})'
 
 
-def init_and_migrate_db():
+def unindexed_search(query):
     """
-    Initializes the DB and handles schema migrations automatically 
-    to prevent errors when adding new features to existing data.
+    [(condition, params), ...] matching each word of a dashboard search in
+    the customer name or email with LIKE, for rows the FTS index does not
+    hold (trashed and archived invoices).
     """
-    conn = get_db_connection()
-    c = conn.cursor()
+    return [('(customer_name LIKE ? OR customer_email LIKE ?)', (f'%{term}%', f'%{term}%'))
+            for term in re.findall(r'\w+', query or '')]
 
-    # 1. Create Tables if they don't exist
-    c.execute('''CREATE TABLE IF NOT EXISTS products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    sku TEXT,
-                    category TEXT,
-                    price REAL NOT NULL
-                )''')
 
-    c.execute('''CREATE TABLE IF NOT EXISTS invoices (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_name TEXT NOT NULL,
-                    customer_email TEXT,
-                    date TEXT NOT NULL,
-                    due_date TEXT,
-                    status TEXT DEFAULT 'Pending',
-                    subtotal REAL DEFAULT 0.0,
-                    tax_rate REAL DEFAULT 0.0,
-                    tax_amount REAL DEFAULT 0.0,
-                    total_amount REAL NOT NULL
-                )''')
+def locate_invoice(conn, invoice_id):
+    """(invoices row, 'main' or 'archive') for an invoice in either database, or (None, None)."""
+    row = conn.execute('SELECT * FROM main.invoices WHERE id = ?', (invoice_id,)).fetchone()
+    if row is not None:
+        return row, 'main'
+    if attach_archive(conn):
+        row = conn.execute('SELECT * FROM archive.invoices WHERE id = ?', (invoice_id,)).fetchone()
+        if row is not None:
+            return row, 'archive'
+    return None, None
 
-    c.execute('''CREATE TABLE IF NOT EXISTS invoice_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    invoice_id INTEGER,
-                    product_name TEXT,
-                    quantity INTEGER,
-                    price REAL,
-                    subtotal REAL,
-                    FOREIGN KEY(invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
-                )''')
 
-    # 2. Smart Migrations (Add columns if they are missing from older versions)
-    def add_column_if_not_exists(table, column, definition):
-        try:
-            c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
-            print(f"Migrated: Added {column} to {table}")
-        except sqlite3.OperationalError:
-            pass  # Column likely exists
-
-    add_column_if_not_exists('products', 'sku', 'TEXT')
-    add_column_if_not_exists('products', 'category', 'TEXT')
-    add_column_if_not_exists('invoices', 'due_date', 'TEXT')
-    add_column_if_not_exists('invoices', 'status', "TEXT DEFAULT 'Pending'")
-    add_column_if_not_exists('invoices', 'subtotal', 'REAL DEFAULT 0.0')
-    add_column_if_not_exists('invoices', 'tax_rate', 'REAL DEFAULT 0.0')
-    add_column_if_not_exists('invoices', 'tax_amount', 'REAL DEFAULT 0.0')
-    add_column_if_not_exists('invoices', 'customer_email', 'TEXT')
-
-    # 3. Seed Data
-    c.execute('SELECT count(*) FROM products')
-    if c.fetchone()[0] == 0:
-        products = [
-            ('Enterprise Laptop X1', 'HW-001', 'Hardware', 1299.99),
-            ('Wireless Ergonomic Mouse', 'ACC-055', 'Accessories', 45.50),
-            ('Mechanical Keyboard', 'ACC-089', 'Accessories', 85.00),
-            ('IT Consultation (Hourly)', 'SVC-101', 'Services', 150.00),
-            ('Software License (Annual)', 'SW-500', 'Software', 599.00)
-        ]
-        c.executemany(
-            'INSERT INTO products (name, sku, category, price) VALUES (?, ?, ?, ?)', products)
-        print("Database seeded with enterprise catalog.")
+def archive_invoices(conn, before=None, batch_size=None, progress=None):
+    """
+    Move invoices closed before `before` (default ARCHIVE_AFTER_DAYS ago):
+    Paid ones dated earlier and trashed ones deleted earlier, in batches of
+    `batch_size`. Returns {'invoices', 'lines', 'skipped', 'before',
+    'seconds', 'invoices_per_second'}.
 
-    conn.commit()
-    conn.close()
+    With WAL a commit is atomic per database file, not across attached
+    ones, so each batch is two transactions: the copy commits to the
+    archive first, then the hot rows whose copy matches (same row_version,
+    still closed) are removed. A run stopped in between leaves copies that
+    reads ignore and the next run replaces.
+    """
+    before = (before or date.today() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])).isoformat()
+    batch_size = batch_size or app.config['ARCHIVE_BATCH_SIZE']
+    attach_archive(conn, create=True)
+    columns = {table: ', '.join(_table_column_names(conn, 'main', table)) for table, _ in ARCHIVE_TABLES}
+    closed = "((status = 'Paid' AND date < :before) OR deleted_at < :before)"
+    report = {'invoices': 0, 'lines': 0, 'skipped': 0, 'before': before}
+    started = time.perf_counter()
+    after = 0
+    while True:
+        ids = [row[0] for row in conn.execute(f'''SELECT id FROM main.invoices
+                                                  WHERE id > :after AND archived_at IS NULL AND {closed}
+                                                  ORDER BY id LIMIT :limit''',
+                                              {'after': after, 'before': before, 'limit': batch_size})]
+        if not ids:
+            break
+        after = ids[-1]
+        marks = ', '.join('?' * len(ids))
+        archived_at = datetime.now().isoformat(timespec='seconds')
 
+        # 1. Copy, replacing anything an interrupted run left for these ids
+        with write_transaction(conn):
+            for table, key in ARCHIVE_TABLES[1:]:
+                conn.execute(f'DELETE FROM archive.{table} WHERE {key} IN ({marks})', ids)
+            for table, key in ARCHIVE_TABLES:
+                conn.execute(f'''INSERT OR REPLACE INTO archive.{table} ({columns[table]})
+                                 SELECT {columns[table]} FROM main.{table} WHERE {key} IN ({marks})''', ids)
+            conn.execute(f'UPDATE archive.invoices SET archived_at = ? WHERE id IN ({marks})', [archived_at] + ids)
 
-# Initialize on start
-init_and_migrate_db()
+        # 2. Remove the hot rows whose copy is current
+        with write_transaction(conn):
+            moved = [row[0] for row in conn.execute(
+                f'''SELECT m.id FROM main.invoices m JOIN archive.invoices a ON a.id = m.id
+                    WHERE m.id IN ({marks}) AND a.row_version = m.row_version
+                      AND ((m.status = 'Paid' AND m.date < ?) OR m.deleted_at < ?)''', ids + [before, before])]
+            stale = sorted(set(ids) - set(moved))
+            if stale:  # changed since the copy: stays hot, and the copy goes
+                stale_marks = ', '.join('?' * len(stale))
+                for table, key in ARCHIVE_TABLES:
+                    conn.execute(f'DELETE FROM archive.{table} WHERE {key} IN ({stale_marks})', stale)
+            if moved:
+                marks = ', '.join('?' * len(moved))
+                # Live invoices stay in the totals; these record which part is archived
+                conn.execute(f'''INSERT INTO invoice_status_totals (status, archived_count)
+                                 SELECT IFNULL(status, ''), count(*) FROM main.invoices
+                                 WHERE id IN ({marks}) AND deleted_at IS NULL GROUP BY 1
+                                 ON CONFLICT(status) DO UPDATE SET
+                                     archived_count = archived_count + excluded.archived_count''', moved)
+                conn.execute(f'''UPDATE customers SET archived_last_date = max(IFNULL(archived_last_date, ''),
+                                                                            moved.last_date)
+                                 FROM (SELECT customer_id, max(date) AS last_date FROM main.invoices
+                                       WHERE id IN ({marks}) AND deleted_at IS NULL GROUP BY customer_id) AS moved
+                                 WHERE customers.id = moved.customer_id''', moved)
+                report['lines'] += conn.execute(f'SELECT count(*) FROM main.invoice_items WHERE invoice_id IN ({marks})',
+                                                moved).fetchone()[0]
+                # archived_at is what tells the delete triggers to leave the aggregates alone
+                conn.execute(f'UPDATE main.invoices SET archived_at = ? WHERE id IN ({marks})', [archived_at] + moved)
+                conn.execute(f'DELETE FROM main.invoices WHERE id IN ({marks})', moved)
+                # foreign_keys=ON cascades these; kept for connections opened without the pragma profile
+                for table, key in ARCHIVE_TABLES[1:]:
+                    conn.execute(f'DELETE FROM main.{table} WHERE {key} IN ({marks})', moved)
+        AUDIT.record([('archive', 'invoice', invoice_id, None, {'archived_at': archived_at}) for invoice_id in moved])
+        report['invoices'] += len(moved)
+        report['skipped'] += len(stale)
+        if progress:
+            progress(report)
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['invoices_per_second'] = round(report['invoices'] / report['seconds']) if report['seconds'] else None
+    return report
+
+
+def rebuild_archive_totals(c):
+    """Recompute invoice_status_totals.archived_count and customers.archived_last_date from the archive."""
+    c.execute('UPDATE invoice_status_totals SET archived_count = 0')
+    c.execute('UPDATE customers SET archived_last_date = NULL')
+    if not any(row[1] == 'archive' for row in c.execute('PRAGMA database_list')):
+        return
+    archived = "archive.invoices WHERE deleted_at IS NULL AND id NOT IN (SELECT id FROM main.invoices)"
+    c.execute(f'''INSERT INTO invoice_status_totals (status, archived_count)
+                  SELECT IFNULL(status, ''), count(*) FROM {archived} GROUP BY 1
+                  ON CONFLICT(status) DO UPDATE SET archived_count = excluded.archived_count''')
+    c.execute(f'''UPDATE customers SET archived_last_date = last.date
+                  FROM (SELECT customer_id, max(date) AS date FROM {archived} GROUP BY customer_id) AS last
+                  WHERE customers.id = last.customer_id''')
+
+
+@job_handler('archive_invoices')
+def _archive_invoices_job(conn, payload, job):
+    """Archive closed invoices; {'before': 'YYYY-MM-DD'} overrides the ARCHIVE_AFTER_DAYS cutoff."""
+    before = date.fromisoformat(payload['before']) if payload.get('before') else None
+    return archive_invoices(conn, before, payload.get('batch_size'), progress=lambda r: job.progress(r['invoices']))
 
 # ==========================================
-# CONFIG & UTILS
+# REPORTS (rollup-backed, optional NumPy)
 # ==========================================
 
-COMPANY_INFO = {
-    "name": "NexusBilling Corp",
-    "address": "123 Innovation Drive, Tech Valley, CA 94043",
-    "email": "finance@nexuscorp.com",
-    "phone": "+1 (555) 019-2834"
-}
+try:
+    import numpy as np
+except ImportError:  # ad-hoc aggregation falls back to plain Python
+    np = None
+
+# Statuses that are not revenue (same rule as the dashboard total)
+NON_REVENUE_STATUSES = ('Draft', '')
+AGING_BUCKETS = (('current', None), ('1-30', 30), ('31-60', 60), ('61-90', 90), ('90+', None))
+
+
+def revenue_series(conn, granularity='month', start=None, end=None):
+    """Revenue, tax and invoice counts per day or month from revenue_daily."""
+    period = 'day' if granularity == 'day' else 'substr(day, 1, 7)'
+    sql = f'''SELECT {period} AS period, SUM(invoice_count) AS invoices, SUM(subtotal_cents) AS subtotal,
+                     SUM(tax_cents) AS tax, SUM(total_cents) AS revenue
+              FROM revenue_daily
+              WHERE status NOT IN (?, ?) AND day >= ? AND day <= ?
+              GROUP BY period HAVING SUM(invoice_count) > 0 ORDER BY period'''
+    rows = conn.execute(sql, NON_REVENUE_STATUSES + (start or '', end or '9999-12-31'))
+    return [{'period': r['period'], 'invoices': r['invoices'], 'subtotal': from_cents(r['subtotal']),
+             'tax': from_cents(r['tax']), 'revenue': from_cents(r['revenue'])} for r in rows]
+
+
+def customer_report(conn, limit=20):
+    rows = conn.execute('''SELECT customer_name, SUM(invoice_count) AS invoices, SUM(total_cents) AS revenue
+                           FROM customer_revenue WHERE status NOT IN (?, ?)
+                           GROUP BY customer_name HAVING SUM(invoice_count) > 0
+                           ORDER BY revenue DESC LIMIT ?''', NON_REVENUE_STATUSES + (limit,))
+    return [{'customer_name': r['customer_name'], 'invoices': r['invoices'],
+             'revenue': from_cents(r['revenue'])} for r in rows]
+
+
+def product_report(conn, start_month=None, end_month=None, limit=20):
+    rows = conn.execute('''SELECT product_name, SUM(line_count) AS lines, SUM(quantity) AS quantity,
+                                  SUM(revenue_cents) AS revenue
+                           FROM product_sales
+                           WHERE status NOT IN (?, ?) AND month >= ? AND month <= ?
+                           GROUP BY product_name HAVING SUM(line_count) > 0
+                           ORDER BY revenue DESC LIMIT ?''',
+                        NON_REVENUE_STATUSES + (start_month or '', end_month or '9999-12', limit))
+    return [{'product_name': r['product_name'], 'lines': r['lines'], 'quantity': r['quantity'],
+             'revenue': from_cents(r['revenue'])} for r in rows]
+
+
+def aging_report(conn, as_of=None):
+    """Open (Pending/Overdue) balances by days past due, read through idx_invoices_status_due."""
+    as_of = (as_of or date.today()).isoformat()
+    report = {name: {'invoices': 0, 'amount': 0.0} for name, _ in AGING_BUCKETS}
+    rows = conn.execute('''SELECT CASE
+                                    WHEN IFNULL(due_date, '') = '' OR due_date >= :as_of THEN 'current'
+                                    WHEN julianday(:as_of) - julianday(due_date) <= 30 THEN '1-30'
+                                    WHEN julianday(:as_of) - julianday(due_date) <= 60 THEN '31-60'
+                                    WHEN julianday(:as_of) - julianday(due_date) <= 90 THEN '61-90'
+                                    ELSE '90+' END AS bucket,
+                                  count(*) AS invoices, SUM(total_cents - paid_cents) AS amount
+                           FROM invoices WHERE status IN ('Pending', 'Overdue') AND deleted_at IS NULL
+                           GROUP BY bucket''', {'as_of': as_of})
+    for row in rows:
+        report[row['bucket']] = {'invoices': row['invoices'], 'amount': from_cents(row['amount'])}
+    return [{'bucket': name, **report[name]} for name, _ in AGING_BUCKETS]
+
+
+def adhoc_revenue(conn, start, end, by='customer', archive=False):
+    """
+    Revenue for an arbitrary date range grouped by 'customer' or 'week'
+    (labelled by its Monday): combinations the rollups don't hold. Reads only
+    the range (idx_invoices_date, in the archive too when `archive` is set)
+    and aggregates with NumPy when installed.
+    """
+    invoices, _ = invoice_sources(conn, archive)
+    rows = conn.execute(f'''SELECT substr(date, 1, 10), customer_name, total_cents FROM {invoices}
+                            WHERE date >= ? AND date <= ? AND IFNULL(status, '') NOT IN (?, ?)''',
+                        (start, end) + NON_REVENUE_STATUSES).fetchall()
+    if not rows:
+        return []
+    days, customers, totals = zip(*rows)
+    if np is not None:
+        if by == 'week':
+            keys = np.array(days, dtype='datetime64[D]')
+            # 1970-01-01 was a Thursday: step back to each date's Monday
+            keys -= ((keys.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+        else:
+            keys = np.array(customers)
+        labels, inverse = np.unique(keys, return_inverse=True)
+        # float64 weights hold whole cents exactly up to 2**53
+        cents = np.bincount(inverse, weights=np.array(totals, dtype=np.float64))
+        groups = zip(labels.astype(str).tolist(), np.bincount(inverse).tolist(),
+                     np.rint(cents).astype(np.int64).tolist())
+    else:
+        acc = {}
+        for day, customer, total in rows:
+            if by == 'week':
+                day = date.fromisoformat(day)
+                key = (day - timedelta(days=day.weekday())).isoformat()
+            else:
+                key = customer
+            count, amount = acc.get(key, (0, 0))
+            acc[key] = (count + 1, amount + total)
+        groups = ((key, count, amount) for key, (count, amount) in acc.items())
+    result = [{by: key, 'invoices': count, 'revenue': from_cents(amount)} for key, count, amount in groups]
+    result.sort(key=lambda r: r[by] if by == 'week' else (-r['revenue'], r[by]))
+    return result
+
+
+def check_report_rollups(conn):
+    """(key, stored, actual) for every rollup figure that has drifted from a recount."""
+    invoices, items = invoice_sources(conn, archive=True)
+    checks = (
+        ('revenue_daily', 'day, status', 'invoice_count, total_cents',
+         "SELECT IFNULL(date, ''), IFNULL(status, ''), count(*), IFNULL(SUM(total_cents), 0) "
+         f"FROM {invoices} GROUP BY 1, 2"),
+        ('customer_revenue', 'customer_name, status', 'invoice_count, total_cents',
+         "SELECT customer_name, IFNULL(status, ''), count(*), IFNULL(SUM(total_cents), 0) "
+         f"FROM {invoices} GROUP BY 1, 2"),
+        ('product_sales', 'month, product_name, status', 'line_count, revenue_cents',
+         "SELECT substr(IFNULL(i.date, ''), 1, 7), IFNULL(l.product_name, ''), IFNULL(i.status, ''), "
+         f"count(*), IFNULL(SUM(l.subtotal_cents), 0) FROM {items} l JOIN {invoices} i ON i.id = l.invoice_id "
+         "GROUP BY 1, 2, 3"),
+    )
+    mismatches = []
+    for table, key_columns, value_columns, recount in checks:
+        stored = {tuple(r[:-2]): tuple(r[-2:]) for r in conn.execute(
+            f'SELECT {key_columns}, {value_columns} FROM {table}')}
+        actual = {tuple(r[:-2]): tuple(r[-2:]) for r in conn.execute(recount)}
+        for key in sorted(set(stored) | set(actual)):
+            if stored.get(key, (0, 0)) != actual.get(key, (0, 0)):
+                mismatches.append((f'{table}{key}', stored.get(key), actual.get(key)))
+    return mismatches
 
 # ==========================================
 # FRONTEND TEMPLATES (NO 3RD PARTY DEPENDENCIES)
 # ==========================================
 
+# Shared stylesheet and script, served as fingerprinted assets (see STATIC
+# ASSETS & COMPRESSION) rather than repeated inline in every page.
+BASE_CSS = """
+/* Custom lightweight CSS Reset & Framework */
+:root {
+    --primary: #2563eb;
+    --primary-dark: #1e40af;
+    --secondary: #64748b;
+    --success: #16a34a;
+    --danger: #dc2626;
+    --warning: #ca8a04;
+    --light: #f8fafc;
+    --dark: #0f172a;
+    --border: #e2e8f0;
+    --sidebar-bg: #1e293b;
+    --text-main: #334155;
+}
+
+body { 
+    margin: 0; 
+    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; 
+    background: var(--light); 
+    color: var(--text-main);
+    display: flex;
+    min-height: 100vh;
+}
+
+* { box-sizing: border-box; }
+
+/* Sidebar */
+.sidebar {
+    width: 260px;
+    background-color: var(--sidebar-bg);
+    color: #94a3b8;
+    position: fixed;
+    top: 0; left: 0; bottom: 0;
+    padding: 20px;
+    display: flex;
+    flex-direction: column;
+    z-index: 100;
+}
+
+.sidebar-brand {
+    color: white;
+    font-size: 1.3rem;
+    font-weight: 700;
+    margin-bottom: 30px;
+    text-decoration: none;
+    display: flex;
+    align-items: center;
+    gap: 10px;
+}
+
+.nav-link {
+    color: inherit;
+    padding: 12px 15px;
+    text-decoration: none;
+    border-radius: 6px;
+    margin-bottom: 5px;
+    display: block;
+    transition: background 0.2s;
+}
+
+.nav-link:hover, .nav-link.active {
+    background-color: rgba(255,255,255,0.1);
+    color: white;
+}
+
+/* Layout */
+.main-content {
+    margin-left: 260px;
+    padding: 30px;
+    width: 100%;
+    max-width: 1400px;
+}
+
+/* Typography & Utils */
+h1, h2, h3, h4, h5 { margin-top: 0; color: var(--dark); }
+.text-secondary { color: var(--secondary); font-size: 0.9em; }
+.text-primary { color: var(--primary); }
+.text-danger { color: var(--danger); }
+.text-success { color: var(--success); }
+.text-end { text-align: right; }
+.text-center { text-align: center; }
+.fw-bold { font-weight: bold; }
+.small { font-size: 0.85em; }
+.d-flex { display: flex; }
+.justify-content-between { justify-content: space-between; }
+.align-items-center { align-items: center; }
+.gap-2 { gap: 10px; }
+.mb-3 { margin-bottom: 1rem; }
+.mb-4 { margin-bottom: 1.5rem; }
+
+/* Components */
+.card {
+    background: white;
+    border: 1px solid var(--border);
+    border-radius: 8px;
+    box-shadow: 0 1px 3px rgba(0,0,0,0.05);
+    margin-bottom: 20px;
+    overflow: hidden;
+}
+
+.card-header {
+    background: #f8fafc;
+    padding: 15px 20px;
+    border-bottom: 1px solid var(--border);
+    font-weight: 600;
+    display: flex;
+    justify-content: space-between;
+    align-items: center;
+}
+
+.card-body { padding: 20px; }
+.card-footer { padding: 15px 20px; background: #fff; border-top: 1px solid var(--border); }
+
+/* Buttons */
+.btn {
+    display: inline-flex;
+    align-items: center;
+    padding: 8px 16px;
+    border-radius: 6px;
+    border: 1px solid transparent;
+    font-size: 0.9rem;
+    cursor: pointer;
+    text-decoration: none;
+    font-weight: 500;
+    gap: 6px;
+}
+.btn-primary { background: var(--primary); color: white; }
+.btn-primary:hover { background: var(--primary-dark); }
+.btn-success { background: var(--success); color: white; }
+.btn-outline { background: white; border-color: var(--border); color: var(--text-main); }
+.btn-outline:hover { background: #f1f5f9; }
+.btn-danger { background: #fee2e2; color: #991b1b; border: 1px solid #fecaca; }
+.btn-sm { padding: 4px 10px; font-size: 0.8rem; }
+.btn-link { background: none; border: none; padding: 0; color: var(--danger); text-decoration: underline; cursor: pointer; }
+
+/* Forms */
+.form-control, .form-select {
+    display: block;
+    width: 100%;
+    padding: 9px 12px;
+    font-size: 0.95rem;
+    color: var(--text-main);
+    border: 1px solid var(--border);
+    border-radius: 6px;
+    margin-top: 5px;
+}
+.input-group { display: flex; align-items: stretch; }
+.input-group-text { background: #f1f5f9; padding: 0 12px; border: 1px solid var(--border); border-right: none; display: flex; align-items: center; border-radius: 6px 0 0 6px; }
+.input-group .form-control { border-top-left-radius: 0; border-bottom-left-radius: 0; margin-top: 0; }
+
+/* Tables */
+.table-responsive { overflow-x: auto; }
+.table { width: 100%; border-collapse: collapse; text-align: left; }
+.table th { background: #f8fafc; padding: 12px 15px; border-bottom: 2px solid var(--border); font-size: 0.75rem; text-transform: uppercase; color: var(--secondary); }
+.table td { padding: 12px 15px; border-bottom: 1px solid var(--border); vertical-align: middle; }
+.table tr:hover { background-color: #f8fafc; }
+
+/* Alerts */
+.alert { padding: 15px; margin-bottom: 20px; border-radius: 6px; border: 1px solid transparent; display: flex; justify-content: space-between; align-items: center; }
+.alert-success { background: #dcfce7; color: #166534; border-color: #bbf7d0; }
+.alert-danger { background: #fee2e2; color: #991b1b; border-color: #fecaca; }
+.alert-warning { background: #fef3c7; color: #92400e; border-color: #fde68a; }
+.alert-close { background: none; border: none; font-size: 1.2rem; cursor: pointer; color: inherit; opacity: 0.7; }
+
+/* Badges */
+.status-badge { padding: 4px 10px; border-radius: 20px; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; }
+.status-paid { background: #dcfce7; color: #166534; }
+.status-pending { background: #fef9c3; color: #854d0e; }
+.status-overdue { background: #fee2e2; color: #991b1b; }
+
+/* Dropdown Simple */
+.dropdown { position: relative; display: inline-block; }
+.dropdown-menu { display: none; position: absolute; right: 0; background: white; border: 1px solid var(--border); box-shadow: 0 4px 6px -1px rgba(0,0,0,0.1); border-radius: 6px; min-width: 150px; z-index: 50; }
+.dropdown-menu.show { display: block; }
+.dropdown-item { display: block; width: 100%; text-align: left; padding: 8px 16px; background: none; border: none; cursor: pointer; color: var(--text-main); }
+.dropdown-item:hover { background: #f1f5f9; }
+
+/* Grid System (Simple) */
+.row { display: flex; flex-wrap: wrap; margin: -10px; }
+.col { flex: 1; padding: 10px; }
+.col-3 { width: 25%; padding: 10px; }
+.col-4 { width: 33.333%; padding: 10px; }
+.col-6 { width: 50%; padding: 10px; }
+.col-8 { width: 66.666%; padding: 10px; }
+
+/* Dashboard Specific Grid */
+.stats-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(240px, 1fr)); gap: 20px; margin-bottom: 30px; }
+
+@media (max-width: 768px) {
+    .sidebar { display: none; }
+    .main-content { margin-left: 0; width: 100%; }
+    .col-3, .col-4, .col-6, .col-8 { width: 100%; }
+}
+
+@media print {
+    .no-print, .sidebar { display: none !important; }
+    .main-content { margin: 0; padding: 0; }
+    .card { border: none; box-shadow: none; }
+}
+"""
+
+BASE_JS = """
+// Simple Dropdown Toggle
+document.addEventListener('click', function(e) {
+    const isDropdownButton = e.target.matches('[data-toggle="dropdown"]');
+    if (!isDropdownButton && e.target.closest('.dropdown') != null) return;
+
+    let currentDropdown;
+    if (isDropdownButton) {
+        currentDropdown = e.target.closest('.dropdown').querySelector('.dropdown-menu');
+        currentDropdown.classList.toggle('show');
+    }
+
+    document.querySelectorAll('.dropdown-menu.show').forEach(menu => {
+        if (menu !== currentDropdown) {
+            menu.classList.remove('show');
+        }
+    });
+});
+"""
+
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -119,206 +3400,7 @@ HTML_TEMPLATE = """
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>NexusBilling | Enterprise Suite</title>
     
-    <style>
-        /* Custom lightweight CSS Reset & Framework */
-        :root {
-            --primary: #2563eb;
-            --primary-dark: #1e40af;
-            --secondary: #64748b;
-            --success: #16a34a;
-            --danger: #dc2626;
-            --warning: #ca8a04;
-            --light: #f8fafc;
-            --dark: #0f172a;
-            --border: #e2e8f0;
-            --sidebar-bg: #1e293b;
-            --text-main: #334155;
-        }
-
-        body { 
-            margin: 0; 
-            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; 
-            background: var(--light); 
-            color: var(--text-main);
-            display: flex;
-            min-height: 100vh;
-        }
-        
-        * { box-sizing: border-box; }
-
-        /* Sidebar */
-        .sidebar {
-            width: 260px;
-            background-color: var(--sidebar-bg);
-            color: #94a3b8;
-            position: fixed;
-            top: 0; left: 0; bottom: 0;
-            padding: 20px;
-            display: flex;
-            flex-direction: column;
-            z-index: 100;
-        }
-
-        .sidebar-brand {
-            color: white;
-            font-size: 1.3rem;
-            font-weight: 700;
-            margin-bottom: 30px;
-            text-decoration: none;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-
-        .nav-link {
-            color: inherit;
-            padding: 12px 15px;
-            text-decoration: none;
-            border-radius: 6px;
-            margin-bottom: 5px;
-            display: block;
-            transition: background 0.2s;
-        }
-
-        .nav-link:hover, .nav-link.active {
-            background-color: rgba(255,255,255,0.1);
-            color: white;
-        }
-        
-        /* Layout */
-        .main-content {
-            margin-left: 260px;
-            padding: 30px;
-            width: 100%;
-            max-width: 1400px;
-        }
-
-        /* Typography & Utils */
-        h1, h2, h3, h4, h5 { margin-top: 0; color: var(--dark); }
-        .text-secondary { color: var(--secondary); font-size: 0.9em; }
-        .text-primary { color: var(--primary); }
-        .text-danger { color: var(--danger); }
-        .text-success { color: var(--success); }
-        .text-end { text-align: right; }
-        .text-center { text-align: center; }
-        .fw-bold { font-weight: bold; }
-        .small { font-size: 0.85em; }
-        .d-flex { display: flex; }
-        .justify-content-between { justify-content: space-between; }
-        .align-items-center { align-items: center; }
-        .gap-2 { gap: 10px; }
-        .mb-3 { margin-bottom: 1rem; }
-        .mb-4 { margin-bottom: 1.5rem; }
-        
-        /* Components */
-        .card {
-            background: white;
-            border: 1px solid var(--border);
-            border-radius: 8px;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.05);
-            margin-bottom: 20px;
-            overflow: hidden;
-        }
-        
-        .card-header {
-            background: #f8fafc;
-            padding: 15px 20px;
-            border-bottom: 1px solid var(--border);
-            font-weight: 600;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        
-        .card-body { padding: 20px; }
-        .card-footer { padding: 15px 20px; background: #fff; border-top: 1px solid var(--border); }
-
-        /* Buttons */
-        .btn {
-            display: inline-flex;
-            align-items: center;
-            padding: 8px 16px;
-            border-radius: 6px;
-            border: 1px solid transparent;
-            font-size: 0.9rem;
-            cursor: pointer;
-            text-decoration: none;
-            font-weight: 500;
-            gap: 6px;
-        }
-        .btn-primary { background: var(--primary); color: white; }
-        .btn-primary:hover { background: var(--primary-dark); }
-        .btn-success { background: var(--success); color: white; }
-        .btn-outline { background: white; border-color: var(--border); color: var(--text-main); }
-        .btn-outline:hover { background: #f1f5f9; }
-        .btn-danger { background: #fee2e2; color: #991b1b; border: 1px solid #fecaca; }
-        .btn-sm { padding: 4px 10px; font-size: 0.8rem; }
-        .btn-link { background: none; border: none; padding: 0; color: var(--danger); text-decoration: underline; cursor: pointer; }
-
-        /* Forms */
-        .form-control, .form-select {
-            display: block;
-            width: 100%;
-            padding: 9px 12px;
-            font-size: 0.95rem;
-            color: var(--text-main);
-            border: 1px solid var(--border);
-            border-radius: 6px;
-            margin-top: 5px;
-        }
-        .input-group { display: flex; align-items: stretch; }
-        .input-group-text { background: #f1f5f9; padding: 0 12px; border: 1px solid var(--border); border-right: none; display: flex; align-items: center; border-radius: 6px 0 0 6px; }
-        .input-group .form-control { border-top-left-radius: 0; border-bottom-left-radius: 0; margin-top: 0; }
-
-        /* Tables */
-        .table-responsive { overflow-x: auto; }
-        .table { width: 100%; border-collapse: collapse; text-align: left; }
-        .table th { background: #f8fafc; padding: 12px 15px; border-bottom: 2px solid var(--border); font-size: 0.75rem; text-transform: uppercase; color: var(--secondary); }
-        .table td { padding: 12px 15px; border-bottom: 1px solid var(--border); vertical-align: middle; }
-        .table tr:hover { background-color: #f8fafc; }
-
-        /* Alerts */
-        .alert { padding: 15px; margin-bottom: 20px; border-radius: 6px; border: 1px solid transparent; display: flex; justify-content: space-between; align-items: center; }
-        .alert-success { background: #dcfce7; color: #166534; border-color: #bbf7d0; }
-        .alert-danger { background: #fee2e2; color: #991b1b; border-color: #fecaca; }
-        .alert-close { background: none; border: none; font-size: 1.2rem; cursor: pointer; color: inherit; opacity: 0.7; }
-
-        /* Badges */
-        .status-badge { padding: 4px 10px; border-radius: 20px; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; }
-        .status-paid { background: #dcfce7; color: #166534; }
-        .status-pending { background: #fef9c3; color: #854d0e; }
-        .status-overdue { background: #fee2e2; color: #991b1b; }
-
-        /* Dropdown Simple */
-        .dropdown { position: relative; display: inline-block; }
-        .dropdown-menu { display: none; position: absolute; right: 0; background: white; border: 1px solid var(--border); box-shadow: 0 4px 6px -1px rgba(0,0,0,0.1); border-radius: 6px; min-width: 150px; z-index: 50; }
-        .dropdown-menu.show { display: block; }
-        .dropdown-item { display: block; width: 100%; text-align: left; padding: 8px 16px; background: none; border: none; cursor: pointer; color: var(--text-main); }
-        .dropdown-item:hover { background: #f1f5f9; }
-
-        /* Grid System (Simple) */
-        .row { display: flex; flex-wrap: wrap; margin: -10px; }
-        .col { flex: 1; padding: 10px; }
-        .col-3 { width: 25%; padding: 10px; }
-        .col-4 { width: 33.333%; padding: 10px; }
-        .col-6 { width: 50%; padding: 10px; }
-        .col-8 { width: 66.666%; padding: 10px; }
-        
-        /* Dashboard Specific Grid */
-        .stats-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(240px, 1fr)); gap: 20px; margin-bottom: 30px; }
-
-        @media (max-width: 768px) {
-            .sidebar { display: none; }
-            .main-content { margin-left: 0; width: 100%; }
-            .col-3, .col-4, .col-6, .col-8 { width: 100%; }
-        }
-        
-        @media print {
-            .no-print, .sidebar { display: none !important; }
-            .main-content { margin: 0; padding: 0; }
-            .card { border: none; box-shadow: none; }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
 </head>
 <body>
 
@@ -336,6 +3418,9 @@ HTML_TEMPLATE = """
         <a class="nav-link {% if request.path == '/products' %}active{% endif %}" href="/products">
             🏷️ Inventory
         </a>
+        <a class="nav-link {% if request.path == '/reports' %}active{% endif %}" href="/reports">
+            📈 Reports
+        </a>
     </div>
     <div style="border-top: 1px solid #334155; padding-top: 20px;">
          <a class="nav-link" href="#" onclick="alert('Settings module is a placeholder.')">
@@ -359,33 +3444,14 @@ HTML_TEMPLATE = """
     {% block content %}{% endblock %}
 </main>
 
-<!-- Minimal Vanilla JS -->
-<script>
-    // Simple Dropdown Toggle
-    document.addEventListener('click', function(e) {
-        const isDropdownButton = e.target.matches('[data-toggle="dropdown"]');
-        if (!isDropdownButton && e.target.closest('.dropdown') != null) return;
-        
-        let currentDropdown;
-        if (isDropdownButton) {
-            currentDropdown = e.target.closest('.dropdown').querySelector('.dropdown-menu');
-            currentDropdown.classList.toggle('show');
-        }
-        
-        document.querySelectorAll('.dropdown-menu.show').forEach(menu => {
-            if (menu !== currentDropdown) {
-                menu.classList.remove('show');
-            }
-        });
-    });
-</script>
+<script src="{{ asset_url('app.js') }}"></script>
 {% block scripts %}{% endblock %}
 </body>
 </html>
 """
 
 DASHBOARD_TEMPLATE = """
-{% extends "base" %}
+{% extends "base.html" %}
 {% block content %}
 <div class="d-flex justify-content-between align-items-center mb-4">
     <div>
@@ -395,8 +3461,11 @@ DASHBOARD_TEMPLATE = """
     <div class="d-flex gap-2">
         <form class="d-flex" action="/" method="GET">
             <input class="form-control" style="margin-top:0; margin-right: 10px;" type="search" name="q" placeholder="Search invoices..." value="{{ request.args.get('q', '') }}">
+            {% if trash %}<input type="hidden" name="trash" value="1">{% endif %}
+            {% if archive %}<input type="hidden" name="archive" value="1">{% endif %}
             <button class="btn btn-primary" type="submit">🔍</button>
         </form>
+        <a href="{{ url_for('export_invoices', fmt='csv', status=request.args.get('status') or None, archive=1 if archive else None) }}" class="btn btn-outline">⬇ Export</a>
         <a href="/create_invoice" class="btn btn-primary"><span>+</span> New Invoice</a>
     </div>
 </div>
@@ -415,7 +3484,8 @@ DASHBOARD_TEMPLATE = """
         <div class="card-body">
             <div class="text-secondary fw-bold small" style="text-transform: uppercase;">Pending Payments</div>
             <h2 class="text-warning" style="margin: 10px 0;">${{ "%.2f"|format(pending_amount) }}</h2>
-            <div class="text-secondary small">{{ pending_count }} invoices awaiting</div>
+            <div class="text-secondary small">{{ pending_count }} invoices awaiting
+                {% if overdue_count %}· <a href="/?status=Overdue" class="text-danger">{{ overdue_count }} overdue (${{ "%.2f"|format(overdue_amount) }})</a>{% endif %}</div>
         </div>
     </div>
     <!-- Count Card -->
@@ -438,7 +3508,24 @@ DASHBOARD_TEMPLATE = """
 
 <div class="card">
     <div class="card-header">
-        <span>Recent Invoices</span>
+        <span>{{ 'Trash' if trash else 'Recent Invoices' }}{% if archive %} <span class="text-secondary small">(including archive)</span>{% endif %}</span>
+        {% if not trash %}
+        <form id="bulk-form" action="{{ url_for('bulk_status') }}" method="POST" class="d-flex gap-2 align-items-center" style="margin-left: auto; margin-right: 10px;">
+            {% if request.args.get('status') or request.args.get('q') %}
+            <label class="small text-secondary" title="Apply to every invoice matching the current filter, not just this page">
+                <input type="checkbox" id="bulk-all" onchange="toggleBulkScope(this)"> All matching
+            </label>
+            <input type="hidden" name="status" value="{{ request.args.get('status', '') }}" class="bulk-filter" disabled>
+            <input type="hidden" name="q" value="{{ request.args.get('q', '') }}" class="bulk-filter" disabled>
+            {% endif %}
+            <select name="to" class="form-select" style="margin-top: 0; width: auto;">
+                {% for target in ['Paid', 'Pending', 'Overdue', 'Draft'] %}<option>{{ target }}</option>{% endfor %}
+            </select>
+            <button class="btn btn-outline btn-sm">Set Status</button>
+            <button class="btn btn-danger btn-sm" formaction="{{ url_for('bulk_delete') }}"
+                    onclick="return confirm('Move the selected invoices to the trash?');">🗑 Delete</button>
+        </form>
+        {% endif %}
         <div class="dropdown">
             <button class="btn btn-outline btn-sm" data-toggle="dropdown">
                 Filter Status ▼
@@ -448,6 +3535,8 @@ DASHBOARD_TEMPLATE = """
                 <a class="dropdown-item" href="/?status=Paid">Paid</a>
                 <a class="dropdown-item" href="/?status=Pending">Pending</a>
                 <a class="dropdown-item" href="/?status=Overdue">Overdue</a>
+                <a class="dropdown-item" href="{{ url_for('index', status=request.args.get('status') or None, trash=1 if trash else None, archive=None if archive else 1) }}">{{ 'Hide' if archive else 'Include' }} archive</a>
+                <a class="dropdown-item" href="{{ url_for('index', trash=None if trash else 1) }}">{{ 'Back to invoices' if trash else 'Trash' }}</a>
             </div>
         </div>
     </div>
@@ -455,6 +3544,7 @@ DASHBOARD_TEMPLATE = """
         <table class="table">
             <thead>
                 <tr>
+                    <th style="width: 30px;"><input type="checkbox" title="Select page" onchange="document.querySelectorAll('.bulk-id:not(:disabled)').forEach(box => box.checked = this.checked)"></th>
                     <th>Invoice</th>
                     <th>Date Issued</th>
                     <th>Due Date</th>
@@ -467,6 +3557,7 @@ DASHBOARD_TEMPLATE = """
             <tbody>
                 {% for invoice in invoices %}
                 <tr>
+                    <td><input type="checkbox" name="ids" value="{{ invoice.id }}" form="bulk-form" class="bulk-id"{% if invoice.archived_at or invoice.deleted_at %} disabled{% endif %}></td>
                     <td class="fw-bold text-primary">#{{ "%05d"|format(invoice.id) }}</td>
                     <td>{{ invoice.date }}</td>
                     <td class="text-secondary">{{ invoice.due_date or '-' }}</td>
@@ -478,18 +3569,26 @@ DASHBOARD_TEMPLATE = """
                         <span class="status-badge status-{{ invoice.status.lower() }}">
                             {{ invoice.status }}
                         </span>
+                        {% if invoice.archived_at %}<span class="text-secondary small" title="Archived {{ invoice.archived_at }}">Archived</span>{% endif %}
                     </td>
                     <td class="text-end">
                         <a href="/invoice/{{ invoice.id }}" class="btn btn-outline btn-sm">View</a>
+                        {% if invoice.archived_at %}
+                        {% elif invoice.deleted_at %}
+                        <form action="{{ url_for('restore_invoice', id=invoice.id) }}" method="POST" style="display:inline;">
+                            <button type="submit" class="btn btn-outline btn-sm" title="Deleted {{ invoice.deleted_at }}">↺ Restore</button>
+                        </form>
+                        {% else %}
                         <!-- Delete Form -->
-                        <form action="/delete_invoice/{{ invoice.id }}" method="POST" style="display:inline;" onsubmit="return confirm('Permanently delete this invoice?');">
+                        <form action="/delete_invoice/{{ invoice.id }}" method="POST" style="display:inline;" onsubmit="return confirm('Move this invoice to the trash?');">
                             <button type="submit" class="btn btn-danger btn-sm" title="Delete">🗑</button>
                         </form>
+                        {% endif %}
                     </td>
                 </tr>
                 {% else %}
                 <tr>
-                    <td colspan="7" class="text-center" style="padding: 40px;">
+                    <td colspan="8" class="text-center" style="padding: 40px;">
                         <div style="font-size: 2rem; opacity: 0.3; margin-bottom: 10px;">🔍</div>
                         No invoices found matching your criteria.
                     </td>
@@ -498,21 +3597,41 @@ DASHBOARD_TEMPLATE = """
             </tbody>
         </table>
     </div>
-    {% if pages > 1 %}
-    <div class="card-footer text-center">
+    {% if prev_cursor or next_cursor or match_count %}
+    {% set q = request.args.get('q') or None %}
+    {% set status = request.args.get('status') or None %}
+    {% set scope = {'trash': 1 if trash else None, 'archive': 1 if archive else None} %}
+    <div class="card-footer d-flex justify-content-between align-items-center">
+        <span class="text-secondary small">
+            {% if match_count is not none %}{{ match_count }} invoice{{ 's' if match_count != 1 }}{% endif %}
+        </span>
         <div style="display: inline-flex; gap: 5px;">
-            <button class="btn btn-outline btn-sm" disabled>Previous</button>
-            <button class="btn btn-primary btn-sm">1</button>
-            <button class="btn btn-outline btn-sm">Next</button>
+            {% if prev_cursor %}
+            <a class="btn btn-outline btn-sm" href="{{ url_for('index', q=q, status=status, before=prev_cursor, **scope) }}">← Newer</a>
+            {% else %}
+            <button class="btn btn-outline btn-sm" disabled>← Newer</button>
+            {% endif %}
+            {% if next_cursor %}
+            <a class="btn btn-outline btn-sm" href="{{ url_for('index', q=q, status=status, after=next_cursor, **scope) }}">Older →</a>
+            {% else %}
+            <button class="btn btn-outline btn-sm" disabled>Older →</button>
+            {% endif %}
         </div>
     </div>
     {% endif %}
 </div>
+<script>
+    // "All matching" sends the filter instead of the ticked rows
+    function toggleBulkScope(box) {
+        document.querySelectorAll('.bulk-filter').forEach(input => input.disabled = !box.checked);
+        document.querySelectorAll('.bulk-id').forEach(input => { input.disabled = box.checked; });
+    }
+</script>
 {% endblock %}
 """
 
 PRODUCTS_TEMPLATE = """
-{% extends "base" %}
+{% extends "base.html" %}
 {% block content %}
 <div class="row">
     <!-- Add/Edit Form Area -->
@@ -632,7 +3751,7 @@ PRODUCTS_TEMPLATE = """
 """
 
 CREATE_INVOICE_TEMPLATE = """
-{% extends "base" %}
+{% extends "base.html" %}
 {% block content %}
 <form id="invoiceForm" action="/save_invoice" method="POST">
     <div class="d-flex justify-content-between align-items-center mb-4">
@@ -678,7 +3797,7 @@ CREATE_INVOICE_TEMPLATE = """
                     <h5 style="margin-bottom: 10px;">Tax Settings</h5>
                     <div class="input-group">
                         <span class="input-group-text">Tax Rate %</span>
-                        <input type="number" id="taxRateInput" name="tax_rate" class="form-control" value="0" min="0" step="0.1" onchange="calculateTotals()">
+                        <input type="number" id="taxRateInput" name="tax_rate" class="form-control" value="0" min="0" max="100" step="0.1" onchange="calculateTotals()">
                     </div>
                 </div>
             </div>
@@ -742,29 +3861,27 @@ CREATE_INVOICE_TEMPLATE = """
 </form>
 
 <script>
-    const products = {{ products_json | safe }};
     const tbody = document.getElementById('itemsBody');
+    const lookupResults = {};  // rowId -> {product name: price} from the last lookup
+    const lookupTimers = {};
     const emptyState = document.getElementById('emptyState');
 
     function checkEmpty() {
         emptyState.style.display = tbody.children.length === 0 ? 'block' : 'none';
     }
 
-    function addItemRow() {
-        const rowId = 'row-' + Date.now();
-        let productOptions = '<option value="">Custom Item / Select...</option>';
-        products.forEach(p => {
-            productOptions += `<option value="${p.id}" data-price="${p.price}" data-name="${p.name}">${p.name} ($${p.price})</option>`;
-        });
+    let rowCounter = 0;
 
+    function addItemRow() {
+        const rowId = 'row-' + (++rowCounter);
         const row = document.createElement('tr');
         row.id = rowId;
         row.innerHTML = `
             <td>
-                <select class="form-select" style="margin-bottom: 5px;" onchange="autoFillRow('${rowId}', this)">
-                    ${productOptions}
-                </select>
-                <input type="text" name="product_names[]" class="form-control" placeholder="Item Name / Description" required>
+                <input type="text" name="product_names[]" class="form-control" list="${rowId}-options"
+                       placeholder="Search catalog or type a description" autocomplete="off"
+                       oninput="lookupProducts('${rowId}', this)" onchange="autoFillRow('${rowId}', this)" required>
+                <datalist id="${rowId}-options"></datalist>
             </td>
             <td>
                 <div class="input-group">
@@ -784,16 +3901,33 @@ CREATE_INVOICE_TEMPLATE = """
         checkEmpty();
     }
 
-    function autoFillRow(rowId, selectElem) {
+    // Ask the server for matching products as the user types (debounced),
+    // instead of shipping the whole catalog with the page.
+    function lookupProducts(rowId, input) {
+        clearTimeout(lookupTimers[rowId]);
+        lookupTimers[rowId] = setTimeout(() => {
+            fetch('/api/v1/products/lookup?limit=20&q=' + encodeURIComponent(input.value))
+                .then(r => r.json())
+                .then(result => {
+                    const list = document.getElementById(rowId + '-options');
+                    if (!list) return;
+                    lookupResults[rowId] = {};
+                    list.replaceChildren(...result.data.map(p => {
+                        lookupResults[rowId][p.name] = p.price;
+                        const option = document.createElement('option');
+                        option.value = p.name;
+                        option.textContent = (p.sku ? p.sku + ' · ' : '') + '$' + p.price;
+                        return option;
+                    }));
+                });
+        }, 150);
+    }
+
+    function autoFillRow(rowId, input) {
         const row = document.getElementById(rowId);
-        const selectedOption = selectElem.options[selectElem.selectedIndex];
-        
-        if(selectedOption.value) {
-            const price = parseFloat(selectedOption.getAttribute('data-price') || 0);
-            const name = selectedOption.getAttribute('data-name');
-            
-            row.querySelector('.price-input').value = price;
-            row.querySelector('input[name="product_names[]"]').value = name;
+        const matches = lookupResults[rowId] || {};
+        if (input.value in matches) {
+            row.querySelector('.price-input').value = matches[input.value];
             updateRow(rowId);
         }
     }
@@ -810,6 +3944,7 @@ CREATE_INVOICE_TEMPLATE = """
 
     function removeRow(rowId) {
         document.getElementById(rowId).remove();
+        delete lookupResults[rowId];
         calculateTotals();
         checkEmpty();
     }
@@ -838,34 +3973,60 @@ CREATE_INVOICE_TEMPLATE = """
     }
     
     checkEmpty();
-    if (products.length > 0) addItemRow(); // Add one default row
+    addItemRow(); // Add one default row
 </script>
 {% endblock %}
 """
 
 VIEW_INVOICE_TEMPLATE = """
-{% extends "base" %}
+{% extends "base.html" %}
 {% block content %}
 <div style="max-width: 900px; margin: 0 auto;">
     <!-- Action Toolbar -->
     <div class="d-flex justify-content-between align-items-center mb-4 no-print">
         <a href="/" class="btn btn-outline">← Dashboard</a>
         <div class="d-flex gap-2">
+            {% if editable %}
             <!-- Status Toggle Dropdown -->
             <div class="dropdown">
                 <button class="btn btn-outline" data-toggle="dropdown">
                     Mark Status: {{ invoice.status }} ▼
                 </button>
                 <div class="dropdown-menu">
-                    <form action="/update_status/{{ invoice.id }}/Paid" method="POST"><button class="dropdown-item">Paid</button></form>
-                    <form action="/update_status/{{ invoice.id }}/Pending" method="POST"><button class="dropdown-item">Pending</button></form>
-                    <form action="/update_status/{{ invoice.id }}/Overdue" method="POST"><button class="dropdown-item">Overdue</button></form>
+                    {% for target in transitions %}
+                    <form action="/update_status/{{ invoice.id }}/{{ target }}" method="POST"><button class="dropdown-item">{{ target }}</button></form>
+                    {% else %}
+                    <span class="dropdown-item text-secondary">No further changes</span>
+                    {% endfor %}
+                </div>
+            </div>
+            <div class="dropdown">
+                <button class="btn btn-outline" data-toggle="dropdown">↻ Repeat ▼</button>
+                <div class="dropdown-menu">
+                    {% for months, label in [(1, 'Monthly'), (3, 'Quarterly'), (12, 'Yearly')] %}
+                    <form action="{{ url_for('make_recurring', id=invoice.id) }}" method="POST">
+                        <input type="hidden" name="interval_months" value="{{ months }}">
+                        <button class="dropdown-item">{{ label }}</button>
+                    </form>
+                    {% endfor %}
                 </div>
             </div>
-            <button onclick="window.print()" class="btn btn-primary">🖨 Print / PDF</button>
+            {% elif invoice.deleted_at and not invoice.archived_at %}
+            <form action="{{ url_for('restore_invoice', id=invoice.id) }}" method="POST">
+                <button class="btn btn-outline">↺ Restore</button>
+            </form>
+            {% endif %}
+            <a href="{{ url_for('invoice_pdf', id=invoice.id) }}" class="btn btn-outline">⬇ PDF</a>
+            <button onclick="window.print()" class="btn btn-primary">🖨 Print</button>
         </div>
     </div>
 
+    {% if invoice.archived_at %}
+    <div class="alert alert-warning no-print">Archived on {{ invoice.archived_at[:10] }}. Archived invoices are read-only.</div>
+    {% elif invoice.deleted_at %}
+    <div class="alert alert-danger no-print">In the trash since {{ invoice.deleted_at[:10] }}. Restore it to make changes.</div>
+    {% endif %}
+
     <!-- Invoice Paper -->
     <div class="card" style="padding: 40px; box-shadow: 0 10px 15px -3px rgba(0, 0, 0, 0.1);">
         <!-- Header -->
@@ -893,6 +4054,12 @@ VIEW_INVOICE_TEMPLATE = """
                 <p class="small fw-bold text-secondary" style="text-transform: uppercase; margin-bottom: 5px;">Billed To</p>
                 <h4 class="fw-bold" style="margin: 0 0 5px 0;">{{ invoice.customer_name }}</h4>
                 {% if invoice.customer_email %}<p class="text-secondary">{{ invoice.customer_email }}</p>{% endif %}
+                {% if customer %}
+                <p class="small text-secondary no-print" style="margin-top: 5px;">
+                    Account: ${{ "%.2f"|format(customer.outstanding) }} outstanding across {{ customer.invoice_count }} invoices
+                    {% if customer.credit_limit is not none %}· ${{ "%.2f"|format(customer.available_credit) }} credit available{% endif %}
+                </p>
+                {% endif %}
             </div>
             <div class="col-6 text-end">
                 <div style="margin-bottom: 10px;">
@@ -946,19 +4113,429 @@ VIEW_INVOICE_TEMPLATE = """
                     <span class="fw-bold" style="font-size: 1.1rem;">Total Due</span>
                     <span class="fw-bold text-primary" style="font-size: 1.5rem;">${{ "%.2f"|format(invoice.total_amount) }}</span>
                 </div>
+                {% if invoice.paid_cents %}
+                <div class="d-flex justify-content-between mb-2" style="margin-top: 10px;">
+                    <span class="text-secondary">Paid</span>
+                    <span class="text-success" style="font-weight: 500;">- ${{ "%.2f"|format(invoice.paid_cents / 100) }}</span>
+                </div>
+                <div class="d-flex justify-content-between align-items-center">
+                    <span class="fw-bold">Balance Due</span>
+                    <span class="fw-bold">${{ "%.2f"|format((invoice.total_cents - invoice.paid_cents) / 100) }}</span>
+                </div>
+                {% endif %}
+            </div>
+        </div>
+
+        <!-- Footer -->
+        <div class="text-center" style="margin-top: 50px; padding-top: 20px; border-top: 1px solid #e2e8f0; color: #64748b; font-size: 0.9rem;">
+            <p style="margin-bottom: 5px; font-weight: 600;">Thank you for your business!</p>
+            <p>Payment is due within 30 days. Please include invoice number on your check.</p>
+        </div>
+    </div>
+
+    <!-- Payments -->
+    <div class="card no-print" style="margin-top: 20px;">
+        <h4 class="fw-bold" style="margin-top: 0;">Payments</h4>
+        {% if payments %}
+        <table class="table">
+            <thead><tr><th>Received</th><th>Method</th><th>Reference</th><th class="text-end">Applied</th></tr></thead>
+            <tbody>
+                {% for payment in payments %}
+                <tr>
+                    <td>{{ payment.received_on }}</td>
+                    <td>{{ payment.method }}</td>
+                    <td>{{ payment.reference or '' }}</td>
+                    <td class="text-end fw-bold">${{ "%.2f"|format(payment.amount_cents / 100) }}</td>
+                </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+        {% else %}
+        <p class="text-secondary">No payments recorded.</p>
+        {% endif %}
+        {% if editable and invoice.status in ('Pending', 'Overdue') %}
+        <form action="{{ url_for('record_invoice_payment', id=invoice.id) }}" method="POST" class="d-flex gap-2 align-items-center">
+            <input type="number" name="amount" step="0.01" min="0.01" class="form-control" placeholder="Amount"
+                   value="{{ '%.2f'|format((invoice.total_cents - invoice.paid_cents) / 100) }}" required>
+            <input type="date" name="date" class="form-control" value="{{ today_date }}" required>
+            <input type="text" name="reference" class="form-control" placeholder="Reference (optional)">
+            <button class="btn btn-primary">Record Payment</button>
+        </form>
+        {% endif %}
+    </div>
+</div>
+{% endblock %}
+"""
+
+REPORTS_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<div class="d-flex justify-content-between align-items-center mb-4">
+    <div>
+        <h2 style="margin-bottom: 5px;">Reports</h2>
+        <span class="text-secondary">{{ start }} to {{ end }} · excludes drafts</span>
+    </div>
+    <form method="GET" class="d-flex gap-2 align-items-center">
+        <input type="date" name="start" value="{{ start }}" class="form-control" style="margin:0;">
+        <input type="date" name="end" value="{{ end }}" class="form-control" style="margin:0;">
+        <button class="btn btn-primary" type="submit">Apply</button>
+    </form>
+</div>
+
+<div class="row">
+    <div class="col-8">
+        <div class="card">
+            <div class="card-header"><span>Revenue by Month</span><span class="text-secondary small">Tax collected ${{ "%.2f"|format(revenue|sum(attribute='tax')) }}</span></div>
+            <div class="table-responsive">
+                <table class="table">
+                    <thead><tr><th>Month</th><th class="text-end">Invoices</th><th class="text-end">Net</th><th class="text-end">Tax</th><th class="text-end">Revenue</th><th style="width: 30%;"></th></tr></thead>
+                    <tbody>
+                    {% set peak = revenue|map(attribute='revenue')|max if revenue else 0 %}
+                    {% for row in revenue %}
+                        <tr>
+                            <td class="fw-bold">{{ row.period }}</td>
+                            <td class="text-end">{{ row.invoices }}</td>
+                            <td class="text-end">${{ "%.2f"|format(row.subtotal) }}</td>
+                            <td class="text-end">${{ "%.2f"|format(row.tax) }}</td>
+                            <td class="text-end fw-bold">${{ "%.2f"|format(row.revenue) }}</td>
+                            <td><div style="background: var(--primary); height: 8px; border-radius: 4px; width: {{ (100 * row.revenue / peak) if peak > 0 else 0 }}%;"></div></td>
+                        </tr>
+                    {% else %}
+                        <tr><td colspan="6" class="text-center text-secondary">No invoices in this range.</td></tr>
+                    {% endfor %}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+
+        <div class="card">
+            <div class="card-header"><span>Top Products</span></div>
+            <div class="table-responsive">
+                <table class="table">
+                    <thead><tr><th>Product</th><th class="text-end">Lines</th><th class="text-end">Qty</th><th class="text-end">Revenue</th></tr></thead>
+                    <tbody>
+                    {% for row in products %}
+                        <tr><td>{{ row.product_name }}</td><td class="text-end">{{ row.lines }}</td><td class="text-end">{{ row.quantity }}</td><td class="text-end fw-bold">${{ "%.2f"|format(row.revenue) }}</td></tr>
+                    {% else %}
+                        <tr><td colspan="4" class="text-center text-secondary">No sales in this range.</td></tr>
+                    {% endfor %}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+    </div>
+
+    <div class="col-4">
+        <div class="card">
+            <div class="card-header"><span>Receivables Aging</span></div>
+            <div class="table-responsive">
+                <table class="table">
+                    <thead><tr><th>Days Past Due</th><th class="text-end">Invoices</th><th class="text-end">Amount</th></tr></thead>
+                    <tbody>
+                    {% for row in aging %}
+                        <tr><td class="{{ 'text-danger' if row.bucket != 'current' and row.invoices }}">{{ row.bucket }}</td><td class="text-end">{{ row.invoices }}</td><td class="text-end">${{ "%.2f"|format(row.amount) }}</td></tr>
+                    {% endfor %}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+
+        <div class="card">
+            <div class="card-header"><span>Top Customers</span><span class="text-secondary small">All time</span></div>
+            <div class="table-responsive">
+                <table class="table">
+                    <tbody>
+                    {% for row in customers %}
+                        <tr><td>{{ row.customer_name }}<div class="text-secondary small">{{ row.invoices }} invoices</div></td><td class="text-end fw-bold">${{ "%.2f"|format(row.revenue) }}</td></tr>
+                    {% else %}
+                        <tr><td class="text-center text-secondary">No customers yet.</td></tr>
+                    {% endfor %}
+                    </tbody>
+                </table>
             </div>
         </div>
-
-        <!-- Footer -->
-        <div class="text-center" style="margin-top: 50px; padding-top: 20px; border-top: 1px solid #e2e8f0; color: #64748b; font-size: 0.9rem;">
-            <p style="margin-bottom: 5px; font-weight: 600;">Thank you for your business!</p>
-            <p>Payment is due within 30 days. Please include invoice number on your check.</p>
-        </div>
     </div>
 </div>
 {% endblock %}
 """
 
+# ==========================================
+# TEMPLATE REGISTRY
+# ==========================================
+
+# Pages extend "base.html" through a real loader, so Jinja lexes, parses and
+# compiles each one once and serves it from its template cache afterwards.
+TEMPLATES = {
+    'base.html': HTML_TEMPLATE,
+    'dashboard.html': DASHBOARD_TEMPLATE,
+    'products.html': PRODUCTS_TEMPLATE,
+    'create_invoice.html': CREATE_INVOICE_TEMPLATE,
+    'view_invoice.html': VIEW_INVOICE_TEMPLATE,
+    'reports.html': REPORTS_TEMPLATE,
+}
+
+app.jinja_loader = DictLoader(TEMPLATES)
+
+
+def precompile_templates():
+    """Compile every registered page up front so no request pays for it."""
+    for name in TEMPLATES:
+        app.jinja_env.get_template(name)
+
+
+precompile_templates()
+
+# ==========================================
+# INSTRUMENTATION (/metrics, Server-Timing, opt-in cProfile)
+# ==========================================
+
+# Every request gets a RequestTrace: SQL time and statement counts from the
+# traced connection, template time from render_with_base, and the total.
+# Totals land in METRICS (Prometheus text at /metrics) and in a Server-Timing
+# header; slow requests are logged with their heaviest statements.
+app.config['SLOW_REQUEST_SECONDS'] = 1.0
+app.config['METRICS_TOP_STATEMENTS'] = 20
+# "X-Profile: 1" dumps a cProfile of that request into PROFILE_DIR. Off unless
+# enabled (or in debug): profiling output must not be a public feature.
+app.config['PROFILE_REQUESTS'] = os.environ.get('BILLING_PROFILE') == '1'
+app.config['PROFILE_DIR'] = os.environ.get('BILLING_PROFILE_DIR', 'profiles')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def normalize_sql(sql):
+    return ' '.join(sql.split())[:200]
+
+
+class RequestTrace:
+    __slots__ = ('started', 'sql_seconds', 'queries', 'statements', 'render_seconds', 'profiler')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_seconds = 0.0
+        self.queries = 0
+        self.statements = {}  # sql -> [count, seconds]
+        self.render_seconds = 0.0
+        self.profiler = None
+
+    def record_sql(self, sql, seconds):
+        self.sql_seconds += seconds
+        self.queries += 1
+        stats = self.statements.get(sql)
+        if stats is None:
+            self.statements[sql] = [1, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+
+    def slowest(self, n=3):
+        """The n statements with the most total time: (seconds, count, sql)."""
+        return sorted(((s, c, normalize_sql(sql)) for sql, (c, s) in self.statements.items()), reverse=True)[:n]
+
+
+class Metrics:
+    """Process-wide counters and histograms, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}   # (endpoint, method, status) -> count
+        self.endpoints = {}  # endpoint -> per-endpoint sums and duration histogram
+        self.statements = {}  # normalized sql -> [count, seconds]
+
+    def observe(self, endpoint, method, status, trace, seconds):
+        with self.lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {
+                    'count': 0, 'seconds': 0.0, 'sql_seconds': 0.0, 'queries': 0, 'max_queries': 0,
+                    'render_seconds': 0.0, 'buckets': [0] * len(DURATION_BUCKETS)}
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['sql_seconds'] += trace.sql_seconds
+            stats['queries'] += trace.queries
+            stats['max_queries'] = max(stats['max_queries'], trace.queries)
+            stats['render_seconds'] += trace.render_seconds
+            for i in range(bisect.bisect_left(DURATION_BUCKETS, seconds), len(DURATION_BUCKETS)):
+                stats['buckets'][i] += 1  # buckets are cumulative (le=)
+            for sql, (count, sql_seconds) in trace.statements.items():
+                total = self.statements.setdefault(normalize_sql(sql), [0, 0.0])
+                total[0] += count
+                total[1] += sql_seconds
+
+    def render(self):
+        def labels(**values):
+            escaped = {k: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                       for k, v in values.items()}
+            return '{' + ','.join(f'{k}="{v}"' for k, v in escaped.items()) + '}'
+
+        with self.lock:
+            out = ['# HELP nexus_http_requests_total Requests handled.',
+                   '# TYPE nexus_http_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                out.append(f'nexus_http_requests_total{labels(endpoint=endpoint, method=method, status=status)} {count}')
+            out += ['# HELP nexus_http_request_duration_seconds Time to build the response.',
+                    '# TYPE nexus_http_request_duration_seconds histogram']
+            for endpoint, stats in sorted(self.endpoints.items()):
+                for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+                    out.append(f'nexus_http_request_duration_seconds_bucket{labels(endpoint=endpoint, le=bound)} {count}')
+                out.append(f'nexus_http_request_duration_seconds_bucket{labels(endpoint=endpoint, le="+Inf")} '
+                           f'{stats["count"]}')
+                out.append(f'nexus_http_request_duration_seconds_sum{labels(endpoint=endpoint)} {stats["seconds"]:.6f}')
+                out.append(f'nexus_http_request_duration_seconds_count{labels(endpoint=endpoint)} {stats["count"]}')
+            for name, key, kind, help_text in (
+                    ('nexus_sql_duration_seconds_total', 'sql_seconds', 'counter', 'Time spent executing SQL.'),
+                    ('nexus_sql_queries_total', 'queries', 'counter', 'SQL statements executed.'),
+                    ('nexus_sql_queries_per_request_max', 'max_queries', 'gauge',
+                     'Most statements a single request executed (N+1 canary).'),
+                    ('nexus_template_render_seconds_total', 'render_seconds', 'counter', 'Time spent rendering templates.')):
+                out += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                for endpoint, stats in sorted(self.endpoints.items()):
+                    value = stats[key]
+                    out.append(f'{name}{labels(endpoint=endpoint)} {value:.6f}' if isinstance(value, float)
+                               else f'{name}{labels(endpoint=endpoint)} {value}')
+            top = sorted(self.statements.items(), key=lambda item: item[1][1],
+                         reverse=True)[:app.config['METRICS_TOP_STATEMENTS']]
+            out += ['# HELP nexus_sql_statement_seconds_total Statements with the most cumulative time.',
+                    '# TYPE nexus_sql_statement_seconds_total counter']
+            out += [f'nexus_sql_statement_seconds_total{labels(statement=sql)} {seconds:.6f}' for sql, (_, seconds) in top]
+            out += ['# TYPE nexus_sql_statement_executions_total counter']
+            out += [f'nexus_sql_statement_executions_total{labels(statement=sql)} {count}' for sql, (count, _) in top]
+        return '\n'.join(out) + '\n'
+
+
+METRICS = Metrics()
+
+
+@app.before_request
+def start_request_trace():
+    trace = _active_trace.trace = RequestTrace()
+    if request.headers.get('X-Profile') == '1' and (app.config['PROFILE_REQUESTS'] or app.debug):
+        trace.profiler = cProfile.Profile()
+        trace.profiler.enable()
+
+
+@app.after_request
+def finish_request_trace(response):
+    trace = getattr(_active_trace, 'trace', None)
+    if trace is None:
+        return response
+    seconds = time.perf_counter() - trace.started
+    if trace.profiler is not None:
+        trace.profiler.disable()
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        path = os.path.join(app.config['PROFILE_DIR'],
+                            f"{datetime.now():%Y%m%d-%H%M%S}-{request.endpoint or 'unknown'}-{uuid.uuid4().hex[:6]}.prof")
+        trace.profiler.dump_stats(path)
+        response.headers['X-Profile-File'] = path
+    response.headers['Server-Timing'] = (f'sql;dur={trace.sql_seconds * 1000:.1f};desc="{trace.queries} queries", '
+                                         f'render;dur={trace.render_seconds * 1000:.1f}, '
+                                         f'total;dur={seconds * 1000:.1f}')
+    METRICS.observe(request.endpoint or 'unknown', request.method, response.status_code, trace, seconds)
+    if seconds >= app.config['SLOW_REQUEST_SECONDS']:
+        app.logger.warning('Slow request %s %s: %.3fs, %d queries / %.3fs SQL, %.3fs render; heaviest: %s',
+                           request.method, request.path, seconds, trace.queries, trace.sql_seconds,
+                           trace.render_seconds, trace.slowest())
+    return response
+
+
+@app.teardown_request
+def clear_request_trace(exc):
+    trace = getattr(_active_trace, 'trace', None)
+    if trace is not None and trace.profiler is not None:
+        trace.profiler.disable()  # the request failed before after_request
+    _active_trace.trace = None
+
+
+# ==========================================
+# STATIC ASSETS & COMPRESSION
+# ==========================================
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Responses below COMPRESS_MIN_SIZE bytes are sent as-is: the headers and CPU
+# cost more than the bytes saved.
+app.config['COMPRESS_MIN_SIZE'] = 500
+app.config['COMPRESS_MIMETYPES'] = {'text/html', 'text/css', 'application/javascript', 'application/json'}
+app.config['COMPRESS_GZIP_LEVEL'] = 6
+app.config['COMPRESS_BROTLI_QUALITY'] = 5
+
+# name -> (mimetype, source); URLs carry a content fingerprint so the files
+# can be cached for a year and a deploy still takes effect immediately.
+ASSET_SOURCES = {
+    'app.css': ('text/css', BASE_CSS),
+    'app.js': ('application/javascript', BASE_JS),
+}
+
+
+def gzip_bytes(data, level):
+    return zlib.compress(data, level, wbits=31)
+
+
+def build_assets():
+    """Fingerprint every asset and pre-compress it once at the highest levels."""
+    assets = {}
+    for name, (mimetype, source) in ASSET_SOURCES.items():
+        data = source.encode()
+        variants = {'identity': data, 'gzip': gzip_bytes(data, 9)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(data, quality=11)
+        assets[name] = {'mimetype': mimetype, 'fingerprint': hashlib.sha256(data).hexdigest()[:12],
+                        'variants': variants}
+    return assets
+
+
+STATIC_ASSETS = build_assets()
+
+
+def asset_url(name):
+    stem, ext = name.rsplit('.', 1)
+    return url_for('static_asset', filename=f"{stem}.{STATIC_ASSETS[name]['fingerprint']}.{ext}")
+
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+
+def negotiate_encoding(available):
+    """Best of `available` codings the client accepts (br over gzip), or 'identity'."""
+    accepted = request.accept_encodings
+    for coding in ('br', 'gzip'):
+        if coding in available and accepted[coding]:
+            return coding
+    return 'identity'
+
+
+@app.after_request
+def compress_response(response):
+    """Compress buffered text responses for clients that accept it."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in app.config['COMPRESS_MIMETYPES']):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    coding = negotiate_encoding(('br', 'gzip') if brotli is not None else ('gzip',))
+    if coding == 'identity':
+        return response
+    if coding == 'br':
+        data = brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    else:
+        data = gzip_bytes(data, app.config['COMPRESS_GZIP_LEVEL'])
+    response.set_data(data)
+    response.headers['Content-Encoding'] = coding
+    # Same content, different bytes: validators become weak (RFC 9110 8.8.1)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
 # ==========================================
 # ROUTES & LOGIC
 # ==========================================
@@ -966,73 +4543,169 @@ VIEW_INVOICE_TEMPLATE = """
 # --- Helper for Template Rendering ---
 
 
-def render_with_base(content_template, **kwargs):
+def render_with_base(template_name, **kwargs):
     # Pass common variables to every template
     kwargs['company'] = COMPANY_INFO
-    final_html = HTML_TEMPLATE.replace(
-        '{% block content %}{% endblock %}', content_template)
-    final_html = final_html.replace('{% extends "base" %}', '')
-    return render_template_string(final_html, **kwargs)
+    start = time.perf_counter()
+    html = render_template(template_name, **kwargs)
+    trace = getattr(_active_trace, 'trace', None)
+    if trace is not None:
+        trace.render_seconds += time.perf_counter() - start
+    return html
+
+
+def fetch_keyset_page(conn, select_sql, conditions, params, keys, descending, after, before):
+    """
+    One page of rows ordered by `keys` ([(sql_expr, row_field), ...]) using
+    keyset pagination: "after" continues past the last row shown, "before"
+    goes back from the first. Every page is a seek, however deep it is.
+    Returns (rows, next_cursor, prev_cursor).
+    """
+    cursor = after or before
+    if cursor and len(cursor) == len(keys):
+        # Walking backwards flips the comparison and the sort, then the rows
+        forward = bool(after)
+        op = '<' if descending == forward else '>'
+        exprs = ', '.join(expr for expr, _ in keys)
+        conditions = conditions + [f"({exprs}) {op} ({', '.join('?' * len(keys))})"]
+        params = params + list(cursor)
+    else:
+        after = before = None
+
+    order = 'DESC' if descending == (before is None) else 'ASC'
+    sql = select_sql
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += ' ORDER BY ' + ', '.join(f'{expr} {order}' for expr, _ in keys)
+    # One extra row tells us whether another page exists in that direction
+    sql += f' LIMIT {PAGE_SIZE + 1}'
+
+    rows = conn.execute(sql, params).fetchall()
+    has_more = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    if before:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or before:
+            next_cursor = encode_cursor(*(rows[-1][field] for _, field in keys))
+        if (has_more and before) or after:
+            prev_cursor = encode_cursor(*(rows[0][field] for _, field in keys))
+    return rows, next_cursor, prev_cursor
 
 
 @app.route('/')
 def index():
     query = request.args.get('q', '')
     status_filter = request.args.get('status', '')
+    trash = request.args.get('trash') == '1'
 
-    conn = get_db_connection()
+    conn = get_db()
+    maybe_sweep_overdue(conn)
+    # ?archive=1 pages through the hot and archived invoices together
+    archive = request.args.get('archive') == '1' and attach_archive(conn)
 
-    # Base Query
-    sql = 'SELECT * FROM invoices'
-    params = []
-    conditions = []
+    search = parse_invoice_search(query)
+    after = decode_cursor(request.args.get('after'))
+    before = None if after else decode_cursor(request.args.get('before'))
 
-    if query:
-        conditions.append("(customer_name LIKE ? OR id LIKE ?)")
-        params.extend([f'%{query}%', f'%{query}%'])
+    conditions, params = [], []
+    if search and search[0] == 'text' and not (archive or trash):
+        # Ranked full-text search (live, hot invoices only); pages keyset on (rank, id)
+        select_sql = ('SELECT invoices.*, invoice_search.rank AS search_rank FROM invoice_search '
+                      'JOIN invoices ON invoices.id = invoice_search.rowid')
+        conditions.append('invoice_search MATCH ?')
+        params.append(search[1])
+        keys, descending = [('invoice_search.rank', 'search_rank'), ('invoices.id', 'id')], False
+    else:
+        if archive:
+            source, _ = invoice_sources(conn, archive=True, trash=trash)
+            select_sql = f'SELECT * FROM {source} AS invoices'
+        else:
+            select_sql = 'SELECT * FROM invoices'
+            conditions.append('deleted_at IS NOT NULL' if trash else 'deleted_at IS NULL')
+        if search and search[0] == 'text':
+            for condition, param in unindexed_search(query):
+                conditions.append(condition)
+                params.extend(param)
+        elif search:  # "#00042" / "INV-42" / "42" is a primary-key lookup
+            conditions.append('id = ?')
+            params.append(search[1])
+        keys, descending = [('id', 'id')], True
 
     if status_filter:
         conditions.append("status = ?")
         params.append(status_filter)
 
-    if conditions:
-        sql += " WHERE " + " AND ".join(conditions)
+    invoices, next_cursor, prev_cursor = fetch_keyset_page(
+        conn, select_sql, conditions, params, keys, descending, after, before)
+
+    # KPI Stats (maintained by triggers, see _migrate_kpi_totals)
+    kpis = load_kpis(conn)
 
-    sql += ' ORDER BY id DESC LIMIT 20'
+    # Totals come from the maintained per-status counts (less the archived
+    # part unless it is included); searches and the trash have no cheap
+    # count, so the footer just pages without one.
+    match_count = None
+    if not query and not trash:
+        if status_filter:
+            row = conn.execute('SELECT invoice_count, archived_count FROM invoice_status_totals WHERE status = ?',
+                               (status_filter,)).fetchone()
+            match_count = row['invoice_count'] - (0 if archive else row['archived_count']) if row else 0
+        else:
+            match_count = kpis['invoice_count'] - (0 if archive else kpis['archived_count'])
 
-    invoices = conn.execute(sql, params).fetchall()
+    return render_with_base('dashboard.html',
+                            invoices=invoices,
+                            next_cursor=next_cursor,
+                            prev_cursor=prev_cursor,
+                            match_count=match_count,
+                            trash=trash,
+                            archive=archive,
+                            today=date.today().strftime("%B %d, %Y"),
+                            **kpis)
 
-    # KPI Stats
-    total_revenue = conn.execute(
-        "SELECT SUM(total_amount) FROM invoices WHERE status != 'Draft'").fetchone()[0] or 0.0
-    pending_amount = conn.execute(
-        "SELECT SUM(total_amount) FROM invoices WHERE status = 'Pending'").fetchone()[0] or 0.0
-    pending_count = conn.execute(
-        "SELECT count(*) FROM invoices WHERE status = 'Pending'").fetchone()[0]
-    invoice_count = conn.execute("SELECT count(*) FROM invoices").fetchone()[0]
-    product_count = conn.execute("SELECT count(*) FROM products").fetchone()[0]
 
-    conn.close()
+@app.route('/assets/<filename>')
+def static_asset(filename):
+    """Fingerprinted shared CSS/JS, served from memory in its pre-compressed variants."""
+    stem, _, rest = filename.partition('.')
+    fingerprint, _, ext = rest.rpartition('.')
+    asset = STATIC_ASSETS.get(f'{stem}.{ext}')
+    if asset is None:
+        return Response('Not found', status=404, mimetype='text/plain')
+    if fingerprint != asset['fingerprint']:
+        # A page cached from before a deploy: point it at the current version
+        return redirect(asset_url(f'{stem}.{ext}'))
+    headers = {'Cache-Control': 'public, max-age=31536000, immutable', 'Vary': 'Accept-Encoding'}
+    if request.if_none_match.contains_weak(fingerprint):
+        response = Response(status=304, headers=headers)
+        response.set_etag(fingerprint)
+        return response
+    coding = negotiate_encoding(asset['variants'])
+    if coding != 'identity':
+        headers['Content-Encoding'] = coding
+    response = Response(asset['variants'][coding], mimetype=asset['mimetype'], headers=headers)
+    response.set_etag(fingerprint)
+    return response
 
-    return render_with_base(DASHBOARD_TEMPLATE,
-                            invoices=invoices,
-                            total_revenue=total_revenue,
-                            pending_amount=pending_amount,
-                            pending_count=pending_count,
-                            invoice_count=invoice_count,
-                            product_count=product_count,
-                            pages=1,
-                            today=date.today().strftime("%B %d, %Y"))
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of the request, SQL and render metrics."""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
 
 # --- PRODUCT MANAGEMENT ---
 
 
 @app.route('/products')
 def products():
-    conn = get_db_connection()
-    products = conn.execute('SELECT * FROM products ORDER BY name').fetchall()
-    conn.close()
-    return render_with_base(PRODUCTS_TEMPLATE, products=products)
+    conn = get_db()
+    # Plain dicts so the edit buttons can serialise rows with |tojson
+    products = [dict(p) for p in conn.execute(
+        'SELECT * FROM products ORDER BY name').fetchall()]
+    return render_with_base('products.html', products=products)
 
 
 @app.route('/save_product', methods=['POST'])
@@ -1043,27 +4716,33 @@ def save_product():
     sku = request.form.get('sku', '')
     category = request.form.get('category', 'General')
 
-    conn = get_db_connection()
+    conn = get_db()
+    values = {'name': name, 'price': price, 'sku': sku, 'category': category}
     if p_id:  # Update
+        old = conn.execute('SELECT name, price, sku, category FROM products WHERE id = ?', (p_id,)).fetchone()
         conn.execute('UPDATE products SET name=?, price=?, sku=?, category=? WHERE id=?',
                      (name, price, sku, category, p_id))
+        event = ('update', 'product', int(p_id), dict(old) if old else None, values)
         flash('Product updated successfully.', 'success')
     else:  # Create
-        conn.execute('INSERT INTO products (name, price, sku, category) VALUES (?, ?, ?, ?)',
-                     (name, price, sku, category))
+        cur = conn.execute('INSERT INTO products (name, price, sku, category) VALUES (?, ?, ?, ?)',
+                           (name, price, sku, category))
+        event = ('create', 'product', cur.lastrowid, None, values)
         flash('New product added to catalog.', 'success')
 
     conn.commit()
-    conn.close()
+    audit(*event)
     return redirect(url_for('products'))
 
 
 @app.route('/delete_product/<int:id>', methods=['POST'])
 def delete_product(id):
-    conn = get_db_connection()
+    conn = get_db()
+    old = conn.execute('SELECT name, price, sku, category FROM products WHERE id = ?', (id,)).fetchone()
     conn.execute('DELETE FROM products WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
+    if old:
+        audit('delete', 'product', id, dict(old))
     flash('Product removed.', 'warning')
     return redirect(url_for('products'))
 
@@ -1072,99 +4751,967 @@ def delete_product(id):
 
 @app.route('/create_invoice')
 def create_invoice():
-    conn = get_db_connection()
-    products = conn.execute('SELECT * FROM products').fetchall()
-    conn.close()
-    products_list = [{'id': p['id'], 'name': p['name'],
-                      'price': p['price'], 'sku': p['sku']} for p in products]
-    return render_with_base(CREATE_INVOICE_TEMPLATE, products_json=products_list, today_date=date.today().isoformat())
+    # The catalog is no longer inlined; line items query /api/v1/products/lookup
+    return render_with_base('create_invoice.html', today_date=date.today().isoformat())
 
 
 @app.route('/save_invoice', methods=['POST'])
 def save_invoice():
-    customer_name = request.form['customer_name']
+    customer_name = request.form['customer_name'].strip()
     customer_email = request.form.get('customer_email')
     inv_date = request.form['date']
     due_date = request.form.get('due_date')
 
-    # Financials
-    subtotal = float(request.form['subtotal'])
-    tax_rate = float(request.form['tax_rate'])
-    tax_amount = float(request.form['tax_amount'])
-    total_amount = float(request.form['total_amount'])
+    # Everything is validated and priced server-side before the write lock
+    # is taken; the client's subtotal/tax/total fields are display-only.
+    try:
+        if not customer_name:
+            raise ValueError('Client name is required.')
+        tax_rate = parse_tax_rate(request.form.get('tax_rate'))
+        lines, _ = build_invoice_lines(request.form.getlist('product_names[]'),
+                                       request.form.getlist('quantities[]'),
+                                       request.form.getlist('prices[]'))
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('create_invoice'))
 
-    # Line Items
-    product_names = request.form.getlist('product_names[]')
-    quantities = request.form.getlist('quantities[]')
-    prices = request.form.getlist('prices[]')
+    conn = get_db()
+    with write_transaction(conn):
+        invoice_id = insert_invoice(conn, customer_name, customer_email, inv_date, due_date,
+                                    tax_rate, lines)
+    audit('create', 'invoice', invoice_id, None,
+          invoice_audit_values(customer_name, customer_email, inv_date, due_date, tax_rate, lines))
+    flash('Invoice generated successfully.', 'success')
+    customer = conn.execute('SELECT customers.* FROM invoices JOIN customers ON customers.id = invoices.customer_id '
+                            'WHERE invoices.id = ?', (invoice_id,)).fetchone()
+    if customer and not credit_check(customer, 0)['approved']:
+        flash(f"{customer['name']} is now over their credit limit of "
+              f"${from_cents(customer['credit_limit_cents']):,.2f}.", 'warning')
+    return redirect(url_for('view_invoice', id=invoice_id))
 
-    conn = get_db_connection()
-    cur = conn.cursor()
 
-    # 1. Create Invoice
-    cur.execute('''INSERT INTO invoices 
-                   (customer_name, customer_email, date, due_date, subtotal, tax_rate, tax_amount, total_amount, status) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'Pending')''',
-                (customer_name, customer_email, inv_date, due_date, subtotal, tax_rate, tax_amount, total_amount))
-    invoice_id = cur.lastrowid
+@app.route('/import', methods=['POST'])
+def import_upload():
+    """
+    Bulk-create invoices from CSV or JSONL. Accepts a multipart "file" field
+    or a raw request body; the upload is parsed as a stream, never loaded
+    whole. Responds with the import report as JSON.
+    """
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format') or request.form.get('format')
+    if not fmt:
+        name = (upload.filename if upload else '') or ''
+        fmt = 'jsonl' if name.endswith(('.jsonl', '.ndjson')) or 'json' in (request.mimetype or '') else 'csv'
+    batch_size = max(1, request.args.get('batch_size', 500, type=int))
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify(error=f'Unsupported import format: {fmt!r} (use csv or jsonl).'), 400
 
-    # 2. Add Items
-    for i in range(len(product_names)):
-        p_name = product_names[i]
-        qty = int(quantities[i])
-        price = float(prices[i])
-        item_subtotal = qty * price
+    if request.args.get('async') == '1':
+        # Spool the upload to disk (streamed) and let a job worker ingest it
+        os.makedirs(app.config['JOB_SPOOL_DIR'], exist_ok=True)
+        path = os.path.join(app.config['JOB_SPOOL_DIR'], f'import-{uuid.uuid4().hex}.{fmt}')
+        with open(path, 'wb') as fh:
+            shutil.copyfileobj(stream, fh, 1024 * 1024)
+        conn = get_db()
+        job_id = enqueue_job(conn, 'import_invoices',
+                             {'path': path, 'format': fmt, 'batch_size': batch_size}, max_attempts=1)
+        conn.commit()
+        return jsonify(job_id=job_id), 202, {'Location': url_for('job_detail', id=job_id)}
 
-        cur.execute('''INSERT INTO invoice_items 
-                       (invoice_id, product_name, quantity, price, subtotal) 
-                       VALUES (?, ?, ?, ?, ?)''',
-                    (invoice_id, p_name, qty, price, item_subtotal))
+    try:
+        report = import_invoices(get_db(), iter_import_records(stream, fmt), batch_size=batch_size)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(report), 200 if not report['error_count'] else 207
 
-    conn.commit()
-    conn.close()
-    flash('Invoice generated successfully.', 'success')
-    return redirect(url_for('view_invoice', id=invoice_id))
+
+@app.route('/export/invoices.<fmt>')
+def export_invoices(fmt):
+    """
+    Stream invoices with their line items as invoices.csv, invoices.jsonl or
+    either with a .gz suffix (or ?gzip=1). Filters: start, end (YYYY-MM-DD,
+    inclusive) and status; ?archive=1 includes archived invoices.
+    """
+    compress = fmt.endswith('.gz') or request.args.get('gzip') == '1'
+    fmt = fmt.removesuffix('.gz')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify(error='Export format must be csv or jsonl.'), 404
+    start, end = request.args.get('start') or None, request.args.get('end') or None
+    try:
+        for value in (start, end):
+            if value:
+                date.fromisoformat(value)
+    except ValueError:
+        return jsonify(error='start and end must be YYYY-MM-DD.'), 400
+
+    body = iter_export_chunks(iter_export_rows(start, end, request.args.get('status') or None,
+                                               archive=request.args.get('archive') == '1'), fmt)
+    filename = f'invoices.{fmt}'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if compress:
+        body, filename, mimetype = gzip_chunks(body), filename + '.gz', 'application/gzip'
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 
 @app.route('/invoice/<int:id>')
 def view_invoice(id):
-    conn = get_db_connection()
-    invoice = conn.execute(
-        'SELECT * FROM invoices WHERE id = ?', (id,)).fetchone()
+    conn = get_db()
+    invoice, schema = locate_invoice(conn, id)
+    if not invoice:
+        flash('Invoice not found.', 'danger')
+        return redirect(url_for('index'))
     items = conn.execute(
-        'SELECT * FROM invoice_items WHERE invoice_id = ?', (id,)).fetchall()
-    conn.close()
+        f'SELECT * FROM {schema}.invoice_items WHERE invoice_id = ?', (id,)).fetchall()
+
+    customer = load_customer(conn, invoice['customer_id'])
+    payments = conn.execute(f'''SELECT p.received_on, p.method, p.reference, a.amount_cents
+                                FROM {schema}.payment_allocations a JOIN payments p ON p.id = a.payment_id
+                                WHERE a.invoice_id = ? ORDER BY p.received_on, a.id''', (id,)).fetchall()
+    # Trashed and archived invoices are read-only
+    editable = schema == 'main' and invoice['deleted_at'] is None
+    return render_with_base('view_invoice.html', invoice=invoice, items=items, payments=payments,
+                            customer=customer_summary(customer) if customer else None,
+                            editable=editable,
+                            transitions=STATUS_TRANSITIONS.get(invoice['status'], ()) if editable else (),
+                            today_date=date.today().isoformat())
+
 
+@app.route('/invoice/<int:id>/pdf')
+def invoice_pdf(id):
+    path = cached_invoice_pdf(get_db(), id)
+    if path is None:
+        flash('Invoice not found.', 'danger')
+        return redirect(url_for('index'))
+    return send_file(os.path.abspath(path), mimetype='application/pdf',
+                     download_name=f'INV-{id:05d}.pdf', max_age=0)
+
+
+@app.route('/invoice/<int:id>/recurring', methods=['POST'])
+def make_recurring(id):
+    """Bill this invoice's customer and lines again every interval_months."""
+    conn = get_db()
+    invoice = conn.execute('SELECT * FROM invoices WHERE id = ?', (id,)).fetchone()
     if not invoice:
         flash('Invoice not found.', 'danger')
         return redirect(url_for('index'))
+    interval = request.form.get('interval_months', 1, type=int)
+    if interval not in (1, 3, 6, 12):
+        flash('Repeat interval must be 1, 3, 6 or 12 months.', 'danger')
+        return redirect(url_for('view_invoice', id=id))
+    lines = [tuple(row) for row in conn.execute(
+        'SELECT product_name, quantity, price_cents, subtotal_cents FROM invoice_items WHERE invoice_id = ? ORDER BY id',
+        (id,))]
+    issued = date.fromisoformat(invoice['date'])
+    due_days = (date.fromisoformat(invoice['due_date']) - issued).days if invoice['due_date'] else 30
+    with write_transaction(conn):
+        recurring_id = create_recurring_invoice(conn, invoice['customer_name'], invoice['customer_email'],
+                                                invoice['tax_rate'], lines, add_months(issued, interval).isoformat(),
+                                                interval, max(due_days, 0))
+    audit('create', 'recurring_invoice', recurring_id, None,
+          {'from_invoice': id, 'interval_months': interval, 'start_date': add_months(issued, interval).isoformat()})
+    flash(f"{invoice['customer_name']} will be invoiced every {interval} month(s), "
+          f"starting {add_months(issued, interval).isoformat()}.", 'success')
+    return redirect(url_for('view_invoice', id=id))
+
+
+@app.route('/invoice/<int:id>/payments', methods=['POST'])
+def record_invoice_payment(id):
+    """A payment from the invoice's customer, applied to this invoice first and the rest oldest-first."""
+    try:
+        amount = to_cents(request.form.get('amount'))
+        received_on = date.fromisoformat(request.form.get('date') or date.today().isoformat()).isoformat()
+        if amount <= 0:
+            raise ValueError
+    except ValueError:
+        flash('Enter a positive amount and a valid date.', 'danger')
+        return redirect(url_for('view_invoice', id=id))
+
+    conn = get_db()
+    with write_transaction(conn):
+        invoice = conn.execute('SELECT customer_id FROM invoices WHERE id = ? AND deleted_at IS NULL',
+                               (id,)).fetchone()
+        if invoice is None:
+            flash('Invoice not found.', 'danger')
+            return redirect(url_for('index'))
+        payment = {'customer_id': invoice['customer_id'], 'amount_cents': amount, 'received_on': received_on,
+                   'invoice_id': id, 'reference': (request.form.get('reference') or '').strip() or None}
+        results = allocate_payments(conn, [payment])
+    AUDIT.record(payment_audit_events([payment], results))
+    _, applied, unapplied = results[0]
+    invalidate_invoice_pdfs(id)
+    message = f'Payment of ${from_cents(amount):,.2f} recorded.'
+    if unapplied:
+        message += f' ${from_cents(unapplied):,.2f} is held as unapplied credit.'
+    flash(message, 'success')
+    return redirect(url_for('view_invoice', id=id))
+
+
+@app.route('/payments/import', methods=['POST'])
+def import_payments_upload():
+    """
+    Reconcile a bank statement (CSV/JSONL with BANK_FIELDS columns), sent
+    like POST /import. Responds with the reconciliation report as JSON;
+    ?async=1 spools the file and returns a job instead.
+    """
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format') or request.form.get('format')
+    if not fmt:
+        name = (upload.filename if upload else '') or ''
+        fmt = 'jsonl' if name.endswith(('.jsonl', '.ndjson')) or 'json' in (request.mimetype or '') else 'csv'
+    batch_size = max(1, request.args.get('batch_size', PAYMENT_BATCH_SIZE, type=int))
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify(error=f'Unsupported import format: {fmt!r} (use csv or jsonl).'), 400
+
+    if request.args.get('async') == '1':
+        os.makedirs(app.config['JOB_SPOOL_DIR'], exist_ok=True)
+        path = os.path.join(app.config['JOB_SPOOL_DIR'], f'payments-{uuid.uuid4().hex}.{fmt}')
+        with open(path, 'wb') as fh:
+            shutil.copyfileobj(stream, fh, 1024 * 1024)
+        conn = get_db()
+        job_id = enqueue_job(conn, 'import_payments',
+                             {'path': path, 'format': fmt, 'batch_size': batch_size}, max_attempts=1)
+        conn.commit()
+        return jsonify(job_id=job_id), 202, {'Location': url_for('job_detail', id=job_id)}
 
-    return render_with_base(VIEW_INVOICE_TEMPLATE, invoice=invoice, items=items)
+    try:
+        report = import_bank_payments(get_db(), iter_import_records(stream, fmt), batch_size=batch_size)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(report), 200 if not report['error_count'] else 207
 
 
 @app.route('/update_status/<int:id>/<status>', methods=['POST'])
 def update_status(id, status):
-    conn = get_db_connection()
-    conn.execute('UPDATE invoices SET status = ? WHERE id = ?', (status, id))
-    conn.commit()
-    conn.close()
-    flash(f'Invoice #{id} marked as {status}.', 'success')
+    conn = get_db()
+    try:
+        result = bulk_update_status(conn, invoice_selection(ids=[id]), status, reference='Marked as paid')
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('view_invoice', id=id))
+    if not result['matched']:
+        flash('Invoice not found.', 'danger')
+        return redirect(url_for('index'))
+    if result['updated']:
+        invalidate_invoice_pdfs(id)
+        flash(f'Invoice #{id} marked as {status}.', 'success')
+    else:
+        flash(f'Invoice #{id} cannot be marked as {status} from its current status.', 'danger')
     return redirect(url_for('view_invoice', id=id))
 
 
 @app.route('/delete_invoice/<int:id>', methods=['POST'])
 def delete_invoice(id):
-    conn = get_db_connection()
-    conn.execute('DELETE FROM invoices WHERE id = ?', (id,))
-    # Cascade delete handles items usually, but let's be safe for sqlite (PRAGMA foreign_keys=ON needed)
-    conn.execute('DELETE FROM invoice_items WHERE invoice_id = ?', (id,))
-    conn.commit()
-    conn.close()
-    flash('Invoice deleted permanently.', 'warning')
+    result = bulk_delete_invoices(get_db(), invoice_selection(ids=[id]))
+    if result['deleted']:
+        invalidate_invoice_pdfs(id)
+        flash(f'Invoice #{id} moved to the trash.', 'warning')
+    elif result['matched']:
+        flash('Paid or part-paid invoices cannot be deleted.', 'danger')
+    return redirect(url_for('index'))
+
+
+@app.route('/invoice/<int:id>/restore', methods=['POST'])
+def restore_invoice(id):
+    if restore_invoices(get_db(), invoice_selection(ids=[id], trash=True))['restored']:
+        flash(f'Invoice #{id} restored.', 'success')
+        return redirect(url_for('view_invoice', id=id))
+    flash('Invoice not found in the trash.', 'danger')
+    return redirect(url_for('index', trash=1))
+
+
+def wants_json():
+    return request.is_json or request.accept_mimetypes.best == 'application/json'
+
+
+def bulk_request():
+    """(selection, args) from a JSON body or form: ids, or status/start/end/q filters."""
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {key: request.form.getlist(key) if key == 'ids' else request.form.get(key)
+                for key in ('ids', 'to', 'status', 'start', 'end', 'q')}
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object.')
+    for key in ('to', 'status', 'start', 'end', 'q'):
+        if not isinstance(data.get(key) or '', str):
+            raise ValueError(f'{key} must be a string.')
+    selection = invoice_selection(data.get('ids'), data.get('status') or None, data.get('start') or None,
+                                  data.get('end') or None, data.get('q') or None)
+    return selection, data
+
+
+def bulk_error(error):
+    if wants_json():
+        return jsonify(error=str(error)), 400
+    flash(str(error), 'danger')
     return redirect(url_for('index'))
 
 
+def bulk_response(result, message, data):
+    """JSON for API callers; a flash and the filtered dashboard for the form."""
+    if wants_json():
+        return jsonify(result)
+    flash(message, 'success' if not result['skipped'] else 'warning')
+    return redirect(url_for('index', status=data.get('status') or None, q=data.get('q') or None))
+
+
+@app.route('/invoices/bulk/status', methods=['POST'])
+def bulk_status():
+    """Move selected (ids) or filtered invoices to `to`, within the status state machine."""
+    try:
+        selection, data = bulk_request()
+        result = bulk_update_status(get_db(), selection, data.get('to') or '')
+    except ValueError as e:
+        return bulk_error(e)
+    message = f"{result['updated']} invoice{'s' if result['updated'] != 1 else ''} marked as {data['to']}."
+    if result['skipped']:
+        message += f" {result['skipped']} skipped (status change not allowed)."
+    return bulk_response(result, message, data)
+
+
+@app.route('/invoices/bulk/delete', methods=['POST'])
+def bulk_delete():
+    try:
+        selection, data = bulk_request()
+    except ValueError as e:
+        return bulk_error(e)
+    result = bulk_delete_invoices(get_db(), selection)
+    message = f"{result['deleted']} invoice{'s' if result['deleted'] != 1 else ''} moved to the trash."
+    if result['skipped']:
+        message += f" {result['skipped']} skipped (paid or part-paid)."
+    return bulk_response(result, message, data)
+
+
+# --- REPORTS ---
+
+
+def report_range():
+    """start/end query args as ISO dates; defaults to the last twelve months."""
+    end = date.fromisoformat(request.args.get('end') or date.today().isoformat())
+    start = date.fromisoformat(request.args.get('start') or add_months(end, -11).replace(day=1).isoformat())
+    return start, end
+
+
+@app.route('/reports')
+def reports():
+    try:
+        start, end = report_range()
+    except ValueError:
+        flash('Report dates must be YYYY-MM-DD.', 'danger')
+        return redirect(url_for('reports'))
+    conn = get_db()
+    return render_with_base('reports.html', start=start.isoformat(), end=end.isoformat(),
+                            revenue=revenue_series(conn, 'month', start.isoformat(), end.isoformat()),
+                            products=product_report(conn, start.isoformat()[:7], end.isoformat()[:7], 10),
+                            customers=customer_report(conn, 10),
+                            aging=aging_report(conn))
+
+# --- BACKGROUND JOBS ---
+
+
+@app.route('/jobs', methods=['POST'])
+def enqueue_job_route():
+    """
+    Queue a registered job kind: JSON body {"kind": ..., "payload": {...}}.
+    Uploads are queued by /import and /payments/import (?async=1) instead.
+    """
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict) or not isinstance(body.get('payload') or {}, dict):
+        return jsonify(error='Expected {"kind": ..., "payload": {...}}.'), 400
+    if isinstance(body.get('kind'), str) and body['kind'] in SPOOLED_JOB_KINDS:
+        return jsonify(error=f"{body['kind']!r} jobs are queued by their upload route."), 400
+    conn = get_db()
+    try:
+        job_id = enqueue_job(conn, body.get('kind'), body.get('payload'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    conn.commit()
+    return jsonify(job_id=job_id), 202, {'Location': url_for('job_detail', id=job_id)}
+
+
+@app.route('/jobs/<int:id>')
+def job_detail(id):
+    row = get_db().execute('SELECT * FROM jobs WHERE id = ?', (id,)).fetchone()
+    if row is None:
+        return jsonify(error='Job not found.'), 404
+    return jsonify(job_status(row))
+
+# --- JSON API (v1) ---
+
+API_DEFAULT_LIMIT = 100
+API_MAX_LIMIT = 1000
+INVOICE_API_FIELDS = ('id', 'customer_id', 'customer_name', 'customer_email', 'date', 'due_date', 'status',
+                      'subtotal', 'tax_rate', 'tax_amount', 'total_amount', 'row_version', 'deleted_at',
+                      'archived_at')
+
+
+def api_etag(*parts):
+    """Strong ETag from version numbers plus the query string that shaped the response."""
+    query = hashlib.sha1(request.query_string).hexdigest()[:12]
+    return '-'.join(str(part) for part in parts + (query,))
+
+
+def api_not_modified(etag):
+    """A 304 response if the client already holds `etag`, else None."""
+    # Weak comparison: compress_response weakens the ETag of compressed bodies
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def api_json(payload, etag):
+    response = Response(json.dumps(payload, separators=(',', ':')), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # always revalidate; a 304 is cheap
+    return response
+
+
+def api_limit():
+    return min(max(request.args.get('limit', API_DEFAULT_LIMIT, type=int), 1), API_MAX_LIMIT)
+
+
+@app.route('/api/v1/products')
+def api_products():
+    conn = get_db()
+    etag = api_etag('products', table_version(conn, 'products'))
+    cached = api_not_modified(etag)
+    if cached:
+        return cached
+
+    limit = api_limit()
+    after = decode_cursor(request.args.get('after'), 1)
+    rows = conn.execute('SELECT id, name, sku, category, price, row_version FROM products '
+                        'WHERE id > ? ORDER BY id LIMIT ?', (after[0] if after else 0, limit + 1)).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None
+    return api_json({'data': [dict(row) for row in rows[:limit]], 'next': next_cursor}, etag)
+
+
+@app.route('/api/v1/reports/<name>')
+def api_report(name):
+    """
+    revenue (?granularity=day|month), customers, products, aging, and
+    adhoc (?by=customer|week, computed from invoices for the range;
+    ?archive=1 includes archived ones).
+    """
+    try:
+        start, end = report_range()
+    except ValueError:
+        return jsonify(error='start and end must be YYYY-MM-DD.'), 400
+    conn = get_db()
+    etag = api_etag('report', name, table_version(conn, 'invoices'), date.today().isoformat())
+    cached = api_not_modified(etag)
+    if cached:
+        return cached
+    start, end = start.isoformat(), end.isoformat()
+    if name == 'revenue':
+        rows = revenue_series(conn, request.args.get('granularity', 'month'), start, end)
+    elif name == 'customers':
+        rows = customer_report(conn, api_limit())
+    elif name == 'products':
+        rows = product_report(conn, start[:7], end[:7], api_limit())
+    elif name == 'aging':
+        rows = aging_report(conn)
+    elif name == 'adhoc':
+        by = request.args.get('by', 'customer')
+        if by not in ('customer', 'week'):
+            return jsonify(error='by must be customer or week.'), 400
+        rows = adhoc_revenue(conn, start, end, by, request.args.get('archive') == '1')[:api_limit()]
+    else:
+        return jsonify(error=f'Unknown report: {name!r}'), 404
+    return api_json({'report': name, 'start': start, 'end': end, 'data': rows}, etag)
+
+
+@app.route('/api/v1/products/lookup')
+def api_product_lookup():
+    """Typeahead: ?q= word/SKU prefix, ?limit=, ?after= cursor from the previous page."""
+    catalog = get_catalog(get_db())
+    etag = api_etag('catalog', catalog.version)
+    cached = api_not_modified(etag)
+    if cached:
+        return cached
+
+    limit = min(max(request.args.get('limit', 20, type=int), 1), API_MAX_LIMIT)
+    cursor = decode_cursor(request.args.get('after'), 2)
+    if request.args.get('after') and not (cursor and type(cursor[1]) is int and cursor[1] >= 0):
+        return jsonify(error='Invalid cursor.'), 400
+    # A cursor from an older catalog snapshot restarts from the top
+    start = cursor[1] if cursor and cursor[0] == catalog.version else 0
+    products, resume = catalog.lookup(request.args.get('q', ''), limit, start)
+    next_cursor = encode_cursor(catalog.version, resume) if resume is not None else None
+    return api_json({'data': products, 'next': next_cursor}, etag)
+
+
+@app.route('/api/v1/invoices')
+def api_invoices():
+    conn = get_db()
+    etag = api_etag('invoices', table_version(conn, 'invoices'))
+    cached = api_not_modified(etag)
+    if cached:
+        return cached
+
+    limit = api_limit()
+    conditions, params = ['deleted_at IS NULL'], []
+    after = decode_cursor(request.args.get('after'), 1)
+    if after:
+        conditions.append('id < ?')
+        params.append(after[0])
+    if request.args.get('status'):
+        conditions.append('status = ?')
+        params.append(request.args['status'])
+    sql = f'SELECT {", ".join(INVOICE_API_FIELDS)} FROM invoices WHERE ' + ' AND '.join(conditions)
+    rows = conn.execute(sql + ' ORDER BY id DESC LIMIT ?', params + [limit + 1]).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None
+    return api_json({'data': [dict(row) for row in rows[:limit]], 'next': next_cursor}, etag)
+
+
+@app.route('/api/v1/invoices/<int:id>')
+def api_invoice(id):
+    conn = get_db()
+    # Line items never change after creation, so the row version covers them
+    row, schema = locate_invoice(conn, id)
+    if row is None:
+        return jsonify(error='Invoice not found.'), 404
+    etag = api_etag('invoice', id, row['row_version'], schema)
+    cached = api_not_modified(etag)
+    if cached:
+        return cached
+
+    invoice = conn.execute(f'SELECT {", ".join(INVOICE_API_FIELDS)}, total_cents, paid_cents '
+                           f'FROM {schema}.invoices WHERE id = ?', (id,)).fetchone()
+    items = conn.execute(f'SELECT product_name, quantity, price, subtotal FROM {schema}.invoice_items '
+                         'WHERE invoice_id = ? ORDER BY id', (id,)).fetchall()
+    payload = dict(invoice)
+    total, paid = payload.pop('total_cents'), payload.pop('paid_cents')
+    payload['amount_paid'] = from_cents(paid)
+    payload['balance_due'] = from_cents(total - paid)
+    payload['items'] = [dict(item) for item in items]
+    return api_json(payload, etag)
+
+
+@app.route('/api/v1/customers')
+def api_customers():
+    conn = get_db()
+    etag = api_etag('customers', table_version(conn, 'invoices'), table_version(conn, 'customers'))
+    cached = api_not_modified(etag)
+    if cached:
+        return cached
+
+    limit = api_limit()
+    after = decode_cursor(request.args.get('after'), 1)
+    rows = conn.execute('SELECT * FROM customers WHERE id > ? ORDER BY id LIMIT ?',
+                        (after[0] if after else 0, limit + 1)).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None
+    return api_json({'data': [customer_summary(row) for row in rows[:limit]], 'next': next_cursor}, etag)
+
+
+@app.route('/api/v1/customers/<int:id>')
+def api_customer(id):
+    """Statement: maintained balances plus open invoices (?limit= caps the list)."""
+    conn = get_db()
+    etag = api_etag('customer', id, table_version(conn, 'invoices'), table_version(conn, 'customers'),
+                    table_version(conn, 'payments'))
+    cached = api_not_modified(etag)
+    if cached:
+        return cached
+    statement = customer_statement(conn, id, api_limit())
+    if statement is None:
+        return jsonify(error='Customer not found.'), 404
+    return api_json(statement, etag)
+
+
+@app.route('/api/v1/customers/<int:id>/credit')
+def api_customer_credit(id):
+    """?amount= the value of a prospective invoice; approved if it fits the credit limit."""
+    try:
+        amount = to_cents(request.args.get('amount') or 0)
+    except ValueError:
+        return jsonify(error='amount must be a number.'), 400
+    customer = load_customer(get_db(), id)
+    if customer is None:
+        return jsonify(error='Customer not found.'), 404
+    return jsonify(credit_check(customer, amount))
+
+
+@app.route('/api/v1/audit')
+def api_audit():
+    """
+    ?entity=invoice&entity_id=42, ?start=/&end= (date or datetime), ?actor=,
+    ?action=; newest first, ?after= cursor from the previous page.
+    """
+    entity_id = request.args.get('entity_id', type=int)
+    if request.args.get('entity_id') and entity_id is None:
+        return jsonify(error='entity_id must be a number.'), 400
+    after = decode_cursor(request.args.get('after'), 2)
+    # Read-your-writes for the first page only, and only when this process
+    # has events buffered; later pages and idle readers never take the write lock
+    if after is None and AUDIT.pending():
+        AUDIT.flush()
+    conn = get_db()
+    # The log is append-only, so its highest id versions it
+    etag = api_etag('audit', conn.execute('SELECT IFNULL(MAX(id), 0) FROM audit_log').fetchone()[0])
+    cached = api_not_modified(etag)
+    if cached:
+        return cached
+    try:
+        events, next_cursor = query_audit_log(
+            conn, request.args.get('entity') or None, entity_id, request.args.get('start') or None,
+            request.args.get('end') or None, request.args.get('actor') or None, request.args.get('action') or None,
+            api_limit(), after)
+    except ValueError:
+        return jsonify(error='start and end must be ISO dates or datetimes.'), 400
+    return api_json({'data': events, 'next': next_cursor}, etag)
+
+
+# ==========================================
+# COMMAND LINE (flask --app app <group> <command>)
+# ==========================================
+
+db_cli = AppGroup('db', help='Schema migrations and query diagnostics.')
+app.cli.add_command(db_cli)
+
+SQL_STATEMENT = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b', re.IGNORECASE)
+
+
+def collect_sql_statements(path=__file__):
+    """(line, sql) for every SQL string literal in this module, in source order."""
+    with open(path, encoding='utf-8') as fh:
+        tree = ast.parse(fh.read())
+    seen = set()
+    statements = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and SQL_STATEMENT.match(node.value):
+            sql = ' '.join(node.value.split())
+            if sql not in seen:
+                seen.add(sql)
+                statements.append((node.lineno, sql))
+    return sorted(statements)
+
+
+def explain_statements(conn, statements):
+    """Yield (line, sql, plan_lines, error) using EXPLAIN QUERY PLAN; params bind as NULL."""
+    for lineno, sql in statements:
+        named = re.findall(r'[:@$](\w+)', sql)
+        params = dict.fromkeys(named) if named else (None,) * sql.count('?')
+        try:
+            rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        except sqlite3.Error as e:
+            yield lineno, sql, [], str(e)
+            continue
+        depth = {0: 0}
+        plan = []
+        for node_id, parent, _, detail in rows:
+            depth[node_id] = depth.get(parent, 0) + 1
+            plan.append('  ' * depth[node_id] + detail)
+        yield lineno, sql, plan, None
+
+
+@db_cli.command('migrate')
+def db_migrate_command():
+    """Apply any pending schema migrations."""
+    init_and_migrate_db()
+    click.echo(f'Schema is at v{SCHEMA_VERSION}.')
+
+
+@db_cli.command('explain')
+@click.option('--scans-only', is_flag=True, help='Only show statements whose plan contains a full SCAN.')
+def db_explain_command(scans_only):
+    """Print EXPLAIN QUERY PLAN for every SQL literal in app.py."""
+    conn = get_db_connection()
+    scans = 0
+    try:
+        for lineno, sql, plan, error in explain_statements(conn, collect_sql_statements()):
+            has_scan = any(line.strip().startswith('SCAN') for line in plan)
+            scans += has_scan
+            if scans_only and not has_scan:
+                continue
+            click.echo(f'app.py:{lineno}  {sql}')
+            if error:
+                click.echo(f'  !! {error}')
+            for line in plan:
+                click.echo(line)
+            click.echo()
+    finally:
+        conn.close()
+    click.echo(f'{scans} statement(s) use a full table scan.')
+
+
+@db_cli.command('check-kpis')
+@click.option('--rebuild', is_flag=True, help='Recompute the totals from the invoice and product tables.')
+def db_check_kpis_command(rebuild):
+    """
+    Compare the maintained dashboard totals, report rollups and customer
+    balances with a full recount of live invoices, archive included.
+    """
+    conn = get_db_connection()
+    try:
+        mismatches = check_kpi_totals(conn) + check_report_rollups(conn) + check_customer_balances(conn)
+        for key, stored, actual in mismatches:
+            click.echo(f'{key}: stored={stored} actual={actual}')
+        if rebuild:
+            invoices, items = invoice_sources(conn, archive=True)
+            schemas = ('main', 'archive') if attach_archive(conn) else ('main',)
+            conn.execute('BEGIN IMMEDIATE')
+            settle_paid_invoices(conn.cursor(), schemas)
+            rebuild_kpi_totals(conn.cursor(), source=invoices)
+            rebuild_kpi_paid_totals(conn.cursor(), source=invoices)
+            rebuild_archive_totals(conn.cursor())
+            rebuild_report_rollups(conn.cursor(), sources=(invoices, items))
+            rebuild_customer_balances(conn.cursor(), source=invoices)
+            conn.commit()
+            click.echo('KPI totals, report rollups and customer balances rebuilt.')
+        elif mismatches:
+            raise SystemExit(1)
+        else:
+            click.echo('KPI totals, report rollups and customer balances are consistent.')
+    finally:
+        conn.close()
+
+
+invoices_cli = AppGroup('invoices', help='Bulk invoice operations.')
+app.cli.add_command(invoices_cli)
+
+
+@invoices_cli.command('import')
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help='Defaults from the file extension (csv otherwise).')
+@click.option('--batch-size', default=500, show_default=True, help='Invoices per transaction.')
+def invoices_import_command(source, fmt, batch_size):
+    """Stream invoices from a CSV/JSONL file ("-" for stdin)."""
+    fmt = fmt or ('jsonl' if source.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+    conn = get_db_connection()
+
+    def progress(report):
+        click.echo(f"  {report['invoices']} invoices, {report['lines']} lines...", err=True)
+
+    try:
+        report = import_invoices(conn, iter_import_records(source, fmt), batch_size, progress)
+    finally:
+        conn.close()
+    for error in report['errors']:
+        click.echo(f"line {error['line']} ({error['invoice_ref']}): {error['error']}", err=True)
+    click.echo(f"Imported {report['invoices']} invoices / {report['lines']} lines from "
+               f"{report['rows']} rows in {report['seconds']}s "
+               f"({report['rows_per_second']} rows/s); {report['error_count']} rejected.")
+
+
+@invoices_cli.command('render-pdfs')
+@click.option('--status', help='Only invoices with this status.')
+@click.option('--start', help='Only invoices dated on/after YYYY-MM-DD.')
+@click.option('--end', help='Only invoices dated on/before YYYY-MM-DD.')
+@click.option('--workers', type=int, help='Renderer processes (default: CPU count).')
+def invoices_render_pdfs_command(status, start, end, workers):
+    """Pre-render invoice PDFs into the cache; re-running resumes."""
+    conditions, params = ['deleted_at IS NULL'], []
+    for clause, value in (('status = ?', status), ('date >= ?', start), ('date <= ?', end)):
+        if value:
+            conditions.append(clause)
+            params.append(value)
+    sql = 'SELECT id FROM invoices WHERE ' + ' AND '.join(conditions)
+    conn = get_db_connection()
+    try:
+        invoice_ids = [row[0] for row in conn.execute(sql + ' ORDER BY id', params)]
+    finally:
+        conn.close()
+
+    started = time.perf_counter()
+    counts = render_invoice_pdfs(
+        invoice_ids, workers,
+        progress=lambda c: click.echo(f"  {c['rendered']} rendered, {c['cached']} cached...", err=True))
+    elapsed = time.perf_counter() - started
+    click.echo(f"{counts['rendered']} rendered, {counts['cached']} already cached, "
+               f"{counts['missing']} missing in {elapsed:.1f}s -> {app.config['PDF_CACHE_DIR']}/")
+
+
+@invoices_cli.command('run-recurring')
+@click.option('--date', 'run_date', help='Bill periods due on/before YYYY-MM-DD (default: today).')
+@click.option('--batch-size', default=RECURRING_BATCH_SIZE, show_default=True, help='Templates per transaction.')
+def invoices_run_recurring_command(run_date, batch_size):
+    """Generate invoices for due recurring templates; safe to re-run."""
+    conn = get_db_connection()
+    try:
+        report = generate_recurring_invoices(
+            conn, date.fromisoformat(run_date) if run_date else None, batch_size,
+            progress=lambda r: click.echo(f"  {r['invoices']} invoices...", err=True))
+    finally:
+        conn.close()
+    click.echo(f"Generated {report['invoices']} invoices from {report['templates']} templates in "
+               f"{report['seconds']}s ({report['invoices_per_second'] or 0} invoices/s).")
+
+
+@invoices_cli.command('sweep-overdue')
+@click.option('--as-of', help='Treat this YYYY-MM-DD as today.')
+def invoices_sweep_overdue_command(as_of):
+    """Mark Pending invoices past their due date as Overdue."""
+    conn = get_db_connection()
+    try:
+        changed = sweep_overdue(conn, date.fromisoformat(as_of) if as_of else None, trigger='cli')
+    finally:
+        conn.close()
+    click.echo(f'{changed} invoice(s) marked Overdue.')
+
+
+@invoices_cli.command('archive')
+@click.option('--before', help='Archive invoices closed before YYYY-MM-DD (default: ARCHIVE_AFTER_DAYS ago).')
+@click.option('--batch-size', type=int, help='Invoices per batch (default: ARCHIVE_BATCH_SIZE).')
+def invoices_archive_command(before, batch_size):
+    """Move old Paid and trashed invoices into the archive database; safe to re-run."""
+    conn = get_db_connection()
+    try:
+        report = archive_invoices(conn, date.fromisoformat(before) if before else None, batch_size,
+                                  progress=lambda r: click.echo(f"  {r['invoices']} invoices...", err=True))
+    finally:
+        conn.close()
+    click.echo(f"Archived {report['invoices']} invoices / {report['lines']} lines closed before "
+               f"{report['before']} in {report['seconds']}s -> {archive_path()}"
+               + (f"; {report['skipped']} changed meanwhile and stay hot." if report['skipped'] else '.'))
+
+
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+app.cli.add_command(jobs_cli)
+
+
+@jobs_cli.command('work')
+@click.option('--workers', default=4, show_default=True, help='Worker threads.')
+def jobs_work_command(workers):
+    """Run job workers in the foreground until interrupted."""
+    pool = JobWorkerPool(workers).start()
+    click.echo(f'{workers} job worker(s) polling {DB_NAME}; Ctrl-C to stop.')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop(timeout=5)
+
+
+@jobs_cli.command('enqueue')
+@click.argument('kind')
+@click.option('--payload', default='{}', help='JSON payload.')
+def jobs_enqueue_command(kind, payload):
+    """Queue a job of KIND."""
+    conn = get_db_connection()
+    try:
+        job_id = enqueue_job(conn, kind, json.loads(payload))
+        conn.commit()
+    finally:
+        conn.close()
+    click.echo(f'Queued job {job_id}.')
+
+
+@jobs_cli.command('list')
+@click.option('--status', help='queued, running, done or failed.')
+@click.option('--limit', default=20, show_default=True)
+def jobs_list_command(status, limit):
+    """Show the most recent jobs."""
+    conn = get_db_connection()
+    try:
+        sql = 'SELECT * FROM jobs' + (' WHERE status = ?' if status else '') + ' ORDER BY id DESC LIMIT ?'
+        for row in conn.execute(sql, ([status] if status else []) + [limit]):
+            progress = f"{row['progress']}/{row['total']}" if row['total'] else str(row['progress'])
+            click.echo(f"#{row['id']:<6} {row['kind']:<18} {row['status']:<8} "
+                       f"attempt {row['attempts']}/{row['max_attempts']}  {progress:>12}  {row['error'] or ''}")
+    finally:
+        conn.close()
+
+
+customers_cli = AppGroup('customers', help='Customer accounts.')
+app.cli.add_command(customers_cli)
+
+
+@customers_cli.command('credit-limit')
+@click.argument('customer_id', type=int)
+@click.argument('amount')
+def customers_credit_limit_command(customer_id, amount):
+    """Set a customer's credit limit (AMOUNT "none" removes it)."""
+    try:
+        limit = None if amount.lower() == 'none' else to_cents(amount)
+    except ValueError:
+        raise click.BadParameter('must be an amount or "none".', param_hint='AMOUNT') from None
+    conn = get_db_connection()
+    try:
+        with write_transaction(conn):
+            old = conn.execute('SELECT credit_limit_cents FROM customers WHERE id = ?', (customer_id,)).fetchone()
+            conn.execute('UPDATE customers SET credit_limit_cents = ? WHERE id = ?', (limit, customer_id))
+        if old is None:
+            raise click.ClickException(f'No customer #{customer_id}.')
+        audit('update', 'customer', customer_id,
+              {'credit_limit': from_cents(old[0]) if old[0] is not None else None},
+              {'credit_limit': from_cents(limit) if limit is not None else None})
+        summary = customer_summary(load_customer(conn, customer_id))
+        click.echo(f"{summary['name']}: limit {summary['credit_limit']}, outstanding {summary['outstanding']:.2f}")
+    finally:
+        conn.close()
+
+
+payments_cli = AppGroup('payments', help='Payments ledger and bank reconciliation.')
+app.cli.add_command(payments_cli)
+
+
+@payments_cli.command('import')
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help='Defaults from the file extension (csv otherwise).')
+@click.option('--batch-size', default=PAYMENT_BATCH_SIZE, show_default=True, help='Payments per transaction.')
+def payments_import_command(source, fmt, batch_size):
+    """Reconcile a bank statement file ("-" for stdin) against open invoices."""
+    fmt = fmt or ('jsonl' if source.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+    conn = get_db_connection()
+
+    def progress(report):
+        click.echo(f"  {report['rows']} lines, {report['payments']} payments...", err=True)
+
+    try:
+        report = import_bank_payments(conn, iter_import_records(source, fmt), batch_size, progress)
+    finally:
+        conn.close()
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Recorded {report['payments']} payments from {report['rows']} lines in {report['seconds']}s "
+               f"({report['rows_per_second']} lines/s): {report['applied']:,.2f} applied, "
+               f"{report['unapplied']:,.2f} unapplied; {report['duplicates']} already imported, "
+               f"{report['error_count']} rejected.")
+
+
+@payments_cli.command('record')
+@click.argument('customer_id', type=int)
+@click.argument('amount')
+@click.option('--date', 'received_on', type=click.DateTime(['%Y-%m-%d']), help='Defaults to today.')
+@click.option('--invoice', 'invoice_id', type=int, help='Apply to this invoice first.')
+@click.option('--reference')
+def payments_record_command(customer_id, amount, received_on, invoice_id, reference):
+    """Record a payment from a customer and allocate it oldest-first."""
+    try:
+        amount_cents = to_cents(amount)
+    except ValueError:
+        raise click.BadParameter('must be an amount.', param_hint='AMOUNT') from None
+    if amount_cents <= 0:
+        raise click.BadParameter('must be positive.', param_hint='AMOUNT')
+    conn = get_db_connection()
+    try:
+        if load_customer(conn, customer_id) is None:
+            raise click.ClickException(f'No customer #{customer_id}.')
+        payment = {'customer_id': customer_id, 'amount_cents': amount_cents,
+                   'received_on': (received_on.date() if received_on else date.today()).isoformat(),
+                   'invoice_id': invoice_id, 'reference': reference}
+        with write_transaction(conn):
+            results = allocate_payments(conn, [payment])
+        AUDIT.record(payment_audit_events([payment], results))
+        payment_id, applied, unapplied = results[0]
+    finally:
+        conn.close()
+    click.echo(f'Payment #{payment_id}: {from_cents(applied):,.2f} applied, {from_cents(unapplied):,.2f} unapplied.')
+
+
 if __name__ == '__main__':
     print("Starting NexusBilling Enterprise Server...")
     print("Dashboard available at: http://127.0.0.1:5000")
-    app.run(debug=True)
+    # BILLING_RELOADER=0 serves from this process; with the reloader on, the
+    # watching parent serves nothing and only the serving child runs job workers
+    reloader = os.environ.get('BILLING_RELOADER', '1') != '0'
+    if app.config['JOB_WORKERS'] and (not reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        JobWorkerPool(app.config['JOB_WORKERS']).start()
+    app.run(debug=True, use_reloader=reloader)
@@ -0,0 +1,76 @@
+"""
+Dashboard reads with and without the invoice archive.
+
+A synthetic dataset (datagen.py) spanning --days of history is generated,
+then each mode runs on its own copy of it. "single" keeps every invoice in
+the hot table, as before archiving existed; "archived" first runs
+archive_invoices with a --keep-days cutoff, so only recent and still open
+invoices stay hot. Both then serve the same mix of dashboard pages (first
+page, status filter, deep keyset page, search) plus an open-invoice aging
+report, and print the mean time per request and the hot table's size.
+
+Usage:
+    python benchmarks/bench_archive.py [--invoices 200000] [--days 2190] [--keep-days 365] [--requests 500]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+WORKDIR = tempfile.mkdtemp(prefix='nexus-bench-')
+os.environ.setdefault('BILLING_DB', os.path.join(WORKDIR, 'seed.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as billing  # noqa: E402
+import datagen  # noqa: E402
+
+
+def use_database(path):
+    billing.db_pool.close_all()
+    billing.DB_NAME = path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--invoices', type=int, default=200_000)
+    parser.add_argument('--days', type=int, default=2190, help='history covered by the dataset')
+    parser.add_argument('--keep-days', type=int, default=365, help='archive cutoff for the "archived" mode')
+    parser.add_argument('--requests', type=int, default=500, help='requests per page')
+    args = parser.parse_args()
+
+    seed_db = os.environ['BILLING_DB']
+    conn = billing.get_db_connection()
+    datagen.generate(conn, args.invoices, customers=max(1, args.invoices // 10), days=args.days)
+    conn.close()
+
+    billing.app.config['OVERDUE_SWEEP_INTERVAL'] = 10 ** 9  # keep the lazy sweep out of the timings
+    for mode in ('single', 'archived'):
+        path = os.path.join(WORKDIR, f'{mode}.db')
+        shutil.copy(seed_db, path)
+        use_database(path)
+        conn = billing.get_db_connection()
+        if mode == 'archived':
+            report = billing.archive_invoices(conn, date.today() - timedelta(days=args.keep_days))
+            print(f"archived  {report['invoices']} invoices in {report['seconds']}s")
+        hot = conn.execute('SELECT count(*) FROM invoices').fetchone()[0]
+        deep = conn.execute('SELECT id FROM invoices ORDER BY id DESC LIMIT 1 OFFSET ?', (hot // 2,)).fetchone()[0]
+        conn.close()
+
+        client = billing.app.test_client(use_cookies=False)
+        pages = {'dashboard': '/', 'status': '/?status=Paid', 'deep page': f'/?after={billing.encode_cursor(deep)}',
+                 'search': '/?q=Acme', 'aging': '/api/v1/reports/aging'}
+        for label, url in pages.items():
+            client.get(url)  # warm the page cache and template
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                client.get(url, headers={'Cache-Control': 'no-cache'})
+            per_request = (time.perf_counter() - start) / args.requests
+            print(f'{mode:<10}{label:<12}{per_request * 1000:>8.3f} ms/request  ({hot} hot invoices)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Cost of the audit trail on the request path.
+
+Each mode moves --requests / 2 invoices Pending -> Overdue -> Pending through
+POST /update_status on its own copy of a synthetic dataset (datagen.py). "off"
+drops audit events, "sync" writes each request's events before it returns
+(one extra write transaction per mutation), "buffered" is the shipped
+AuditLog: the request appends to memory and the flusher batches the INSERTs.
+The buffered figure includes the final flush, so nothing is left unwritten.
+
+Usage:
+    python benchmarks/bench_audit.py [--invoices 20000] [--requests 2000]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='nexus-bench-')
+os.environ.setdefault('BILLING_DB', os.path.join(WORKDIR, 'seed.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as billing  # noqa: E402
+import datagen  # noqa: E402
+
+
+def use_database(path):
+    billing.db_pool.close_all()
+    billing.DB_NAME = path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--invoices', type=int, default=20_000)
+    parser.add_argument('--requests', type=int, default=2_000)
+    args = parser.parse_args()
+
+    seed_db = os.environ['BILLING_DB']
+    conn = billing.get_db_connection()
+    datagen.generate(conn, args.invoices, customers=max(1, args.invoices // 10),
+                     status_mix={'Pending': 1})
+    ids = [row[0] for row in conn.execute('SELECT id FROM invoices ORDER BY id LIMIT ?', (args.requests // 2,))]
+    conn.close()
+
+    record = billing.AuditLog.record
+    for mode in ('off', 'sync', 'buffered'):
+        path = os.path.join(WORKDIR, f'{mode}.db')
+        shutil.copy(seed_db, path)
+        use_database(path)
+        if mode == 'off':
+            billing.AuditLog.record = lambda self, events: None
+        elif mode == 'sync':
+            billing.AuditLog.record = lambda self, events: (record(self, events), self.flush())
+        else:
+            billing.AuditLog.record = record
+        client = billing.app.test_client(use_cookies=False)  # flashes would pile up unread
+        start = time.perf_counter()
+        for invoice_id in ids:
+            client.post(f'/update_status/{invoice_id}/Overdue')
+            client.post(f'/update_status/{invoice_id}/Pending')
+        requests_done = time.perf_counter() - start
+        billing.AUDIT.flush()
+        total = time.perf_counter() - start
+        conn = billing.get_db_connection()
+        logged = conn.execute('SELECT count(*) FROM audit_log').fetchone()[0]
+        conn.close()
+        print(f'{mode:<10}{requests_done / (2 * len(ids)) * 1000:>8.3f} ms/request  {total:>7.2f}s total '
+              f'({logged} events logged)')
+    billing.AuditLog.record = record
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Mixed read/write load against the dashboard and save_invoice on several threads.
+
+Compares the legacy connection handling (open + close per request, rollback
+journal, no pragmas) with the pooled WAL profile. Each profile gets its own
+fresh database file because journal_mode=WAL is persisted in the file.
+
+Usage:
+    python benchmarks/bench_concurrency.py [--threads 8] [--seconds 5] [--write-ratio 0.2]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='nexus-bench-')
+os.environ.setdefault('BILLING_DB', os.path.join(WORKDIR, 'import.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as billing  # noqa: E402
+
+TUNED_PRAGMAS = dict(billing.app.config['SQLITE_PRAGMAS'])
+PROFILES = {
+    'legacy': {'pragmas': {}, 'pool': False},
+    'pooled-wal': {'pragmas': TUNED_PRAGMAS, 'pool': True},
+}
+
+INVOICE_FORM = {
+    'customer_name': 'Load Test Client', 'customer_email': 'load@example.com',
+    'date': '2024-01-01', 'due_date': '2024-01-31',
+    'subtotal': '300', 'tax_rate': '10', 'tax_amount': '30', 'total_amount': '330',
+    'product_names[]': ['IT Consultation (Hourly)', 'Mechanical Keyboard'],
+    'quantities[]': ['1', '2'], 'prices[]': ['150', '75'],
+}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def worker(deadline, write_ratio, latencies, errors, seed):
+    rng = random.Random(seed)
+    client = billing.app.test_client()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if rng.random() < write_ratio:
+            response = client.post('/save_invoice', data=INVOICE_FORM)
+            ok = response.status_code == 302
+        else:
+            response = client.get('/')
+            ok = response.status_code == 200
+        latencies.append((time.perf_counter() - start) * 1000)
+        if not ok:
+            errors.append(response.status_code)
+
+
+def run_profile(name, profile, args):
+    billing.db_pool.close_all()
+    billing.DB_NAME = os.path.join(WORKDIR, f'{name}.db')
+    billing.app.config['SQLITE_PRAGMAS'] = profile['pragmas']
+    billing.app.config['SQLITE_POOL_CONNECTIONS'] = profile['pool']
+    billing.init_and_migrate_db()
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=worker, args=(deadline, args.write_ratio, latencies, errors, i))
+               for i in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / args.seconds,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies, default=0.0),
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}")
+    for name, profile in PROFILES.items():
+        r = run_profile(name, profile, args)
+        print(f"{name:<12}{r['rps']:>9.0f}{r['p50']:>9.2f}{r['p95']:>9.2f}"
+              f"{r['p99']:>9.2f}{r['max']:>9.2f}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
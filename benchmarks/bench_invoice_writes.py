@@ -0,0 +1,91 @@
+"""
+Time taken to write one invoice of 1, 100 and 10,000 lines.
+
+"legacy" replays the old save_invoice loop (parse + INSERT per line inside an
+implicit deferred transaction); "batched" is insert_invoice, which prices
+every line up front and inserts them with one executemany inside
+BEGIN IMMEDIATE. Both end-to-end time and the time spent inside the write
+transaction (i.e. holding the database write lock) are reported.
+
+Usage:
+    python benchmarks/bench_invoice_writes.py [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('BILLING_DB', os.path.join(
+    tempfile.mkdtemp(prefix='nexus-bench-'), 'bench.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as billing  # noqa: E402
+
+LINE_COUNTS = (1, 100, 10_000)
+
+
+def form_lines(count):
+    names = [f'Project task {i}' for i in range(count)]
+    quantities = [str(1 + i % 5) for i in range(count)]
+    prices = [f'{10 + i % 90}.25' for i in range(count)]
+    return names, quantities, prices
+
+
+def legacy_write(conn, names, quantities, prices):
+    cur = conn.cursor()
+    cur.execute('''INSERT INTO invoices
+                   (customer_name, customer_email, date, due_date, subtotal, tax_rate, tax_amount, total_amount, status)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'Pending')''',
+                ('Bench Client', None, '2024-01-01', None, 0, 0, 0, 0))
+    invoice_id = cur.lastrowid
+    for i in range(len(names)):
+        qty = int(quantities[i])
+        price = float(prices[i])
+        cur.execute('''INSERT INTO invoice_items
+                       (invoice_id, product_name, quantity, price, subtotal)
+                       VALUES (?, ?, ?, ?, ?)''',
+                    (invoice_id, names[i], qty, price, qty * price))
+    billing.refresh_invoice_search_items(conn, [invoice_id])
+    conn.commit()
+
+
+def batched_write(conn, names, quantities, prices):
+    lines, _ = billing.build_invoice_lines(names, quantities, prices)
+    start = time.perf_counter()
+    with billing.write_transaction(conn):
+        billing.insert_invoice(conn, 'Bench Client', None, '2024-01-01', None, 0.0, lines)
+    return start
+
+
+def best_of(repeat, fn, *args):
+    """Best (end-to-end ms, write-lock ms) over `repeat` runs."""
+    totals, locked = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        lock_start = fn(*args) or start  # legacy parses while holding the lock
+        end = time.perf_counter()
+        totals.append((end - start) * 1000)
+        locked.append((end - lock_start) * 1000)
+    return min(totals), min(locked)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    conn = billing.get_db_connection()
+    print(f"{'lines':>7}{'legacy total':>14}{'batched total':>15}"
+          f"{'legacy lock':>13}{'batched lock':>14}  (ms)")
+    for count in LINE_COUNTS:
+        data = form_lines(count)
+        legacy_total, legacy_lock = best_of(args.repeat, legacy_write, conn, *data)
+        batched_total, batched_lock = best_of(args.repeat, batched_write, conn, *data)
+        print(f"{count:>7}{legacy_total:>14.2f}{batched_total:>15.2f}"
+              f"{legacy_lock:>13.2f}{batched_lock:>14.2f}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Throughput of Decimal versus integer-cent arithmetic for bulk invoice totals.
+
+N invoices of 5 lines each are priced (line totals, tax, grand total) with
+decimal.Decimal quantized to the cent and with integer cents as
+insert_invoice does. "parse" turns the submitted price strings into either
+form; "totals" is the arithmetic on already-parsed amounts, which is what
+every later total, rollup and report repeats. "sum" adds the same N totals
+in SQLite over the REAL column and the integer cents column, and shows how
+far the REAL sum drifted from the exact total.
+
+Usage:
+    python benchmarks/bench_money.py [--invoices 200000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+os.environ.setdefault('BILLING_DB', os.path.join(
+    tempfile.mkdtemp(prefix='nexus-bench-'), 'bench.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as billing  # noqa: E402
+
+LINES_PER_INVOICE = 5
+CENT = Decimal('0.01')
+
+
+def sample_invoices(count):
+    rng = random.Random(42)
+    return [([(rng.randint(1, 9), f'{rng.randint(0, 999)}.{rng.randint(0, 99):02d}')
+              for _ in range(LINES_PER_INVOICE)], rng.choice((0, 5, 7.5, 18)))
+            for _ in range(count)]
+
+
+def parse_decimal(invoices):
+    return [([(qty, Decimal(price)) for qty, price in lines], Decimal(repr(rate)))
+            for lines, rate in invoices]
+
+
+def parse_cents(invoices):
+    return [([(qty, billing.to_cents(price)) for qty, price in lines], rate)
+            for lines, rate in invoices]
+
+
+def totals_decimal(invoices):
+    grand = Decimal(0)
+    for lines, rate in invoices:
+        subtotal = sum(qty * price for qty, price in lines)
+        grand += subtotal + (subtotal * rate / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+    return int(grand.scaleb(2))
+
+
+def totals_cents(invoices):
+    grand = 0
+    for lines, rate in invoices:
+        subtotal = sum(qty * price for qty, price in lines)
+        grand += subtotal + billing.tax_cents(subtotal, rate)
+    return grand
+
+
+def best_of(repeat, fn, *args):
+    """(best seconds, result) over `repeat` runs."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def load_totals(conn, invoices):
+    """One invoices row per sample with both representations of its total."""
+    conn.execute('DROP TABLE IF EXISTS bench_totals')
+    conn.execute('CREATE TABLE bench_totals (total_amount REAL, total_cents INTEGER)')
+    rows = []
+    for lines, rate in parse_cents(invoices):
+        subtotal = sum(qty * price for qty, price in lines)
+        total = subtotal + billing.tax_cents(subtotal, rate)
+        rows.append((billing.from_cents(total), total))
+    conn.executemany('INSERT INTO bench_totals VALUES (?, ?)', rows)
+    conn.commit()
+    return sum(cents for _, cents in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--invoices', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    invoices = sample_invoices(args.invoices)
+    print(f"{args.invoices} invoices x {LINES_PER_INVOICE} lines{'Decimal':>14}{'int cents':>14}  (invoices/s)")
+    parse_dec_s, parsed_dec = best_of(args.repeat, parse_decimal, invoices)
+    parse_int_s, parsed_int = best_of(args.repeat, parse_cents, invoices)
+    print(f"{'parse':>24}{args.invoices / parse_dec_s:>14,.0f}{args.invoices / parse_int_s:>14,.0f}")
+    dec_s, dec_total = best_of(args.repeat, totals_decimal, parsed_dec)
+    int_s, int_total = best_of(args.repeat, totals_cents, parsed_int)
+    assert dec_total == int_total, (dec_total, int_total)
+    print(f"{'totals':>24}{args.invoices / dec_s:>14,.0f}{args.invoices / int_s:>14,.0f}")
+
+    conn = billing.get_db_connection()
+    exact = load_totals(conn, invoices)
+    real_s, real_sum = best_of(args.repeat, lambda: conn.execute(
+        'SELECT SUM(total_amount) FROM bench_totals').fetchone()[0])
+    cents_s, cents_sum = best_of(args.repeat, lambda: conn.execute(
+        'SELECT SUM(total_cents) FROM bench_totals').fetchone()[0])
+    conn.execute('DROP TABLE bench_totals')
+    conn.close()
+    print(f"SQL SUM over {args.invoices} rows (exact total {exact / 100:,.2f})")
+    print(f"{'REAL':>12}{real_s * 1000:>10.2f}ms  drift {real_sum - exact / 100:+.10f}")
+    print(f"{'INTEGER':>12}{cents_s * 1000:>10.2f}ms  drift {(cents_sum - exact) / 100:+.10f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Time to reconcile a bank statement against open invoices.
+
+A synthetic dataset (datagen.py) is generated, then a bank file of --lines
+credits is built from its open invoices: most name an invoice number, some
+only the payer's email, some are part-payments. "clicks" settles the same
+invoices one POST /update_status/<id>/Paid at a time, as before the
+payments ledger; "reconcile" is import_bank_payments, which allocates each
+batch with one set-based UPDATE. Each mode runs on its own copy of the data.
+
+Usage:
+    python benchmarks/bench_payments.py [--invoices 50000] [--lines 20000] [--clicks 1000]
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='nexus-bench-')
+os.environ.setdefault('BILLING_DB', os.path.join(WORKDIR, 'seed.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as billing  # noqa: E402
+import datagen  # noqa: E402
+
+
+def bank_file(conn, lines, seed=7):
+    """CSV bytes of `lines` credits drawn from the open invoices; returns (data, invoice ids)."""
+    rows = conn.execute('''SELECT i.id, i.total_cents, c.email FROM invoices i
+                           JOIN customers c ON c.id = i.customer_id
+                           WHERE i.status IN ('Pending', 'Overdue') ORDER BY i.id''').fetchall()
+    rng = random.Random(seed)
+    rng.shuffle(rows)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(billing.BANK_FIELDS)
+    ids = []
+    for n in range(lines):
+        invoice_id, total, email = rows[n % len(rows)]
+        ids.append(invoice_id)
+        kind = rng.random()
+        if kind < 0.7:
+            writer.writerow([f'TX{n}', '2024-06-30', f'{total / 100:.2f}', f'Payment INV-{invoice_id:05d}', '', ''])
+        elif kind < 0.9:
+            writer.writerow([f'TX{n}', '2024-06-30', f'{total / 100:.2f}', 'Transfer', '', email])
+        else:
+            writer.writerow([f'TX{n}', '2024-06-30', f'{total / 200:.2f}', f'Part INV-{invoice_id}', '', ''])
+    return out.getvalue().encode(), ids
+
+
+def use_database(path):
+    billing.db_pool.close_all()
+    billing.DB_NAME = path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--invoices', type=int, default=50_000)
+    parser.add_argument('--lines', type=int, default=20_000)
+    parser.add_argument('--clicks', type=int, default=1_000, help='status clicks to time (extrapolated)')
+    args = parser.parse_args()
+
+    seed_db = os.environ['BILLING_DB']
+    conn = billing.get_db_connection()
+    datagen.generate(conn, args.invoices, customers=max(1, args.invoices // 10))
+    data, invoice_ids = bank_file(conn, args.lines)
+    conn.close()
+
+    for mode in ('clicks', 'reconcile'):
+        path = os.path.join(WORKDIR, f'{mode}.db')
+        shutil.copy(seed_db, path)
+        use_database(path)
+        if mode == 'clicks':
+            client = billing.app.test_client()
+            sample = invoice_ids[:args.clicks]
+            start = time.perf_counter()
+            for invoice_id in sample:
+                client.post(f'/update_status/{invoice_id}/Paid')
+            per_click = (time.perf_counter() - start) / len(sample)
+            print(f"{'clicks':<10}{per_click * 1000:>8.2f} ms/invoice  ~{per_click * args.lines:>7.1f}s "
+                  f"for {args.lines} lines (measured {len(sample)})")
+        else:
+            conn = billing.get_db_connection()
+            report = billing.import_bank_payments(conn, billing.iter_import_records(io.BytesIO(data), 'csv'))
+            conn.close()
+            print(f"{'reconcile':<10}{report['seconds'] / args.lines * 1000:>8.3f} ms/line     "
+                  f"{report['seconds']:>8.1f}s for {report['rows']} lines "
+                  f"({report['payments']} payments, {report['error_count']} rejected)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""
+Latency and throughput of every route over a synthetic dataset, as JSON.
+
+Builds (or reuses, with --db) a database filled by datagen.py, then drives
+each scenario twice: sequentially through Flask's test client, which
+isolates application time, and through a threaded WSGI server hit by
+--threads concurrent HTTP clients, which adds sockets, the server's thread
+per request and contention on the SQLite write lock. Per scenario it records
+request count, errors, throughput and mean/p50/p95/p99/max latency in ms.
+
+The JSON written to --out carries the commit, Python/SQLite versions and
+dataset size alongside the numbers; pass an earlier file to --compare to
+print the p50/p95/throughput change for every scenario.
+
+Usage:
+    python benchmarks/bench_suite.py [--invoices 20000] [--db /tmp/bench-1m.db]
+        [--mode client,wsgi] [--iterations 200] [--threads 8] [--seconds 3]
+        [--routes dashboard|api] [--no-writes] [--out results.json] [--compare baseline.json]
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timezone
+from urllib.parse import urlencode
+
+WORKDIR = tempfile.mkdtemp(prefix='nexus-bench-')
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+INVOICE_FORM = {
+    'customer_name': 'Load Test Client', 'customer_email': 'load@example.com',
+    'date': '2024-01-01', 'due_date': '2024-01-31', 'tax_rate': '10',
+    'product_names[]': ['IT Consultation (Hourly)', 'Mechanical Keyboard'],
+    'quantities[]': ['1', '2'], 'prices[]': ['150', '75'],
+}
+
+# (name, method, path(rng, ctx), form). Writes run last so reads see the
+# generated dataset rather than what earlier scenarios added to it.
+SCENARIOS = [
+    ('dashboard', 'GET', lambda rng, ctx: '/', None),
+    ('dashboard_status', 'GET', lambda rng, ctx: '/?status=Pending', None),
+    ('dashboard_search_customer', 'GET', lambda rng, ctx: f"/?q={rng.choice(ctx['customer_terms'])}", None),
+    ('dashboard_search_number', 'GET', lambda rng, ctx: f"/?q=INV-{rng.randint(1, ctx['max_id'])}", None),
+    ('products', 'GET', lambda rng, ctx: '/products', None),
+    ('create_invoice', 'GET', lambda rng, ctx: '/create_invoice', None),
+    ('view_invoice', 'GET', lambda rng, ctx: f"/invoice/{rng.randint(1, ctx['max_id'])}", None),
+    ('invoice_pdf', 'GET', lambda rng, ctx: f"/invoice/{rng.randint(1, ctx['max_id'])}/pdf", None),
+    ('reports', 'GET', lambda rng, ctx: '/reports', None),
+    ('export_csv_month', 'GET', lambda rng, ctx: f"/export/invoices.csv?start={ctx['month_start']}&end={ctx['last_date']}", None),
+    ('api_invoices', 'GET', lambda rng, ctx: '/api/v1/invoices', None),
+    ('api_invoices_status', 'GET', lambda rng, ctx: '/api/v1/invoices?status=Overdue', None),
+    ('api_invoice', 'GET', lambda rng, ctx: f"/api/v1/invoices/{rng.randint(1, ctx['max_id'])}", None),
+    ('api_customers', 'GET', lambda rng, ctx: '/api/v1/customers', None),
+    ('api_customer_statement', 'GET', lambda rng, ctx: f"/api/v1/customers/{rng.randint(1, ctx['max_customer_id'])}", None),
+    ('api_customer_credit', 'GET', lambda rng, ctx: f"/api/v1/customers/{rng.randint(1, ctx['max_customer_id'])}/credit?amount=500", None),
+    ('api_products', 'GET', lambda rng, ctx: '/api/v1/products', None),
+    ('api_product_lookup', 'GET', lambda rng, ctx: f"/api/v1/products/lookup?q={rng.choice(ctx['product_terms'])}", None),
+    ('api_report_revenue', 'GET', lambda rng, ctx: '/api/v1/reports/revenue', None),
+    ('api_report_customers', 'GET', lambda rng, ctx: '/api/v1/reports/customers', None),
+    ('api_report_products', 'GET', lambda rng, ctx: '/api/v1/reports/products', None),
+    ('api_report_aging', 'GET', lambda rng, ctx: '/api/v1/reports/aging', None),
+    ('api_report_adhoc', 'GET', lambda rng, ctx: f"/api/v1/reports/adhoc?start={ctx['month_start']}&end={ctx['last_date']}", None),
+    ('metrics', 'GET', lambda rng, ctx: '/metrics', None),
+    ('save_invoice', 'POST', lambda rng, ctx: '/save_invoice', INVOICE_FORM),
+    ('update_status', 'POST', lambda rng, ctx: f"/update_status/{rng.randint(1, ctx['max_id'])}/{rng.choice(('Paid', 'Pending'))}", {}),
+]
+OK_STATUSES = (200, 302)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies, errors, seconds):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / seconds, 1) if seconds else 0.0,
+        'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'p50': round(percentile(latencies, 50), 3),
+        'p95': round(percentile(latencies, 95), 3),
+        'p99': round(percentile(latencies, 99), 3),
+        'max': round(max(latencies, default=0.0), 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dataset_context(conn):
+    """Bounds and search terms the scenarios draw their parameters from."""
+    counts = conn.execute('''SELECT (SELECT count(*) FROM invoices), (SELECT count(*) FROM invoice_items),
+                                    (SELECT count(*) FROM products), (SELECT IFNULL(max(id), 1) FROM invoices),
+                                    (SELECT max(date) FROM invoices), (SELECT IFNULL(max(id), 1) FROM customers)''').fetchone()
+    last_date = date.fromisoformat(counts[4] or date.today().isoformat())
+    customers = [row[0].split()[0] for row in
+                 conn.execute('SELECT DISTINCT customer_name FROM invoices LIMIT 50')] or ['Client']
+    products = [row[0].split()[0] for row in
+                conn.execute('SELECT name FROM products ORDER BY id LIMIT 50')] or ['Laptop']
+    return {
+        'invoices': counts[0], 'lines': counts[1], 'products': counts[2], 'max_id': counts[3],
+        'max_customer_id': counts[5],
+        'last_date': last_date.isoformat(), 'month_start': last_date.replace(day=1).isoformat(),
+        'customer_terms': sorted(set(customers)), 'product_terms': sorted(set(products)),
+    }
+
+
+def run_client(billing, scenario, ctx, iterations, seed):
+    """Sequential requests through the test client (no sockets, no threads)."""
+    name, method, path, form = scenario
+    rng = random.Random(seed)
+    client = billing.app.test_client()
+    headers = {'Accept-Encoding': 'gzip'}
+    client.open(path(rng, ctx), method=method, data=form, headers=headers)  # warm-up
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = client.open(path(rng, ctx), method=method, data=form, headers=headers)
+        response.get_data()
+        latencies.append((time.perf_counter() - start) * 1000)
+        errors += response.status_code not in OK_STATUSES
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def run_wsgi(port, scenario, ctx, threads, seconds, seed):
+    """`threads` HTTP clients hammering the threaded server for `seconds`."""
+    name, method, path, form = scenario
+    body = None
+    headers = {'Accept-Encoding': 'gzip'}
+    if form is not None:
+        body = urlencode(form, doseq=True)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    latencies, errors = [], []
+
+    def client(worker_seed, deadline):
+        rng = random.Random(worker_seed)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            try:
+                conn.request(method, path(rng, ctx), body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status in OK_STATUSES
+            except OSError:
+                ok = False
+            finally:
+                conn.close()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if not ok:
+                errors.append(1)
+
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(seed + i, deadline)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return summarize(latencies, len(errors), time.perf_counter() - started)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({(baseline['meta'].get('commit') or '?')[:10]})")
+    print(f"{'mode':<8}{'scenario':<28}{'p50':>10}{'p95':>10}{'req/s':>10}")
+    for mode, scenarios in results.items():
+        for name, r in scenarios.items():
+            old = baseline['results'].get(mode, {}).get(name)
+            if not old:
+                continue
+            change = [(r[k] - old[k]) / old[k] * 100 if old[k] else 0.0 for k in ('p50', 'p95', 'rps')]
+            print(f"{mode:<8}{name:<28}{change[0]:>+9.1f}%{change[1]:>+9.1f}%{change[2]:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', help='reuse this database if it has invoices, otherwise generate into it')
+    parser.add_argument('--invoices', type=int, default=20_000)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--customers', type=int, default=2_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mode', default='client,wsgi')
+    parser.add_argument('--iterations', type=int, default=200, help='test client requests per scenario')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent HTTP clients per scenario')
+    parser.add_argument('--seconds', type=float, default=3.0, help='WSGI load duration per scenario')
+    parser.add_argument('--routes', help='regex selecting scenarios by name')
+    parser.add_argument('--no-writes', action='store_true', help='skip the POST scenarios')
+    parser.add_argument('--out', help='JSON results file (default: bench-<commit>.json)')
+    parser.add_argument('--compare', help='earlier JSON results to diff against')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(WORKDIR, 'bench.db')
+    os.environ['BILLING_DB'] = db_path
+    os.environ.setdefault('BILLING_PDF_CACHE', os.path.join(WORKDIR, 'pdf_cache'))
+    os.environ.setdefault('BILLING_JOB_SPOOL', os.path.join(WORKDIR, 'job_spool'))
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import app as billing
+    import datagen
+
+    conn = billing.get_db_connection()
+    try:
+        ctx = dataset_context(conn)
+        generated = None
+        if not ctx['invoices']:
+            generated = datagen.generate(conn, args.invoices, args.products, args.customers, seed=args.seed)
+            ctx = dataset_context(conn)
+    finally:
+        conn.close()
+    print(f"dataset: {ctx['invoices']:,} invoices, {ctx['lines']:,} lines, {ctx['products']:,} products"
+          + (f" (generated in {generated['seconds']}s)" if generated else ' (reused)') + f" -> {db_path}")
+
+    selected = [s for s in SCENARIOS
+                if (not args.routes or re.search(args.routes, s[0])) and not (args.no_writes and s[1] == 'POST')]
+    modes = [m.strip() for m in args.mode.split(',') if m.strip()]
+    results = {}
+
+    print(f"{'mode':<8}{'scenario':<28}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}")
+    server = None
+    for mode in modes:
+        if mode == 'wsgi':
+            from werkzeug.serving import make_server
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no access log per request
+            server = make_server('127.0.0.1', 0, billing.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        for n, scenario in enumerate(selected):
+            if mode == 'client':
+                r = run_client(billing, scenario, ctx, args.iterations, args.seed + n)
+            elif mode == 'wsgi':
+                r = run_wsgi(server.server_port, scenario, ctx, args.threads, args.seconds, args.seed + n)
+            else:
+                parser.error(f'unknown mode {mode!r} (use client and/or wsgi)')
+            results.setdefault(mode, {})[scenario[0]] = r
+            print(f"{mode:<8}{scenario[0]:<28}{r['rps']:>9.0f}{r['p50']:>9.2f}{r['p95']:>9.2f}"
+                  f"{r['p99']:>9.2f}{r['max']:>9.2f}{r['errors']:>8}")
+    if server:
+        server.shutdown()
+
+    commit = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'dataset': {k: ctx[k] for k in ('invoices', 'lines', 'products')},
+            'settings': {'iterations': args.iterations, 'threads': args.threads,
+                         'seconds': args.seconds, 'seed': args.seed},
+        },
+        'results': results,
+    }
+    out = args.out or f"bench-{(commit or 'unknown')[:10]}.json"
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results -> {out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Render latency per route: legacy string splicing vs the template registry.
+
+The legacy path rebuilt the base+page source on every call and handed it to
+render_template_string, so Jinja recompiled it each time. The registry path
+renders precompiled templates through the DictLoader.
+
+Usage:
+    python benchmarks/bench_templates.py [--iterations 300]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('BILLING_DB', os.path.join(
+    tempfile.mkdtemp(prefix='nexus-bench-'), 'bench.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template_string  # noqa: E402
+
+import app as billing  # noqa: E402
+
+
+def legacy_render_with_base(template_name, **kwargs):
+    """The pre-registry helper: splice page into base and compile per call."""
+    kwargs['company'] = billing.COMPANY_INFO
+    final_html = billing.HTML_TEMPLATE.replace(
+        '{% block content %}{% endblock %}', billing.TEMPLATES[template_name])
+    final_html = final_html.replace('{% extends "base.html" %}', '')
+    return render_template_string(final_html, **kwargs)
+
+
+def time_route(client, path, iterations):
+    client.get(path)  # warm-up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=300)
+    args = parser.parse_args()
+
+    client = billing.app.test_client()
+    response = client.post('/save_invoice', data={
+        'customer_name': 'Bench Client', 'customer_email': 'bench@example.com',
+        'date': '2024-01-01', 'due_date': '2024-01-31',
+        'subtotal': '150', 'tax_rate': '10', 'tax_amount': '15', 'total_amount': '165',
+        'product_names[]': ['IT Consultation (Hourly)'], 'quantities[]': ['1'], 'prices[]': ['150'],
+    })
+    invoice_path = response.headers['Location']
+    routes = ['/', '/products', '/create_invoice', invoice_path]
+
+    registry_helper = billing.render_with_base
+    results = {}
+    for label, helper in (('legacy', legacy_render_with_base), ('registry', registry_helper)):
+        billing.render_with_base = helper
+        for path in routes:
+            results.setdefault(path, {})[label] = time_route(client, path, args.iterations)
+    billing.render_with_base = registry_helper
+
+    print(f"{'route':<20}{'legacy ms':>12}{'registry ms':>14}{'speedup':>10}")
+    for path in routes:
+        legacy, registry = results[path]['legacy'], results[path]['registry']
+        print(f"{path:<20}{legacy:>12.3f}{registry:>14.3f}{legacy / registry:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Synthetic dataset generator for benchmarks.
+
+Fills a billing database with a catalog of products and N invoices whose
+line items, customers, dates and statuses follow a fixed seed, so two runs
+with the same arguments produce the same data. Invoices go through
+insert_invoice in write transactions of --batch-size, exactly like the bulk
+importer, so every trigger-maintained total, rollup and search row is
+populated the way production writes populate it.
+
+Usage:
+    python benchmarks/datagen.py --db /tmp/bench.db [--invoices 100000] [--products 500]
+        [--customers 5000] [--max-lines 8] [--days 730] [--status-mix Paid=60,Pending=25,Overdue=10,Draft=5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+DEFAULT_STATUS_MIX = {'Paid': 60, 'Pending': 25, 'Overdue': 10, 'Draft': 5}
+TAX_RATES = (0, 5, 7.5, 10, 18)
+CATEGORIES = {
+    'Hardware': ('HW', ('Laptop', 'Workstation', 'Monitor', 'Docking Station', 'Server', 'Tablet'), (150, 3500)),
+    'Accessories': ('ACC', ('Mouse', 'Keyboard', 'Headset', 'Webcam', 'Cable Kit', 'Stand'), (10, 250)),
+    'Software': ('SW', ('License (Annual)', 'Subscription', 'Seat Pack', 'Support Plan'), (50, 2500)),
+    'Services': ('SVC', ('Consultation (Hourly)', 'Installation', 'Training Day', 'Audit', 'Migration'), (80, 1500)),
+}
+ADJECTIVES = ('Pro', 'Enterprise', 'Compact', 'Wireless', 'Ergonomic', 'Premium', 'Basic', 'Ultra', 'Secure', 'Cloud')
+FIRST_WORDS = ('Acme', 'Globex', 'Initech', 'Umbrella', 'Stark', 'Wayne', 'Hooli', 'Vandelay', 'Soylent', 'Tyrell',
+               'Cyberdyne', 'Wonka', 'Oscorp', 'Aperture', 'Monarch', 'Gringotts', 'Nakatomi', 'Pied Piper')
+SECOND_WORDS = ('Industries', 'Logistics', 'Labs', 'Holdings', 'Systems', 'Foods', 'Consulting', 'Media',
+                'Dynamics', 'Partners', 'Retail', 'Energy')
+
+
+def parse_status_mix(text):
+    """'Paid=60,Pending=25' -> {'Paid': 60, 'Pending': 25}."""
+    mix = {}
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        status, _, weight = part.partition('=')
+        mix[status.strip()] = float(weight)
+    if not mix or any(w < 0 for w in mix.values()) or not sum(mix.values()):
+        raise ValueError(f'Invalid status mix: {text!r}')
+    return mix
+
+
+def make_products(rng, count):
+    """(name, sku, category, price) tuples with unique SKUs."""
+    products = []
+    categories = list(CATEGORIES.items())
+    for n in range(1, count + 1):
+        category, (prefix, nouns, (low, high)) = categories[n % len(categories)]
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(nouns)} {n}'
+        price = round(rng.uniform(low, high), 2)
+        products.append((name, f'{prefix}-{n:05d}', category, price))
+    return products
+
+
+def make_customers(rng, count):
+    customers = []
+    for n in range(1, count + 1):
+        name = f'{rng.choice(FIRST_WORDS)} {rng.choice(SECOND_WORDS)} {n}'
+        email = f"billing{n}@{name.split()[0].lower()}.example.com"
+        customers.append((name, email))
+    return customers
+
+
+def generate(conn, invoices=10_000, products=200, customers=2_000, max_lines=8, days=730,
+             status_mix=None, seed=42, batch_size=1_000, end=None, progress=None):
+    """
+    Add `products` catalog rows and `invoices` invoices (1..max_lines lines
+    each, dated over the `days` days up to `end`) to an already migrated
+    database. A small share of customers receives most invoices, as in real
+    ledgers. Returns a summary dict.
+    """
+    import app as billing
+
+    rng = random.Random(seed)
+    status_mix = status_mix or DEFAULT_STATUS_MIX
+    statuses, weights = list(status_mix), list(status_mix.values())
+    end = end or date.today()
+    started = time.perf_counter()
+
+    catalog = make_products(rng, products)
+    with billing.write_transaction(conn):
+        conn.executemany('INSERT INTO products (name, sku, category, price) VALUES (?, ?, ?, ?)', catalog)
+    people = make_customers(rng, customers)
+
+    written = lines_written = 0
+    while written < invoices:
+        batch = []
+        for _ in range(min(batch_size, invoices - written)):
+            # Pareto-ish: a few customers account for most of the volume
+            name, email = people[min(int(rng.paretovariate(1.2)) - 1, len(people) - 1)
+                                 if rng.random() < 0.5 else rng.randrange(len(people))]
+            issued = end - timedelta(days=rng.randrange(days))
+            lines = []
+            for _ in range(rng.randint(1, max_lines)):
+                product_name, _, _, price = catalog[rng.randrange(len(catalog))]
+                qty = rng.choices((1, 2, 3, 5, 10), weights=(50, 20, 12, 10, 8))[0]
+                cents = billing.to_cents(price)
+                lines.append((product_name, qty, cents, qty * cents))
+            status = rng.choices(statuses, weights=weights)[0]
+            batch.append((name, email, issued.isoformat(), (issued + timedelta(days=30)).isoformat(),
+                          rng.choice(TAX_RATES), lines, status))
+        with billing.write_transaction(conn):
+            ids = [billing.insert_invoice(conn, *args, index_items=False) for args in batch]
+            billing.refresh_invoice_search_items(conn, ids)
+        written += len(batch)
+        lines_written += sum(len(args[5]) for args in batch)
+        if progress:
+            progress(written, invoices)
+
+    seconds = time.perf_counter() - started
+    return {'products': products, 'customers': customers, 'invoices': written, 'lines': lines_written,
+            'seconds': round(seconds, 2), 'invoices_per_second': round(written / seconds) if seconds else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', required=True, help='database file (created and migrated if missing)')
+    parser.add_argument('--invoices', type=int, default=100_000)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--customers', type=int, default=5_000)
+    parser.add_argument('--max-lines', type=int, default=8)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--status-mix', type=parse_status_mix, default=DEFAULT_STATUS_MIX)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=1_000)
+    args = parser.parse_args()
+
+    os.environ['BILLING_DB'] = args.db
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app as billing
+
+    def progress(done, total):
+        print(f'\r{done:,}/{total:,} invoices', end='', file=sys.stderr, flush=True)
+
+    conn = billing.get_db_connection()
+    try:
+        summary = generate(conn, args.invoices, args.products, args.customers, args.max_lines, args.days,
+                           args.status_mix, args.seed, args.batch_size, progress=progress)
+    finally:
+        conn.close()
+    print(file=sys.stderr)
+    print(f"{summary['invoices']:,} invoices / {summary['lines']:,} lines / {summary['products']:,} products "
+          f"in {summary['seconds']}s ({summary['invoices_per_second']:,} invoices/s) -> {args.db}")
+
+
+if __name__ == '__main__':
+    main()